@@ -0,0 +1,77 @@
+# Simulates many concurrent users against AsyncManager and reports p50/p99
+# latency per operation.
+#
+#   python benchmarks/bench_async.py --users 100 --ops 50
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from comic_async import AsyncManager
+
+
+async def build(manager, users, comics):
+    await manager.create_comicdb()
+    await manager.add_volumes_bulk(range(1, 4))
+    await manager.add_publishers_bulk(['Marvel', 'DC', 'Image'])
+    await manager.add_series_bulk((f'Series {n}', n % 3 + 1, n % 3 + 1) for n in range(200))
+    await manager.add_comics_bulk((n % 200 + 1, n // 200 + 1, 3.99) for n in range(comics))
+    for n in range(users):
+        await manager.add_user(f'user{n}', 'secret')
+    # Each simulated user signs in the way a real client would
+    return await asyncio.gather(*(manager.login(f'user{n}', 'secret') for n in range(users)))
+
+
+async def simulate_user(manager, session, ops, comics, latencies, rng):
+    operations = [
+        ('show_user_comics_page', lambda: manager.show_user_comics_page(session)),
+        ('show_comics_page', lambda: manager.show_comics_page(rng.randint(0, comics - 50))),
+        ('search_comics', lambda: manager.search_comics(f'series {rng.randint(0, 199)}')),
+        ('collection_value', lambda: manager.collection_value(session)),
+        ('add_to_collection', lambda: manager.add_to_collection(session, rng.randint(1, comics))),
+    ]
+    for _ in range(ops):
+        name, operation = rng.choice(operations)
+        start = time.perf_counter()
+        await operation()
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='AsyncManager load benchmark')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--ops', type=int, default=50, help='operations per user')
+    parser.add_argument('--comics', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        async with AsyncManager(os.path.join(tmp, 'bench.db'), args.readers) as manager:
+            sessions = await build(manager, args.users, args.comics)
+            latencies = {}
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                simulate_user(manager, session, args.ops, args.comics, latencies, random.Random(session.user_id))
+                for session in sessions
+            ))
+            elapsed = time.perf_counter() - start
+
+    total = [value for values in latencies.values() for value in values]
+    print(f'{args.users} users, {len(total)} ops in {elapsed:.2f}s ({len(total) / elapsed:.0f} ops/sec)')
+    print(f'{"operation":<24}{"count":>8}{"p50 ms":>10}{"p99 ms":>10}')
+    for name, values in sorted(latencies.items()) + [('all', total)]:
+        print(f'{name:<24}{len(values):>8}{percentile(values, 0.5) * 1000:>10.2f}{percentile(values, 0.99) * 1000:>10.2f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+# Compares ops/sec of the Manager CRUD methods when every call opens its own
+# sqlite3 connection (the old behaviour) against the persistent per-thread
+# connection that Manager keeps now.
+#
+#   python benchmarks/bench_connections.py --ops 2000
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from comic_manager import Manager
+
+
+class ConnectPerCallManager(Manager):
+    # A fresh connection per method call, configured with the same pragmas as
+    # the persistent one; it is released when the method returns and the last
+    # reference goes away, like the old conn.close()
+    def connect(self):
+        return self._open()
+
+
+def seed(manager):
+    manager.create_comicdb()
+    manager.add_volume(1)
+    manager.add_publisher('Marvel')
+    manager.add_series('Spider-Man', 1, 1)
+    manager.add_comic(1, 1, 2.99)
+    manager.add_user('reader', 'secret')
+    manager.user_id = 1
+
+
+def operations(manager):
+    return [
+        ('add_comic', lambda i: manager.add_comic(1, i, 2.99)),
+        ('update_comic', lambda i: manager.update_comic(1, current_price=i)),
+        ('add_to_collection', lambda i: manager.add_to_collection(1)),
+        ('get_series', lambda i: manager.get_series(1)),
+        ('show_all_series', lambda i: manager.show_all_series()),
+        ('show_all_publishers', lambda i: manager.show_all_publishers()),
+        ('show_user_comics', lambda i: manager.show_user_comics()),
+    ]
+
+
+def run(manager_class, ops):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        with manager_class(os.path.join(tmp, 'bench.db')) as manager:
+            seed(manager)
+            for name, op in operations(manager):
+                start = time.perf_counter()
+                for i in range(ops):
+                    op(i)
+                results[name] = ops / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Connection reuse benchmark')
+    parser.add_argument('--ops', type=int, default=1000, help='calls per method')
+    args = parser.parse_args()
+
+    before = run(ConnectPerCallManager, args.ops)
+    after = run(Manager, args.ops)
+
+    print(f'{"method":<22}{"per-call ops/s":>16}{"pooled ops/s":>16}{"speedup":>10}')
+    for name in before:
+        print(f'{name:<22}{before[name]:>16.0f}{after[name]:>16.0f}{after[name] / before[name]:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Measures write throughput of add_to_collection from many threads under each
+# pragma profile, with and without group commit.
+#
+#   python benchmarks/bench_group_commit.py --threads 16 --writes 200
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from comic_manager import Manager
+
+MODES = [
+    ('legacy', False),
+    ('legacy', True),
+    ('durable', False),
+    ('durable', True),
+    ('default', False),
+    ('default', True),
+]
+
+
+def run(profile, group_commit, threads, writes):
+    with tempfile.TemporaryDirectory() as tmp, Manager(os.path.join(tmp, 'bench.db'), profile) as manager:
+        manager.create_comicdb()
+        manager.add_volume(1)
+        manager.add_publisher('Marvel')
+        manager.add_series('Spider-Man', 1, 1)
+        manager.add_comics_bulk((1, n, 3.99) for n in range(1, 101))
+        # One collector per thread; collection rows need a real user
+        for n in range(1, threads + 1):
+            manager.add_user(f'writer{n}', 'secret')
+        user_ids = [row[0] for row in manager.connect().execute("SELECT user_id FROM user WHERE username LIKE 'writer%'")]
+        if group_commit:
+            manager.enable_group_commit()
+
+        def writer(user_id):
+            for n in range(writes):
+                manager.add_to_collection(n % 100 + 1, user_id=user_id)
+
+        workers = [threading.Thread(target=writer, args=(user_id,)) for user_id in user_ids]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        batches = manager._write_queue.batches if group_commit else threads * writes
+        return threads * writes / elapsed, batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Group commit benchmark')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=200, help='writes per thread')
+    args = parser.parse_args()
+
+    print(f'{"profile":<10}{"group commit":>14}{"writes/sec":>12}{"commits":>10}')
+    for profile, group_commit in MODES:
+        rate, commits = run(profile, group_commit, args.threads, args.writes)
+        print(f'{profile:<10}{str(group_commit):>14}{rate:>12.0f}{commits:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Measures login throughput at several scrypt work factors, with several
+# threads logging in at once, and compares it to session token lookups.
+#
+#   python benchmarks/bench_login.py --threads 4 --logins 40 --cost 2**12,8,1 --cost 2**14,8,1
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from comic_manager import Manager
+
+
+def parse_int(value):
+    # Accepts powers written as 2**14
+    base, _, exponent = value.partition('**')
+    return int(base) ** int(exponent) if exponent else int(base)
+
+
+def parse_cost(value):
+    n, r, p = (parse_int(part) for part in value.split(','))
+    return {'n': n, 'r': r, 'p': p}
+
+
+def timed(threads, count, func):
+    def worker():
+        for _ in range(count // threads):
+            func()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return count // threads * threads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--cost', type=parse_cost, action='append', help='scrypt n,r,p, may be repeated')
+    args = parser.parse_args()
+    costs = args.cost or [parse_cost(cost) for cost in ('2**12,8,1', '2**14,8,1', '2**15,8,1', '2**16,8,1')]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for cost in costs:
+            with Manager(os.path.join(tmp, f'login-{cost["n"]}.db'), password_cost=cost) as manager:
+                manager.create_comicdb()
+                manager.add_user('reader', 'secret')
+
+                rate = timed(args.threads, args.logins, lambda: manager.authenticate('reader', 'secret'))
+                print(f'scrypt n=2**{cost["n"].bit_length() - 1} r={cost["r"]} p={cost["p"]}: '
+                      f'{rate:8.1f} logins/s ({1000 * args.threads / rate:6.1f} ms each)')
+
+        with Manager(os.path.join(tmp, 'tokens.db')) as manager:
+            manager.create_comicdb()
+            manager.add_user('reader', 'secret')
+            token, user = manager.login_token('reader', 'secret')
+            rate = timed(args.threads, 200000, lambda: manager.token_user(token))
+            print(f'session token lookups: {rate:10.0f} /s')
+
+
+if __name__ == '__main__':
+    main()
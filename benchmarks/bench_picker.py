@@ -0,0 +1,66 @@
+# Times rendering a menu of N comics with the old list.index() numbering
+# against comic_menu.Picker, which numbers rows with enumerate and only
+# renders one page at a time.
+#
+#   python benchmarks/bench_picker.py --rows 10000 100000
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from comic_menu import Picker
+
+
+def describe_comic(comic):
+    return f'{comic[1]} #{comic[2]}'
+
+
+def legacy_render(table):
+    # The loop every CLI menu used before the Picker
+    return [f'{table.index(comic) + 1}.) {comic[1]} #{comic[2]}' for comic in table]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def page_through(picker):
+    # Visit every page the way a user pressing 'n' would
+    after, offset = 0, 0
+    while True:
+        entries, has_next = picker.load_page(after)
+        picker.render([row for key, row in entries], offset)
+        if not has_next:
+            break
+        after = entries[-1][0]
+        offset += len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Menu rendering benchmark')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--legacy-limit', type=int, default=20000,
+                        help='skip the quadratic renderer above this many rows')
+    args = parser.parse_args()
+
+    print(f'{"rows":>8}{"legacy":>12}{"full render":>14}{"first page":>12}{"all pages":>12}{"filtered":>12}')
+    for count in args.rows:
+        table = [(comic_id, f'Series {comic_id % 500}', comic_id % 100) for comic_id in range(1, count + 1)]
+        picker = Picker.from_rows(table, describe_comic)
+
+        legacy = f'{timed(legacy_render, table):.3f}s' if count <= args.legacy_limit else 'skipped'
+        full = timed(picker.render, table)
+        first = timed(picker.load_page, 0)
+        pages = timed(page_through, picker)
+        picker.filter_text = 'series 42'
+        filtered = timed(page_through, picker)
+
+        print(f'{count:>8}{legacy:>12}{full:>13.3f}s{first:>11.5f}s{pages:>11.3f}s{filtered:>11.3f}s')
+
+
+if __name__ == '__main__':
+    main()
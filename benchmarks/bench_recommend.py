@@ -0,0 +1,133 @@
+# Times the "collectors also own" Recommender: the full build, top-10
+# recommendations per user, and the refresh that follows add_to_collection().
+# Each synthetic collector favours one publisher's series and owns runs of
+# issues in them, so owners cluster the way real collections do.
+#
+#   python benchmarks/bench_recommend.py --users 50000 --rows 5000000
+#
+# --db keeps the generated database and reuses it on later runs, as filling
+# 5M collection rows takes a while.
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from catalogue import generate
+from comic_manager import Manager
+from comic_recommend import Recommender
+
+INSERT_CHUNK = 100000
+
+
+def fill(manager, args, rng):
+    first_user = generate(
+        manager, publishers=args.publishers, volumes=10, series=args.series, issues=args.issues,
+        users=args.users, collection=0,
+    )
+    conn = manager.connect()
+    by_publisher = {}
+    for series_id, publisher_id in conn.execute('SELECT series_id, publisher_id FROM series'):
+        by_publisher.setdefault(publisher_id, []).append(series_id)
+    issues = {}
+    for series_id, comic_id in conn.execute('SELECT series_id, comic_id FROM comic ORDER BY series_id, issue_num'):
+        issues.setdefault(series_id, []).append(comic_id)
+    all_series = list(issues)
+    publishers = list(by_publisher)
+
+    rows = []
+    per_user = args.rows // args.users
+    for user_id in range(first_user, first_user + args.users):
+        favourites = by_publisher[rng.choice(publishers)]
+        count = rng.randint(5, 40)
+        # Mostly the favourite publisher's series, with a few from anywhere
+        chosen = {
+            rng.choice(favourites) if rng.random() < 0.8 else rng.choice(all_series) for _ in range(count)
+        }
+        owned = set()
+        for series_id in chosen:
+            run = issues.get(series_id)
+            if not run:
+                continue
+            length = min(len(run), max(1, per_user // len(chosen)))
+            start = rng.randrange(len(run) - length + 1)
+            owned.update(run[start:start + length])
+        rows.extend((user_id, comic_id) for comic_id in owned)
+        if len(rows) >= INSERT_CHUNK:
+            conn.executemany('INSERT INTO collection (user_id, comic_id) VALUES (?, ?)', rows)
+            conn.commit()
+            rows = []
+    conn.executemany('INSERT INTO collection (user_id, comic_id) VALUES (?, ?)', rows)
+    conn.commit()
+    return first_user
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f'{name:<28}{statistics.median(samples) * 1000:>10.2f} ms median {p95 * 1000:>10.2f} ms p95')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recommender build and lookup times')
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--rows', type=int, default=5000000, help='collection rows, roughly')
+    parser.add_argument('--publishers', type=int, default=100)
+    parser.add_argument('--series', type=int, default=5000)
+    parser.add_argument('--issues', type=int, default=250000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--db', help='keep the generated database here, or reuse it')
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'recommend.db')
+        exists = os.path.exists(path)
+        with Manager(path) as manager:
+            if exists:
+                manager.create_comicdb()
+            else:
+                start = time.perf_counter()
+                fill(manager, args, rng)
+                print(f'generated in {time.perf_counter() - start:.1f}s')
+            conn = manager.connect()
+            rows = conn.execute('SELECT COUNT(*) FROM collection').fetchone()[0]
+            users = [row[0] for row in conn.execute('SELECT DISTINCT user_id FROM collection')]
+            comics = conn.execute('SELECT MAX(comic_id) FROM comic').fetchone()[0]
+
+            recommender = Recommender(manager)
+            start = time.perf_counter()
+            recommender.build()
+            built = time.perf_counter() - start
+            arrays = sum(array.nbytes for array in (
+                recommender.indptr, recommender.indices, recommender.data,
+                recommender.user_ids, recommender.user_indptr, recommender.user_series, recommender.comic_series,
+            ))
+            print(f'{len(users)} collectors, {rows} collection rows, {len(recommender.series_ids)} series')
+            print(f'built in {built:.2f}s, {len(recommender.indices)} series pairs, {arrays / 1024 / 1024:.1f} MB of arrays')
+
+            samples = []
+            for user_id in rng.sample(users, min(args.queries, len(users))):
+                start = time.perf_counter()
+                recommender.recommend(user_id)
+                samples.append(time.perf_counter() - start)
+            report('recommend', samples)
+
+            # Each add is picked up from the change log by the next recommend()
+            samples = []
+            for _ in range(args.queries):
+                user_id = rng.choice(users)
+                manager.add_to_collection(rng.randint(1, comics), user_id=user_id)
+                start = time.perf_counter()
+                recommender.recommend(user_id)
+                samples.append(time.perf_counter() - start)
+            report('add, then recommend', samples)
+
+
+if __name__ == '__main__':
+    main()
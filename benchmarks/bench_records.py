@@ -0,0 +1,69 @@
+# Measures the memory and time of listing every comic as the plain tuples
+# show_all_comics() used to return, as Comic records, and as Columns. Memory
+# is what the result keeps alive, from tracemalloc, scaled to 1M rows.
+#
+#   python benchmarks/bench_records.py --issues 1000000
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from catalogue import generate
+from comic_manager import Manager
+
+# The query show_all_comics() runs
+SQL = '''
+    SELECT c.comic_id, s.name, c.issue_num
+    FROM comic c
+    INNER JOIN series s ON s.series_id = c.series_id
+'''
+
+
+def measure(load):
+    # (seconds, retained bytes, peak bytes) for one call of load; timed
+    # without tracemalloc, which slows allocation down
+    gc.collect()
+    start = time.perf_counter()
+    result = load()
+    seconds = time.perf_counter() - start
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, retained, peak, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Result set memory per 1M rows')
+    parser.add_argument('--issues', type=int, default=1000000)
+    parser.add_argument('--series', type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with Manager(os.path.join(tmp, 'records.db')) as manager:
+            generate(manager, publishers=50, volumes=5, series=args.series, issues=args.issues, users=1, collection=0)
+            conn = manager.connect()
+
+            loaders = [
+                ('tuples', lambda: conn.execute(SQL).fetchall()),
+                ('records', lambda: manager.show_all_comics()),
+                ('columnar', lambda: manager.show_all_comics(columnar=True)),
+            ]
+            print(f'{"result":<10}{"seconds":>10}{"MB/1M rows":>12}{"peak MB/1M":>12}')
+            for name, load in loaders:
+                seconds, retained, peak, rows = measure(load)
+                scale = 1000000 / rows / 1024 / 1024
+                print(f'{name:<10}{seconds:>10.3f}{retained * scale:>12.1f}{peak * scale:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
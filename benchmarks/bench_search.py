@@ -0,0 +1,63 @@
+# Builds a synthetic catalogue and times Manager.search_comics queries. Every
+# match is ranked, so matches shows what each query costs.
+#
+#   python benchmarks/bench_search.py --issues 500000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from comic_manager import Manager
+
+WORDS = ['amazing', 'spider', 'man', 'dark', 'knight', 'uncanny', 'x', 'men', 'saga', 'walking',
+         'dead', 'hulk', 'thor', 'wonder', 'woman', 'flash', 'lantern', 'green', 'iron', 'fist']
+QUERIES = ['spider', 'amazing spider 12', 'venom', 'dark knight', 'publisher 7', 'wond', '250']
+
+
+def build(manager, issues, series_count):
+    rng = random.Random(1)
+    manager.create_comicdb()
+    manager.add_volumes_bulk(range(1, 6))
+    manager.add_publishers_bulk(f'Publisher {n}' for n in range(1, 51))
+    manager.add_series_bulk(
+        (' '.join(rng.sample(WORDS, 2)).title(), rng.randint(1, 5), rng.randint(1, 50))
+        for n in range(series_count)
+    )
+    manager.add_comics_bulk(
+        (rng.randint(1, series_count), n % 600 + 1, 3.99, None,
+         'First appearance of Venom' if n % 5000 == 0 else None)
+        for n in range(issues)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full-text search benchmark')
+    parser.add_argument('--issues', type=int, default=500000)
+    parser.add_argument('--series', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, Manager(os.path.join(tmp, 'bench.db')) as manager:
+        start = time.perf_counter()
+        build(manager, args.issues, args.series)
+        print(f'built {args.issues} issues in {time.perf_counter() - start:.1f}s')
+
+        conn = manager.connect()
+        print(f'{"query":<22}{"matches":>8}{"results":>8}{"ms/query":>10}')
+        for query in QUERIES:
+            results = manager.search_comics(query)
+            terms = ' '.join(f'"{word}"' if word.isdigit() else f'"{word}"*' for word in query.split())
+            matches = conn.execute('SELECT COUNT(*) FROM comic_search WHERE comic_search MATCH ?', (terms,)).fetchone()[0]
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                manager.search_comics(query)
+            elapsed = (time.perf_counter() - start) / args.repeat * 1000
+            print(f'{query:<22}{matches:>8}{len(results):>8}{elapsed:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Times find_similar() on a catalogue of synthetic series names against
+# scoring every name, the linear scan the trigram index replaces, at two
+# catalogue sizes. found is the share of lookups where find_similar() returned
+# a name as similar as the best the scan found.
+#
+#   python benchmarks/bench_similar.py --series 100000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from catalogue import generate
+from comic_manager import SIMILAR_THRESHOLD, Manager, _trigrams
+
+
+def misspell(rng, name):
+    # The name with one letter dropped, as a typed in near duplicate
+    index = rng.randrange(len(name))
+    return name[:index] + name[index + 1:]
+
+
+def scan(names, name):
+    # The best similarity of any name
+    trigrams = _trigrams(name)
+    best = 0.0
+    for other in names:
+        other_trigrams = _trigrams(other)
+        common = len(trigrams & other_trigrams)
+        best = max(best, common / (len(trigrams) + len(other_trigrams) - common))
+    return round(best, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='find_similar() against a full scan')
+    parser.add_argument('--series', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--scans', type=int, default=10, help='lookups also answered by a full scan')
+    parser.add_argument('--threshold', type=float, default=SIMILAR_THRESHOLD)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    print(f'{"names":>8}{"find_similar ms":>18}{"scan ms":>10}{"found":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (args.series // 10, args.series):
+            with Manager(os.path.join(tmp, f'similar{size}.db')) as manager:
+                generate(manager, publishers=50, volumes=5, series=size, issues=size, users=1, collection=0)
+                names = [series.name for series in manager.show_all_series()]
+                lookups = [misspell(rng, rng.choice(names)) for _ in range(args.lookups)]
+
+                start = time.perf_counter()
+                results = [manager.find_similar(name, args.threshold, 'series') for name in lookups]
+                indexed = (time.perf_counter() - start) / len(lookups)
+
+                start = time.perf_counter()
+                best = [scan(names, name) for name in lookups[:args.scans]]
+                scanned = (time.perf_counter() - start) / args.scans
+
+                found = sum(
+                    1 for matches, similarity in zip(results, best)
+                    if similarity < args.threshold or (matches and matches[0].similarity == similarity)
+                ) / args.scans
+                print(f'{size:>8}{indexed * 1000:>18.2f}{scanned * 1000:>10.1f}{found:>8.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# Synthetic catalogue generator shared by the benchmark suite. The same
+# sizes and seed always produce the same database.
+#
+#   python benchmarks/catalogue.py /tmp/synthetic.db --issues 1000000 --users 1000 --collection 500
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from comic_auth import hash_password
+from comic_manager import Manager
+
+WORDS = ['amazing', 'spider', 'man', 'dark', 'knight', 'uncanny', 'x', 'men', 'saga', 'walking',
+         'dead', 'hulk', 'thor', 'wonder', 'woman', 'flash', 'lantern', 'green', 'iron', 'fist']
+
+# Named catalogue sizes for --scale
+SCALES = {
+    'small': {'publishers': 20, 'volumes': 5, 'series': 500, 'issues': 20000, 'users': 50, 'collection': 100},
+    'medium': {'publishers': 100, 'volumes': 10, 'series': 5000, 'issues': 250000, 'users': 500, 'collection': 500},
+    'large': {'publishers': 300, 'volumes': 20, 'series': 20000, 'issues': 2000000, 'users': 2000, 'collection': 1000},
+}
+
+# Every synthetic user signs in with this password
+PASSWORD = 'secret'
+
+CHUNK = 50000
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def generate(manager, publishers, volumes, series, issues, users, collection, seed=1):
+    # Fills a fresh database through create_comicdb() and the bulk add_*
+    # methods. Users and collection rows have no bulk method, so they go in
+    # with executemany on the Manager's connection, sharing one password hash.
+    rng = random.Random(seed)
+    manager.create_comicdb()
+    manager.add_volumes_bulk(range(1, volumes + 1))
+    manager.add_publishers_bulk(f'Publisher {n}' for n in range(1, publishers + 1))
+    for chunk in _chunks(
+        (' '.join(rng.sample(WORDS, 2)).title() + f' {n}', rng.randint(1, volumes), rng.randint(1, publishers))
+        for n in range(series)
+    ):
+        manager.add_series_bulk(chunk)
+
+    for chunk in _chunks(
+        (rng.randint(1, series), n // series + 1, round(rng.uniform(1, 10), 2),
+         round(rng.uniform(1, 500), 2) if rng.random() < 0.3 else None)
+        for n in range(issues)
+    ):
+        manager.add_comics_bulk(chunk)
+
+    conn = manager.connect()
+    password = hash_password(PASSWORD, **manager.password_cost)
+    conn.executemany(
+        'INSERT INTO user (username, password, clearance_level) VALUES (?, ?, 1)',
+        ((f'user{n}', password) for n in range(1, users + 1)),
+    )
+    conn.commit()
+
+    first_user = conn.execute("SELECT MIN(user_id) FROM user WHERE username LIKE 'user%'").fetchone()[0] or 1
+    for chunk in _chunks(
+        (first_user + user, comic_id)
+        for user in range(users)
+        for comic_id in rng.sample(range(1, issues + 1), min(collection, issues))
+    ):
+        conn.executemany('INSERT INTO collection (user_id, comic_id) VALUES (?, ?)', chunk)
+        conn.commit()
+    return first_user
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic catalogue to a new database')
+    parser.add_argument('db')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--seed', type=int, default=1)
+    for name in SCALES['small']:
+        parser.add_argument(f'--{name}', type=int, help=f'overrides the scale\'s {name} count')
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    sizes.update({name: getattr(args, name) for name in sizes if getattr(args, name) is not None})
+    if os.path.exists(args.db):
+        parser.error(f'{args.db} already exists')
+
+    start = time.perf_counter()
+    with Manager(args.db) as manager:
+        generate(manager, seed=args.seed, **sizes)
+    print(f'generated {sizes} in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Load tests the JSON API server: starts it on a temporary copy of the bundled
+# comicdb.db and hits the list endpoints from keep-alive client threads,
+# reporting requests/sec with and without ETag revalidation.
+#
+#   python benchmarks/load_server.py --clients 8 --requests 2000
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from comic_manager import Manager
+from comic_server import ComicServer
+
+PATHS = ['/comics?limit=50', '/series?limit=50', '/publishers', '/volumes', '/comics/search?q=vol']
+
+
+def client(port, requests, revalidate, gzip, results):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    etags = {}
+    statuses = {}
+    for n in range(requests):
+        path = PATHS[n % len(PATHS)]
+        headers = {}
+        if gzip:
+            headers['Accept-Encoding'] = 'gzip'
+        if revalidate and path in etags:
+            headers['If-None-Match'] = etags[path]
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        etags[path] = response.getheader('ETag')
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    conn.close()
+    results.append(statuses)
+
+
+def run(port, clients, requests, revalidate, gzip):
+    results = []
+    threads = [
+        threading.Thread(target=client, args=(port, requests // clients, revalidate, gzip, results))
+        for n in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    statuses = {}
+    for result in results:
+        for status, count in result.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return sum(statuses.values()) / seconds, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=os.path.join(ROOT, 'comicdb.db'), help='database to copy and serve')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--comics', type=int, default=0, help='extra comics to add to the copy first')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The server migrates and writes to its database, so never serve the original
+        db_name = os.path.join(tmp, 'comicdb.db')
+        shutil.copyfile(args.db, db_name)
+
+        with Manager(db_name) as manager:
+            manager.create_comicdb()
+            if args.comics:
+                series_id = manager.add_series('Load Test', manager.add_volume(1), manager.add_publisher('Load Test'))
+                manager.add_comics_bulk((series_id, n + 1, 3.99) for n in range(args.comics))
+
+            server = ComicServer(('127.0.0.1', 0), manager, quiet=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            port = server.server_port
+
+            print(f'{args.clients} clients, {args.requests} requests, paths: {json.dumps(PATHS)}')
+            for label, revalidate, gzip in [
+                ('plain', False, False),
+                ('gzip', False, True),
+                ('etag revalidation', True, False),
+            ]:
+                rate, statuses = run(port, args.clients, args.requests, revalidate, gzip)
+                print(f'{label:>18}: {rate:8.0f} req/s  statuses {statuses}')
+
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# Benchmark suite: generates a synthetic catalogue in a temporary database,
+# times each Manager operation and writes the results as JSON. Pass earlier
+# results to --compare to flag regressions between versions.
+#
+#   python benchmarks/run_suite.py --scale small --out before.json
+#   python benchmarks/run_suite.py --scale small --out after.json --compare before.json
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from catalogue import SCALES, generate
+from comic_manager import Manager
+
+
+def operations(manager, sizes, first_user, rng):
+    # name -> (callable run once per repeat, number of repeats). Writes come
+    # after reads, and the deletes remove rows the inserts added.
+    issues, series, users = sizes['issues'], sizes['series'], sizes['users']
+    added = []
+
+    def user():
+        return first_user + rng.randrange(users)
+
+    def add_comic():
+        added.append(manager.add_comic(rng.randint(1, series), rng.randint(1, 999), 3.99))
+
+    def add_comics_bulk():
+        manager.add_comics_bulk((rng.randint(1, series), n, 3.99) for n in range(1000))
+
+    def delete_comic():
+        manager.delete_comic(added.pop())
+
+    def delete_series():
+        series_id = manager.add_series('Benchmark Series', 1, 1)
+        manager.delete_series(series_id)
+
+    return [
+        ('show_all_comics', lambda: manager.show_all_comics(), 3),
+        ('show_comics_page', lambda: manager.show_comics_page(rng.randrange(issues)), 200),
+        ('iter_comics', lambda: sum(1 for _ in manager.iter_comics()), 3),
+        ('show_all_series', lambda: manager.show_all_series(), 50),
+        ('get_series', lambda: manager.get_series(rng.randint(1, series)), 500),
+        ('show_user_comics', lambda: manager.show_user_comics(user_id=user()), 50),
+        ('show_user_comics_page', lambda: manager.show_user_comics_page(user_id=user()), 200),
+        ('collection_value', lambda: manager.collection_value(user()), 50),
+        ('collection_value_by_series', lambda: manager.collection_value_by_series(user()), 20),
+        ('missing_issues', lambda: manager.missing_issues(user_id=user()), 5),
+        ('search_comics', lambda: manager.search_comics(rng.choice(['spider', 'dark knight', 'publisher 7', '12'])), 50),
+        ('find_similar', lambda: manager.find_similar(rng.choice(['Amazing Spidr 12', 'Dark Knigt 40', 'walking ded']), table='series'), 50),
+        ('add_comic', add_comic, 200),
+        ('add_comics_bulk_1000', add_comics_bulk, 5),
+        ('add_to_collection', lambda: manager.add_to_collection(rng.randint(1, issues), user_id=user()), 200),
+        ('update_comic', lambda: manager.update_comic(rng.randint(1, issues), current_price=round(rng.uniform(1, 500), 2)), 200),
+        ('update_comics_bulk_1000', lambda: manager.update_comics_bulk(
+            {'comic_id': rng.randint(1, issues), 'current_price': round(rng.uniform(1, 500), 2)} for _ in range(1000)
+        ), 5),
+        ('delete_comic', delete_comic, 200),
+        ('add_delete_series', delete_series, 100),
+    ]
+
+
+def run(manager, sizes, first_user, seed, repeat_scale):
+    rng = random.Random(seed)
+    results = {}
+    for name, func, repeats in operations(manager, sizes, first_user, rng):
+        repeats = max(1, int(repeats * repeat_scale))
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) * 1000)
+        times.sort()
+        results[name] = {
+            'runs': repeats,
+            'mean_ms': statistics.fmean(times),
+            'median_ms': statistics.median(times),
+            'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))],
+            'min_ms': times[0],
+        }
+        print(f'{name:<28}{results[name]["median_ms"]:>10.3f} ms median{results[name]["p95_ms"]:>10.3f} ms p95')
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, threshold, min_delta_ms):
+    # Ratios of median times; returns the operations that slowed past threshold.
+    # Sub-millisecond operations jitter by tens of percent, so a slowdown must
+    # also exceed min_delta_ms to count.
+    regressions = []
+    print(f'\n{"operation":<28}{"before":>10}{"after":>10}{"ratio":>8}')
+    for name, after in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f'{name:<28}{"-":>10}{after["median_ms"]:>10.3f}')
+            continue
+        ratio = after['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        slower = ratio > threshold and after['median_ms'] - before['median_ms'] > min_delta_ms
+        flag = '  REGRESSION' if slower else ''
+        print(f'{name:<28}{before["median_ms"]:>10.3f}{after["median_ms"]:>10.3f}{ratio:>8.2f}{flag}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time Manager operations on a synthetic catalogue')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    for name in SCALES['small']:
+        parser.add_argument(f'--{name}', type=int, help=f'overrides the scale\'s {name} count')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat-scale', type=float, default=1.0, help='multiplies every operation\'s repeat count')
+    parser.add_argument('--profile', default='default', help='Manager pragma profile')
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='median ratio counted as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=0.1, help='ignore slowdowns smaller than this')
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    sizes.update({name: getattr(args, name) for name in sizes if getattr(args, name) is not None})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with Manager(os.path.join(tmp, 'bench.db'), args.profile) as manager:
+            start = time.perf_counter()
+            first_user = generate(manager, seed=args.seed, **sizes)
+            generate_seconds = time.perf_counter() - start
+            print(f'generated {sizes} in {generate_seconds:.1f}s')
+            results = run(manager, sizes, first_user, args.seed, args.repeat_scale)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'profile': args.profile,
+            'seed': args.seed,
+            'sizes': sizes,
+            'generate_seconds': generate_seconds,
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta']['sizes'] != sizes:
+            print('warning: the baseline used different catalogue sizes')
+        if compare(baseline, results, args.threshold, args.min_delta_ms):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
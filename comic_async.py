@@ -0,0 +1,164 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from comic_manager import PAGE_SIZE, Manager
+
+
+class Session:
+    # Who a request is acting for. AsyncManager keeps no per-user state, so
+    # every user-specific call takes one of these.
+    __slots__ = ('user_id', 'username', 'clearance_level')
+
+    def __init__(self, user_id, username, clearance_level):
+        self.user_id = user_id
+        self.username = username
+        self.clearance_level = clearance_level
+
+    def __repr__(self):
+        return f'Session(user_id={self.user_id!r}, username={self.username!r}, clearance_level={self.clearance_level!r})'
+
+
+def _reader(name):
+    async def method(self, *args, **kwargs):
+        return await self._run(self._readers, getattr(self.manager, name), *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+def _writer(name):
+    async def method(self, *args, **kwargs):
+        return await self._run(self._writer, getattr(self.manager, name), *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+class AsyncManager:
+    # asyncio front end for Manager. SQLite calls run on worker threads, each
+    # with its own connection from Manager.connect(): a bounded pool for reads
+    # and a single thread for writes, so writers never contend with each other.
+    def __init__(self, db_name='comicdb.db', readers=4):
+        self.manager = Manager(db_name)
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='comicdb-reader')
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='comicdb-writer')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _run(self, executor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._shutdown)
+
+    def _shutdown(self):
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        self.manager.close()
+
+    async def create_comicdb(self):
+        return await self._run(self._writer, self.manager.create_comicdb)
+
+    async def login(self, username, password):
+        # The password is checked on a reader; upgrading an outdated hash is
+        # a write, so it goes through the writer like every other write
+        user = await self._run(self._readers, self.manager.authenticate, username, password, rehash=False)
+        if user is None:
+            return None
+        await self._run(self._writer, self.manager.rehash_password, user[0], password)
+        return Session(*user)
+
+    # Catalogue methods, same arguments as on Manager
+    add_user = _writer('add_user')
+    add_admin = _writer('add_admin')
+    change_password = _writer('change_password')
+    delete_user = _writer('delete_user')
+    add_series = _writer('add_series')
+    add_series_bulk = _writer('add_series_bulk')
+    add_publisher = _writer('add_publisher')
+    add_publishers_bulk = _writer('add_publishers_bulk')
+    add_volume = _writer('add_volume')
+    add_volumes_bulk = _writer('add_volumes_bulk')
+    add_comic = _writer('add_comic')
+    add_comics_bulk = _writer('add_comics_bulk')
+    update_comic = _writer('update_comic')
+    update_comics_bulk = _writer('update_comics_bulk')
+    update_series = _writer('update_series')
+    update_publisher = _writer('update_publisher')
+    update_volume = _writer('update_volume')
+    delete_comic = _writer('delete_comic')
+    delete_series = _writer('delete_series')
+    delete_publisher = _writer('delete_publisher')
+    delete_volume = _writer('delete_volume')
+    merge_publishers = _writer('merge_publishers')
+    merge_series = _writer('merge_series')
+    refresh_prices = _writer('refresh_prices')
+    record_prices = _writer('record_prices')
+    sweep_orphans = _writer('sweep_orphans')
+    maintain = _writer('maintain')
+    truncate_changes = _writer('truncate_changes')
+
+    show_all_comics = _reader('show_all_comics')
+    show_all_series = _reader('show_all_series')
+    show_all_publishers = _reader('show_all_publishers')
+    show_all_volumes = _reader('show_all_volumes')
+    show_comics_page = _reader('show_comics_page')
+    show_series_page = _reader('show_series_page')
+    show_publishers_page = _reader('show_publishers_page')
+    show_volumes_page = _reader('show_volumes_page')
+    show_covers_page = _reader('show_covers_page')
+    get_series = _reader('get_series')
+    search_comics = _reader('search_comics')
+    find_similar = _reader('find_similar')
+    get_price_history = _reader('get_price_history')
+    get_series_price_history = _reader('get_series_price_history')
+    latest_price = _reader('latest_price')
+    change_cursor = _reader('change_cursor')
+
+    # Collection methods act for an explicit session
+    async def add_to_collection(self, session, comic_id, **details):
+        return await self._run(
+            self._writer, self.manager.add_to_collection, comic_id, user_id=session.user_id, **details
+        )
+
+    async def update_collection(self, session, collection_id, **details):
+        return await self._run(
+            self._writer, self.manager.update_collection, collection_id, user_id=session.user_id, **details
+        )
+
+    async def delete_collection(self, session, collection_id, quantity=None):
+        return await self._run(
+            self._writer, self.manager.delete_collection, collection_id, quantity, user_id=session.user_id
+        )
+
+    async def show_user_comics(self, session):
+        return await self._run(self._readers, self.manager.show_user_comics, user_id=session.user_id)
+
+    async def show_user_comics_page(self, session, after_id=0, limit=PAGE_SIZE):
+        return await self._run(
+            self._readers, self.manager.show_user_comics_page, after_id, limit, user_id=session.user_id
+        )
+
+    async def changes_since(self, session, cursor_id=0, limit=1000):
+        # Catalogue changes plus the session's own collection changes
+        return await self._run(self._readers, self.manager.changes_since, cursor_id, limit, user_id=session.user_id)
+
+    async def missing_issues(self, session, series_id=None):
+        return await self._run(self._readers, self.manager.missing_issues, series_id, user_id=session.user_id)
+
+    async def collection_value(self, session):
+        return await self._run(self._readers, self.manager.collection_value, session.user_id)
+
+    async def collection_value_by_series(self, session):
+        return await self._run(self._readers, self.manager.collection_value_by_series, session.user_id)
+
+    async def collection_value_by_publisher(self, session):
+        return await self._run(self._readers, self.manager.collection_value_by_publisher, session.user_id)
+
+    async def value_summary(self, session):
+        return await self._run(self._readers, self.manager.value_summary, session.user_id)
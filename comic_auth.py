@@ -0,0 +1,107 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# scrypt work factor: n is the CPU/memory cost (a power of two), r the block
+# size and p the parallelism. Memory use is about 128 * n * r bytes, so the
+# default costs 16 MiB and tens of milliseconds per hash.
+PASSWORD_COST = {'n': 2 ** 14, 'r': 8, 'p': 1}
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+# Seconds a session token stays valid after login
+TOKEN_TTL = 3600
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=HASH_BYTES,
+    )
+
+
+def hash_password(password, n=PASSWORD_COST['n'], r=PASSWORD_COST['r'], p=PASSWORD_COST['p']):
+    # Stored as scrypt$n$r$p$salt$hash so the cost can change without
+    # invalidating existing passwords
+    salt = secrets.token_bytes(SALT_BYTES)
+    return f'scrypt${n}${r}${p}${salt.hex()}${_scrypt(password, salt, n, r, p).hex()}'
+
+
+def is_hashed(stored):
+    return stored.startswith('scrypt$')
+
+
+def verify_password(password, stored):
+    try:
+        scheme, n, r, p, salt, digest = stored.split('$')
+    except ValueError:
+        return False
+    if scheme != 'scrypt':
+        return False
+    return hmac.compare_digest(_scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p)), bytes.fromhex(digest))
+
+
+def needs_rehash(stored, n=PASSWORD_COST['n'], r=PASSWORD_COST['r'], p=PASSWORD_COST['p']):
+    return stored.split('$')[1:4] != [str(n), str(r), str(p)]
+
+
+class SessionTokens:
+    # Bearer tokens for signed in users, held in memory. Checking a token is a
+    # dict lookup, so only the login itself pays for the password hash.
+    def __init__(self, ttl=TOKEN_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        # Oldest first, so expired tokens are always at the front
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        # Drops expired tokens from the front; called with the lock held
+        while self._tokens:
+            token, (user, expires) = next(iter(self._tokens.items()))
+            if expires > now:
+                break
+            del self._tokens[token]
+
+    def issue(self, user):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            now = self.clock()
+            self._prune(now)
+            self._tokens[token] = (user, now + self.ttl)
+        return token
+
+    def lookup(self, token):
+        # The (user_id, username, clearance_level) the token was issued for,
+        # or None once it has expired or been revoked
+        with self._lock:
+            now = self.clock()
+            self._prune(now)
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires <= now:
+                del self._tokens[token]
+                return None
+            return user
+
+    def revoke(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            for token, (user, expires) in list(self._tokens.items()):
+                if user[0] == user_id:
+                    del self._tokens[token]
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def __len__(self):
+        return len(self._tokens)
@@ -0,0 +1,130 @@
+import csv
+import json
+import os
+import time
+
+from comic_import import chunked
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Parquet export is only offered when pyarrow is installed
+    pyarrow = None
+
+CHUNK_SIZE = 5000
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.parquet': 'parquet'}
+
+# kind -> (Manager iterator, columns and their parquet types). comics, series,
+# publishers and volumes use the column names the importer reads back.
+EXPORTS = {
+    'comics': ('iter_comic_details', [
+        ('comic_id', 'int64'), ('series', 'string'), ('volume', 'string'), ('publisher', 'string'),
+        ('issue_num', 'int64'), ('cover_price', 'float64'), ('current_price', 'float64'),
+        ('description', 'string'), ('image_url', 'string'),
+    ]),
+    'series': ('iter_series_details', [
+        ('series_id', 'int64'), ('name', 'string'), ('volume', 'string'), ('publisher', 'string'),
+    ]),
+    'publishers': ('iter_publishers', [('publisher_id', 'int64'), ('name', 'string')]),
+    'volumes': ('iter_volumes', [('volume_id', 'int64'), ('name', 'string')]),
+    'collection': ('iter_collection_details', [
+        ('collection_id', 'int64'), ('comic_id', 'int64'), ('series', 'string'), ('volume', 'string'),
+        ('publisher', 'string'), ('issue_num', 'int64'), ('cover_price', 'float64'),
+        ('current_price', 'float64'), ('quantity', 'int64'), ('grade', 'float64'),
+        ('purchase_price', 'float64'), ('acquired_on', 'string'),
+    ]),
+}
+KINDS = tuple(EXPORTS)
+
+
+class CsvWriter:
+    def __init__(self, f, columns):
+        self.writer = csv.writer(f)
+        self.writer.writerow([name for name, kind in columns])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class JsonLinesWriter:
+    def __init__(self, f, columns):
+        self.f = f
+        self.names = [name for name, kind in columns]
+
+    def write(self, rows):
+        self.f.write(''.join(json.dumps(dict(zip(self.names, row))) + '\n' for row in rows))
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    # One row group per chunk, so memory stays bounded by the chunk size
+    def __init__(self, f, columns):
+        self.names = [name for name, kind in columns]
+        self.schema = pyarrow.schema([(name, getattr(pyarrow, kind)()) for name, kind in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(f, self.schema, compression='zstd')
+
+    def write(self, rows):
+        values = list(zip(*rows))
+        self.writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(values, self.schema)],
+            schema=self.schema,
+        ))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {'csv': CsvWriter, 'jsonl': JsonLinesWriter, 'parquet': ParquetWriter}
+
+
+class Exporter:
+    # Streams a table out of the Manager chunk by chunk: rows come from an
+    # iter_* method's cursor and each chunk is written before the next is read
+    def __init__(self, manager, chunk_size=CHUNK_SIZE, progress=None):
+        self.manager = manager
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.rows = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def export_file(self, path, kind, file_format=None, user_id=None):
+        if kind not in EXPORTS:
+            raise ValueError(f'Unknown export kind {kind!r}, expected one of {", ".join(KINDS)}')
+        file_format = file_format or FORMATS.get(os.path.splitext(path)[1].lower())
+        if file_format not in WRITERS:
+            raise ValueError(f'Unknown export format for {path}, use csv, jsonl or parquet')
+        if file_format == 'parquet' and pyarrow is None:
+            raise ValueError('Parquet export needs pyarrow installed')
+
+        method, columns = EXPORTS[kind]
+        if kind == 'collection':
+            rows = getattr(self.manager, method)(self.chunk_size, user_id=user_id)
+        else:
+            rows = getattr(self.manager, method)(self.chunk_size)
+
+        start = time.perf_counter()
+        if file_format == 'parquet':
+            f = open(path, 'wb')
+        else:
+            f = open(path, 'w', newline='', encoding='utf-8')
+        with f:
+            writer = WRITERS[file_format](f, columns)
+            for chunk in chunked(rows, self.chunk_size):
+                writer.write(chunk)
+                self.rows += len(chunk)
+                self.seconds = time.perf_counter() - start
+                if self.progress:
+                    self.progress(self.rows, self.rows_per_second)
+            writer.close()
+        self.seconds = time.perf_counter() - start
+        return self.rows
@@ -0,0 +1,277 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow covers are still cached, just without thumbnails
+    Image = None
+
+MAX_BYTES = 512 * 1024 * 1024
+# Largest single image ingest() will accept
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+THUMB_SIZE = (200, 300)
+# last_used is only rewritten when it is older than this, so reading a
+# cover doesn't mean a database write every time
+TOUCH_SECONDS = 60
+
+# Leading bytes of the image formats accepted, with their file extensions
+SIGNATURES = [
+    (b'\xff\xd8\xff', '.jpg', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', '.png', 'image/png'),
+    (b'GIF87a', '.gif', 'image/gif'),
+    (b'GIF89a', '.gif', 'image/gif'),
+]
+
+
+def sniff(data):
+    # (extension, content type) for supported image bytes, else None
+    for signature, extension, content_type in SIGNATURES:
+        if data.startswith(signature):
+            return extension, content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp', 'image/webp'
+    return None
+
+
+def fetch(source, limit=MAX_IMAGE_BYTES):
+    # Reads a local path or a URL (http, https or file)
+    if '://' not in source:
+        with open(source, 'rb') as f:
+            data = f.read(limit + 1)
+    else:
+        with urllib.request.urlopen(source, timeout=30) as response:
+            data = response.read(limit + 1)
+    if len(data) > limit:
+        raise ValueError(f'{source} is larger than {limit} bytes')
+    return data
+
+
+class ImageStore:
+    # Content-addressed cover cache. Each image is stored once under its
+    # sha256, however many comics use it, and comics record the cached path
+    # next to image_url so listings never have to touch the files. The least
+    # recently used images are evicted once the store outgrows max_bytes.
+    def __init__(self, manager, root=None, max_bytes=MAX_BYTES, thumb_size=THUMB_SIZE, fetch=fetch):
+        self.manager = manager
+        self.root = root or os.path.join(os.path.dirname(os.path.abspath(manager.db_name)), 'covers')
+        self.max_bytes = max_bytes
+        self.thumb_size = thumb_size
+        self.fetch = fetch
+
+    def path(self, relative):
+        return os.path.join(self.root, relative)
+
+    def _write(self, relative, data):
+        # Written to a temporary file and renamed, so readers never see half an image
+        target = self.path(relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp, target)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+    def _remove(self, *names):
+        for name in names:
+            if name:
+                try:
+                    os.remove(self.path(name))
+                except FileNotFoundError:
+                    pass
+
+    def _thumbnail(self, digest, data):
+        # (relative path, size) of a new thumbnail
+        if Image is None:
+            return None, 0
+        image = Image.open(io.BytesIO(data))
+        image.thumbnail(self.thumb_size)
+        out = io.BytesIO()
+        image.convert('RGB').save(out, 'JPEG', quality=85)
+        relative = os.path.join('thumbs', digest[:2], f'{digest}.jpg')
+        self._write(relative, out.getvalue())
+        return relative, out.tell()
+
+    def ingest(self, source):
+        # Stores the image at source if it isn't already held and returns its
+        # (sha256, path, thumb_path)
+        return self.add_bytes(self.fetch(source))
+
+    def add_bytes(self, data):
+        kind = sniff(data)
+        if kind is None:
+            raise ValueError('Not a JPEG, PNG, GIF or WebP image')
+        digest = hashlib.sha256(data).hexdigest()
+
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT path, thumb_path, last_used FROM image_cache WHERE sha256 = ?', (digest,))
+        row = cursor.fetchone()
+        if row is not None and os.path.exists(self.path(row[0])):
+            self._touch(conn, digest, row[2])
+            return digest, row[0], row[1]
+
+        relative = os.path.join(digest[:2], digest + kind[0])
+        thumb = None
+        self._write(relative, data)
+        try:
+            thumb, thumb_bytes = self._thumbnail(digest, data)
+            # bytes counts the thumbnail too, as eviction removes both
+            cursor.execute('''
+                INSERT OR REPLACE INTO image_cache (sha256, path, thumb_path, content_type, bytes, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (digest, relative, thumb, kind[1], len(data) + thumb_bytes, int(time.time())))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Without an image_cache row eviction would never find the files
+            self._remove(relative, thumb)
+            raise
+
+        self.evict(keep=digest)
+        return digest, relative, thumb
+
+    def _touch(self, conn, digest, last_used):
+        now = int(time.time())
+        if now - last_used >= TOUCH_SECONDS:
+            try:
+                conn.execute('UPDATE image_cache SET last_used = ? WHERE sha256 = ?', (now, digest))
+            except Exception:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def cache_comic(self, comic_id):
+        # Caches the comic's image_url and records the paths on the comic
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT image_url FROM comic WHERE comic_id = ?', (comic_id,))
+        row = cursor.fetchone()
+        if row is None or not row[0]:
+            return None
+        digest, relative, thumb = self.ingest(row[0])
+        self._record(comic_id, relative, thumb)
+        return relative, thumb
+
+    def _record(self, comic_id, relative, thumb):
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('''
+                UPDATE comic SET image_path = ?, thumb_path = ? WHERE comic_id = ?
+            ''', (relative, thumb, comic_id))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def cache_missing(self, limit=None, workers=4):
+        # Fetches the covers of comics with an image_url but no cached copy,
+        # downloading on worker threads. Returns (cached, failed) counts.
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT comic_id, image_url FROM comic
+            WHERE image_url IS NOT NULL AND image_url != '' AND image_path IS NULL
+            ORDER BY comic_id LIMIT ?
+        ''', (-1 if limit is None else limit,))
+        comics = cursor.fetchall()
+
+        stored = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Only workers * 2 downloads are in flight or waiting at a time, and
+            # each is dropped once stored, so a long backlog never holds more
+            # than that many images in memory
+            downloads = deque()
+            for comic_id, url in comics:
+                downloads.append((comic_id, pool.submit(self.fetch, url)))
+                if len(downloads) >= workers * 2:
+                    stored.append(self._store_download(*downloads.popleft()))
+            while downloads:
+                stored.append(self._store_download(*downloads.popleft()))
+        return stored.count(True), stored.count(False)
+
+    def _store_download(self, comic_id, download):
+        # True once the fetched image is stored and recorded on the comic
+        try:
+            digest, relative, thumb = self.add_bytes(download.result())
+        except (OSError, ValueError):
+            return False
+        self._record(comic_id, relative, thumb)
+        return True
+
+    def cover(self, comic_id, thumb=False):
+        # (absolute path, content type) of a comic's cached cover, or None
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT i.sha256, c.image_path, c.thumb_path, i.content_type, i.last_used
+            FROM comic c
+            INNER JOIN image_cache i ON i.path = c.image_path
+            WHERE c.comic_id = ?
+        ''', (comic_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        self._touch(conn, row[0], row[4])
+        if thumb and row[2]:
+            return self.path(row[2]), 'image/jpeg'
+        return self.path(row[1]), row[3]
+
+    def total_bytes(self):
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT COALESCE(SUM(bytes), 0) FROM image_cache')
+        return cursor.fetchone()[0]
+
+    def evict(self, max_bytes=None, keep=None):
+        # Drops least recently used images, other than keep, until the store
+        # fits in max_bytes; returns how many were removed
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        excess = self.total_bytes() - max_bytes
+        if excess <= 0:
+            return 0
+
+        victims = []
+        cursor.execute('''
+            SELECT sha256, path, thumb_path, bytes FROM image_cache WHERE sha256 IS NOT ? ORDER BY last_used
+        ''', (keep,))
+        for digest, relative, thumb, size in cursor:
+            victims.append((digest, relative, thumb))
+            excess -= size
+            if excess <= 0:
+                break
+
+        try:
+            cursor.executemany('UPDATE comic SET image_path = NULL, thumb_path = NULL WHERE image_path = ?', [
+                (relative,) for digest, relative, thumb in victims
+            ])
+            cursor.executemany('DELETE FROM image_cache WHERE sha256 = ?', [
+                (digest,) for digest, relative, thumb in victims
+            ])
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+        for digest, relative, thumb in victims:
+            self._remove(relative, thumb)
+        return len(victims)
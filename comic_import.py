@@ -0,0 +1,264 @@
+import csv
+import json
+import os
+import time
+
+CHUNK_SIZE = 5000
+KINDS = ('comics', 'series', 'publishers', 'volumes', 'prices')
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+def read_rows(path, file_format=None):
+    # Streams dict rows from a CSV or JSON Lines file without loading it whole
+    file_format = file_format or FORMATS.get(os.path.splitext(path)[1].lower())
+    if file_format not in ('csv', 'jsonl'):
+        raise ValueError(f'Unknown import format for {path}, use csv or jsonl')
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def volume_name(value):
+    # Volumes are stored as 'Vol. <num>', accept either form in import files
+    value = '' if value is None else str(value).strip()
+    if value.lower().startswith('vol.'):
+        value = value[4:].strip()
+    if not value:
+        raise ValueError('Missing volume number')
+    return f'Vol. {value}'
+
+
+def _value(row, key, convert=str):
+    value = row.get(key)
+    if value is None or value == '':
+        return None
+    return convert(value)
+
+
+class Importer:
+    def __init__(self, manager, chunk_size=CHUNK_SIZE, progress=None, similar=None):
+        self.manager = manager
+        self.chunk_size = chunk_size
+        self.progress = progress
+        # With a find_similar() threshold, a publisher or series name that is
+        # new but close to an existing one is matched to it, not created;
+        # matched records (table, name) -> the existing name used
+        self.similar = similar
+        self.matched = {}
+        self.rows = 0
+        self.inserted = 0
+        self.seconds = 0.0
+
+        # name -> id lookups, loaded on first use and kept as rows are created
+        self.publishers = None
+        self.volumes = None
+        self.series = None
+        self.series_by_name = None
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def _load_lookups(self):
+        # Copies of the Manager's cached name -> id maps, extended as rows are added
+        self.publishers = dict(self.manager.publisher_ids())
+        self.volumes = dict(self.manager.volume_ids())
+        self.series_by_name = dict(self.manager.series_ids())
+        self.series = {}
+        for series_id, name, volume_id, publisher_id in self.manager.show_all_series():
+            self.series.setdefault((name, volume_id, publisher_id), series_id)
+        # The highest id read per table; rows after it are new
+        self.last_ids = {
+            'publisher': max(self.publishers.values(), default=0),
+            'volume': max(self.volumes.values(), default=0),
+            'series': max(self.series.values(), default=0),
+        }
+
+    def _load_new(self, table):
+        # Adds the rows inserted since the lookups were read, a page at a time,
+        # so a bulk chunk costs its own size rather than the whole table's
+        fetch_page = {
+            'publisher': self.manager.show_publishers_page,
+            'volume': self.manager.show_volumes_page,
+            'series': self.manager.show_series_page,
+        }[table]
+        while True:
+            rows = fetch_page(self.last_ids[table], self.chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                if table == 'series':
+                    series_id, name, volume_id, publisher_id = row
+                    self.series.setdefault((name, volume_id, publisher_id), series_id)
+                    self.series_by_name.setdefault(name, series_id)
+                elif table == 'publisher':
+                    self.publishers.setdefault(row[1], row[0])
+                else:
+                    self.volumes.setdefault(row[1], row[0])
+            self.last_ids[table] = rows[-1][0]
+
+    def _similar(self, name, table, accept=None):
+        # The closest existing row to name that accept() allows, or None
+        if self.similar is None:
+            return None
+        for match in self.manager.find_similar(name, self.similar, table):
+            if accept is None or accept(match):
+                self.matched[(table, name)] = match.name
+                return match
+        return None
+
+    def publisher_id(self, name):
+        if self.publishers is None:
+            self._load_lookups()
+        if name not in self.publishers:
+            match = self._similar(name, 'publisher')
+            self.publishers[name] = match.row_id if match else self.manager.add_publisher(name)
+        return self.publishers[name]
+
+    def volume_id(self, value):
+        if self.volumes is None:
+            self._load_lookups()
+        name = volume_name(value)
+        if name not in self.volumes:
+            self.volumes[name] = self.manager.add_volume(name[5:])
+        return self.volumes[name]
+
+    def series_id(self, name, volume=None, publisher=None):
+        if self.series is None:
+            self._load_lookups()
+        if volume is None or publisher is None:
+            if name not in self.series_by_name:
+                match = self._similar(name, 'series')
+                if match is None:
+                    raise ValueError(f'Unknown series {name!r}, include its volume and publisher to create it')
+                self.series_by_name[name] = match.row_id
+            return self.series_by_name[name]
+
+        return self._series_key_id((name, self.volume_id(volume), self.publisher_id(publisher)))
+
+    def _series_key_id(self, key):
+        # key is (name, volume_id, publisher_id)
+        if key not in self.series:
+            # Only a series with the same volume and publisher is a match
+            def same_parents(match):
+                return self.series.get((match.name, *key[1:])) == match.row_id
+
+            match = self._similar(key[0], 'series', same_parents)
+            self.series[key] = match.row_id if match else self.manager.add_series(*key)
+            self.series_by_name.setdefault(key[0], self.series[key])
+        return self.series[key]
+
+    def import_file(self, path, kind, file_format=None):
+        handlers = {
+            'comics': self._import_comics,
+            'series': self._import_series,
+            'publishers': self._import_publishers,
+            'volumes': self._import_volumes,
+            'prices': self._import_prices,
+        }
+        if kind not in handlers:
+            raise ValueError(f'Unknown import kind {kind!r}, expected one of {", ".join(KINDS)}')
+
+        start = time.perf_counter()
+        for chunk in chunked(read_rows(path, file_format), self.chunk_size):
+            self.inserted += handlers[kind](chunk)
+            self.rows += len(chunk)
+            self.seconds = time.perf_counter() - start
+            if self.progress:
+                self.progress(self.rows, self.rows_per_second)
+        self.seconds = time.perf_counter() - start
+        return self.rows
+
+    def _import_comics(self, chunk):
+        comics = []
+        for row in chunk:
+            comics.append((
+                self.series_id(_value(row, 'series'), _value(row, 'volume'), _value(row, 'publisher')),
+                _value(row, 'issue_num', int),
+                _value(row, 'cover_price', float),
+                _value(row, 'current_price', float),
+                _value(row, 'description'),
+                _value(row, 'image_url'),
+            ))
+        return self.manager.add_comics_bulk(comics)
+
+    def _import_series(self, chunk):
+        if self.series is None:
+            self._load_lookups()
+        missing = {}
+        for row in chunk:
+            key = (
+                _value(row, 'name'),
+                self.volume_id(_value(row, 'volume')),
+                self.publisher_id(_value(row, 'publisher')),
+            )
+            if key not in self.series:
+                missing[key] = None
+        if self.similar is not None:
+            # One at a time, so a near duplicate later in the file is matched
+            # to the series added for an earlier row
+            for key in missing:
+                self._series_key_id(key)
+            return sum(1 for key in missing if ('series', key[0]) not in self.matched)
+        count = self.manager.add_series_bulk(missing)
+        self._load_new('series')
+        return count
+
+    def _import_publishers(self, chunk):
+        if self.publishers is None:
+            self._load_lookups()
+        names = list(dict.fromkeys(
+            name for name in (_value(row, 'name') for row in chunk) if name not in self.publishers
+        ))
+        if self.similar is not None:
+            for name in names:
+                self.publisher_id(name)
+            return sum(1 for name in names if ('publisher', name) not in self.matched)
+        count = self.manager.add_publishers_bulk(names)
+        self._load_new('publisher')
+        return count
+
+    def _import_volumes(self, chunk):
+        if self.volumes is None:
+            self._load_lookups()
+        names = {}
+        for number, row in enumerate(chunk, self.rows + 1):
+            try:
+                names[volume_name(_value(row, 'num') or _value(row, 'name'))] = None
+            except ValueError:
+                raise ValueError(f'Volume row {number} has no num or name')
+        count = self.manager.add_volumes_bulk(name[5:] for name in names if name not in self.volumes)
+        self._load_new('volume')
+        return count
+
+    def _import_prices(self, chunk):
+        # Rows with a recorded_at (unix seconds) backfill price history, the
+        # rest refresh comic.current_price and are recorded as of now
+        points = []
+        prices = []
+        for row in chunk:
+            comic_id = _value(row, 'comic_id', int)
+            price = _value(row, 'price', float)
+            recorded_at = _value(row, 'recorded_at', int)
+            if recorded_at is None:
+                prices.append((comic_id, price))
+            else:
+                points.append((comic_id, recorded_at, price))
+        return self.manager.record_prices(points) + self.manager.refresh_prices(prices)
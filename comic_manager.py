@@ -1,19 +1,853 @@
+import json
+import logging
+import math
+import re
 import sqlite3
+import sys
+import threading
+import time
+
+from comic_auth import PASSWORD_COST, SessionTokens, hash_password, is_hashed, needs_rehash, verify_password
+from comic_records import (
+    Change, CollectionEntry, Columns, Comic, IssueGap, Publisher, Series, SimilarName, Volume, build_records,
+)
+from comic_writes import WriteQueue
+
+
+def _add_lookup_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_collection_user_comic ON collection (user_id, comic_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comic_series_issue ON comic (series_id, issue_num)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_series_publisher ON series (publisher_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_series_volume ON series (volume_id)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_user_username ON user (username)')
+
+def _add_comic_search(cursor):
+    # Full-text index over each comic's series, publisher, issue number and
+    # description. rowid is the comic_id; triggers keep it in step.
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS comic_search USING fts5(
+            series_name, publisher_name, issue_num, description
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO comic_search (rowid, series_name, publisher_name, issue_num, description)
+        SELECT c.comic_id, s.name, p.name, c.issue_num, c.description
+        FROM comic c
+        LEFT JOIN series s ON s.series_id = c.series_id
+        LEFT JOIN publisher p ON p.publisher_id = s.publisher_id
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS comic_search_insert AFTER INSERT ON comic BEGIN
+            INSERT INTO comic_search (rowid, series_name, publisher_name, issue_num, description)
+            SELECT new.comic_id, s.name, p.name, new.issue_num, new.description
+            FROM (SELECT 1)
+            LEFT JOIN series s ON s.series_id = new.series_id
+            LEFT JOIN publisher p ON p.publisher_id = s.publisher_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS comic_search_update AFTER UPDATE OF series_id, issue_num, description ON comic BEGIN
+            DELETE FROM comic_search WHERE rowid = old.comic_id;
+            INSERT INTO comic_search (rowid, series_name, publisher_name, issue_num, description)
+            SELECT new.comic_id, s.name, p.name, new.issue_num, new.description
+            FROM (SELECT 1)
+            LEFT JOIN series s ON s.series_id = new.series_id
+            LEFT JOIN publisher p ON p.publisher_id = s.publisher_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS comic_search_delete AFTER DELETE ON comic BEGIN
+            DELETE FROM comic_search WHERE rowid = old.comic_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS comic_search_series_update AFTER UPDATE OF name, publisher_id ON series BEGIN
+            DELETE FROM comic_search WHERE rowid IN (SELECT comic_id FROM comic WHERE series_id = new.series_id);
+            INSERT INTO comic_search (rowid, series_name, publisher_name, issue_num, description)
+            SELECT c.comic_id, new.name, p.name, c.issue_num, c.description
+            FROM comic c
+            LEFT JOIN publisher p ON p.publisher_id = new.publisher_id
+            WHERE c.series_id = new.series_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS comic_search_publisher_update AFTER UPDATE OF name ON publisher BEGIN
+            DELETE FROM comic_search WHERE rowid IN (
+                SELECT c.comic_id FROM comic c
+                INNER JOIN series s ON s.series_id = c.series_id
+                WHERE s.publisher_id = new.publisher_id
+            );
+            INSERT INTO comic_search (rowid, series_name, publisher_name, issue_num, description)
+            SELECT c.comic_id, s.name, new.name, c.issue_num, c.description
+            FROM comic c
+            INNER JOIN series s ON s.series_id = c.series_id
+            WHERE s.publisher_id = new.publisher_id;
+        END
+    ''')
+
+VALUE_SUMMARY_TRIGGERS = (
+    'value_summary_collection_insert', 'value_summary_collection_update', 'value_summary_collection_delete',
+    'value_summary_comic_update', 'value_summary_comic_delete',
+)
+
+def _create_value_summary(cursor):
+    # Per-user collection totals kept current by triggers, so dashboards read
+    # one row instead of aggregating. Comics are valued at current_price when
+    # known, otherwise at cover_price, times the copies owned.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS collection_value_summary (
+            user_id INTEGER PRIMARY KEY,
+            comics INTEGER NOT NULL,
+            cover_total REAL NOT NULL,
+            current_total REAL NOT NULL
+        )
+    ''')
+    cursor.execute('DELETE FROM collection_value_summary')
+    cursor.execute('''
+        INSERT INTO collection_value_summary (user_id, comics, cover_total, current_total)
+        SELECT co.user_id, SUM(co.quantity), SUM(c.cover_price * co.quantity),
+            SUM(COALESCE(c.current_price, c.cover_price) * co.quantity)
+        FROM collection co
+        INNER JOIN comic c ON c.comic_id = co.comic_id
+        GROUP BY co.user_id
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS value_summary_collection_insert AFTER INSERT ON collection
+        WHEN EXISTS (SELECT 1 FROM comic WHERE comic_id = new.comic_id) BEGIN
+            INSERT INTO collection_value_summary (user_id, comics, cover_total, current_total)
+            SELECT new.user_id, new.quantity, cover_price * new.quantity, COALESCE(current_price, cover_price) * new.quantity
+            FROM comic WHERE comic_id = new.comic_id
+            ON CONFLICT (user_id) DO UPDATE SET
+                comics = comics + excluded.comics,
+                cover_total = cover_total + excluded.cover_total,
+                current_total = current_total + excluded.current_total;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS value_summary_collection_update AFTER UPDATE OF quantity ON collection
+        WHEN new.quantity != old.quantity BEGIN
+            UPDATE collection_value_summary SET
+                comics = comics + new.quantity - old.quantity,
+                cover_total = cover_total + c.cover_price * (new.quantity - old.quantity),
+                current_total = current_total + COALESCE(c.current_price, c.cover_price) * (new.quantity - old.quantity)
+            FROM (SELECT cover_price, current_price FROM comic WHERE comic_id = new.comic_id) AS c
+            WHERE user_id = new.user_id;
+        END
+    ''')
+    # A comic being deleted is subtracted by value_summary_comic_delete instead
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS value_summary_collection_delete AFTER DELETE ON collection
+        WHEN EXISTS (SELECT 1 FROM comic WHERE comic_id = old.comic_id) BEGIN
+            UPDATE collection_value_summary SET
+                comics = comics - old.quantity,
+                cover_total = cover_total - c.cover_price * old.quantity,
+                current_total = current_total - COALESCE(c.current_price, c.cover_price) * old.quantity
+            FROM (SELECT cover_price, current_price FROM comic WHERE comic_id = old.comic_id) AS c
+            WHERE user_id = old.user_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS value_summary_comic_update AFTER UPDATE OF cover_price, current_price ON comic BEGIN
+            UPDATE collection_value_summary SET
+                cover_total = cover_total + (new.cover_price - old.cover_price) * owned.copies,
+                current_total = current_total + (
+                    COALESCE(new.current_price, new.cover_price) - COALESCE(old.current_price, old.cover_price)
+                ) * owned.copies
+            FROM (
+                SELECT user_id, SUM(quantity) AS copies FROM collection WHERE comic_id = new.comic_id GROUP BY user_id
+            ) AS owned
+            WHERE collection_value_summary.user_id = owned.user_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS value_summary_comic_delete BEFORE DELETE ON comic BEGIN
+            UPDATE collection_value_summary SET
+                comics = comics - owned.copies,
+                cover_total = cover_total - old.cover_price * owned.copies,
+                current_total = current_total - COALESCE(old.current_price, old.cover_price) * owned.copies
+            FROM (
+                SELECT user_id, SUM(quantity) AS copies FROM collection WHERE comic_id = old.comic_id GROUP BY user_id
+            ) AS owned
+            WHERE collection_value_summary.user_id = owned.user_id;
+        END
+    ''')
+
+def _add_price_history(cursor):
+    # One point per comic per second, clustered by (comic_id, recorded_at) so
+    # range scans and the latest price for a comic are index seeks
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS price_history (
+            comic_id INTEGER NOT NULL,
+            recorded_at INTEGER NOT NULL,
+            price REAL NOT NULL,
+            PRIMARY KEY (comic_id, recorded_at)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO price_history (comic_id, recorded_at, price)
+        SELECT comic_id, CAST(strftime('%s', 'now') AS INTEGER), current_price
+        FROM comic WHERE current_price IS NOT NULL
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS price_history_insert AFTER INSERT ON comic
+        WHEN new.current_price IS NOT NULL BEGIN
+            INSERT OR REPLACE INTO price_history (comic_id, recorded_at, price)
+            VALUES (new.comic_id, CAST(strftime('%s', 'now') AS INTEGER), new.current_price);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS price_history_update AFTER UPDATE OF current_price ON comic
+        WHEN new.current_price IS NOT NULL AND new.current_price IS NOT old.current_price BEGIN
+            INSERT OR REPLACE INTO price_history (comic_id, recorded_at, price)
+            VALUES (new.comic_id, CAST(strftime('%s', 'now') AS INTEGER), new.current_price);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS price_history_delete AFTER DELETE ON comic BEGIN
+            DELETE FROM price_history WHERE comic_id = old.comic_id;
+        END
+    ''')
+
+def _hash_passwords(cursor):
+    # Older databases spelled the column clearence_level and kept passwords
+    # in plaintext; hash them in place with the default cost
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(user)')]
+    if 'clearence_level' in columns:
+        cursor.execute('ALTER TABLE user RENAME COLUMN clearence_level TO clearance_level')
+
+    users = cursor.execute('SELECT user_id, password FROM user').fetchall()
+    cursor.executemany('UPDATE user SET password = ? WHERE user_id = ?', [
+        (hash_password(password), user_id) for user_id, password in users if not is_hashed(password)
+    ])
+
+# The tables holding foreign keys, as rebuilt by _add_delete_actions. Deleting
+# a series deletes its comics, and deleting a comic or a user deletes their
+# collection rows; volumes and publishers can't be deleted while a series
+# still uses them.
+DELETE_ACTION_TABLES = {
+    'series': '''
+        series_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        volume_id INTEGER NOT NULL,
+        publisher_id INTEGER NOT NULL,
+        FOREIGN KEY (volume_id) REFERENCES volume (volume_id) ON DELETE RESTRICT,
+        FOREIGN KEY (publisher_id) REFERENCES publisher (publisher_id) ON DELETE RESTRICT
+    ''',
+    'comic': '''
+        comic_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_url TEXT,
+        description TEXT,
+        series_id INTEGER NOT NULL,
+        current_price REAL,
+        issue_num INTEGER NOT NULL,
+        cover_price REAL NOT NULL,
+        FOREIGN KEY (series_id) REFERENCES series (series_id) ON DELETE CASCADE
+    ''',
+    'collection': '''
+        collection_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        comic_id INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES user (user_id) ON DELETE CASCADE,
+        FOREIGN KEY (comic_id) REFERENCES comic (comic_id) ON DELETE CASCADE
+    ''',
+}
+
+def _add_delete_actions(cursor):
+    # SQLite can't alter a foreign key, so each table is copied into a new
+    # definition and renamed over the old one. _migrate turns foreign keys off
+    # first, or dropping the old tables would cascade. Every trigger is dropped
+    # for the rebuild, as renaming checks them all, and recreated afterwards.
+    tables = tuple(DELETE_ACTION_TABLES)
+    triggers = cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    indexes = cursor.execute(f'''
+        SELECT sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({', '.join('?' * len(tables))})
+    ''', tables).fetchall()
+    sequences = cursor.execute('SELECT name, seq FROM sqlite_sequence').fetchall()
+
+    for name, sql in triggers:
+        cursor.execute(f'DROP TRIGGER {name}')
+
+    for table, definition in DELETE_ACTION_TABLES.items():
+        columns = ', '.join(row[1] for row in cursor.execute(f'PRAGMA table_info({table})'))
+        cursor.execute(f'CREATE TABLE {table}_new ({definition})')
+        cursor.execute(f'INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}')
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+    # Keep AUTOINCREMENT from reusing ids deleted before the rebuild
+    cursor.executemany('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', [
+        (seq, name) for name, seq in sequences if name in DELETE_ACTION_TABLES
+    ])
+    for (sql,) in indexes:
+        cursor.execute(sql)
+    for name, sql in triggers:
+        cursor.execute(sql)
+    # Cascading a comic delete looks its collection rows up by comic_id
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_collection_comic ON collection (comic_id)')
+
+def _add_cover_cache(cursor):
+    # Covers held by comic_images.ImageStore, one row per distinct image.
+    # Comics record their cached paths next to image_url.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_cache (
+            sha256 TEXT PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            thumb_path TEXT,
+            content_type TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            last_used INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_cache_last_used ON image_cache (last_used)')
+    cursor.execute('ALTER TABLE comic ADD COLUMN image_path TEXT')
+    cursor.execute('ALTER TABLE comic ADD COLUMN thumb_path TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comic_image_path ON comic (image_path) WHERE image_path IS NOT NULL')
+    # A new image_url makes the cached copy stale
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS cover_cache_url_update AFTER UPDATE OF image_url ON comic
+        WHEN new.image_url IS NOT old.image_url BEGIN
+            UPDATE comic SET image_path = NULL, thumb_path = NULL WHERE comic_id = new.comic_id;
+        END
+    ''')
+
+def _add_collection_quantities(cursor):
+    # A user's copies of a comic share one row: quantity counts them and the
+    # other columns describe what they own. Duplicate rows collapse into the
+    # oldest one, and the unique index lets add_to_collection upsert.
+    cursor.execute('ALTER TABLE collection ADD COLUMN quantity INTEGER NOT NULL DEFAULT 1 CHECK (quantity > 0)')
+    cursor.execute('ALTER TABLE collection ADD COLUMN grade REAL')
+    cursor.execute('ALTER TABLE collection ADD COLUMN purchase_price REAL')
+    cursor.execute('ALTER TABLE collection ADD COLUMN acquired_on TEXT')
+    cursor.execute('''
+        UPDATE collection SET quantity = copies.quantity
+        FROM (
+            SELECT MIN(collection_id) AS collection_id, COUNT(*) AS quantity
+            FROM collection GROUP BY user_id, comic_id HAVING COUNT(*) > 1
+        ) AS copies
+        WHERE collection.collection_id = copies.collection_id
+    ''')
+    cursor.execute('''
+        DELETE FROM collection
+        WHERE collection_id NOT IN (SELECT MIN(collection_id) FROM collection GROUP BY user_id, comic_id)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_collection_user_comic')
+    cursor.execute('CREATE UNIQUE INDEX idx_collection_user_comic ON collection (user_id, comic_id)')
+
+    # A materialized value summary is rebuilt with triggers that count quantity
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'collection_value_summary'")
+    if cursor.fetchone() is not None:
+        for trigger in VALUE_SUMMARY_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        _create_value_summary(cursor)
+
+# Columns recorded in change_log for each table, key first. A comic's cached
+# cover paths are local to this server, so changing them isn't logged.
+CHANGE_LOG_COLUMNS = {
+    'volume': ('volume_id', 'name'),
+    'publisher': ('publisher_id', 'name'),
+    'series': ('series_id', 'name', 'volume_id', 'publisher_id'),
+    'comic': ('comic_id', 'series_id', 'issue_num', 'cover_price', 'current_price', 'description', 'image_url'),
+    'collection': ('collection_id', 'user_id', 'comic_id', 'quantity', 'grade', 'purchase_price', 'acquired_on'),
+}
+
+def _add_change_log(cursor):
+    # Every insert, update and delete on the catalogue and collection tables,
+    # in commit order. change_id never goes backwards or gets reused, so a
+    # client holding the last one it saw can ask for just what came after.
+    # data is the row as JSON after the change, and user_id marks collection
+    # rows so they are only synced to their owner.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            user_id INTEGER,
+            data TEXT,
+            changed_at INTEGER NOT NULL
+        )
+    ''')
+    for table, columns in CHANGE_LOG_COLUMNS.items():
+        new_user = 'new.user_id' if table == 'collection' else 'NULL'
+        old_user = 'old.user_id' if table == 'collection' else 'NULL'
+        data = 'json_object(' + ', '.join(f"'{column}', new.{column}" for column in columns) + ')'
+        # Updates that leave every logged column as it was aren't recorded
+        changed = ' OR '.join(f'new.{column} IS NOT old.{column}' for column in columns[1:])
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS change_log_{table}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO change_log (table_name, row_id, action, user_id, data, changed_at)
+                VALUES ('{table}', new.{columns[0]}, 'insert', {new_user}, {data}, CAST(strftime('%s', 'now') AS INTEGER));
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS change_log_{table}_update AFTER UPDATE OF {', '.join(columns[1:])} ON {table}
+            WHEN {changed} BEGIN
+                INSERT INTO change_log (table_name, row_id, action, user_id, data, changed_at)
+                VALUES ('{table}', new.{columns[0]}, 'update', {new_user}, {data}, CAST(strftime('%s', 'now') AS INTEGER));
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS change_log_{table}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO change_log (table_name, row_id, action, user_id, data, changed_at)
+                VALUES ('{table}', old.{columns[0]}, 'delete', {old_user}, NULL, CAST(strftime('%s', 'now') AS INTEGER));
+            END
+        ''')
+
+    # Rows written before the log existed were never recorded, so a client
+    # starting from 0 on an existing catalogue is told to pull it in full
+    cursor.execute('''
+        SELECT 1 FROM volume UNION ALL SELECT 1 FROM publisher UNION ALL SELECT 1 FROM collection LIMIT 1
+    ''')
+    if cursor.fetchone() is not None:
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', 1)")
+
+def _trigram_text(name):
+    # name as the trigram indexes store it: tabs and line breaks as spaces,
+    # runs of spaces collapsed and one space either side. _TRIGRAM_TEXT does
+    # the same in SQL; the index folds case itself.
+    for space in '\t\n\r':
+        name = name.replace(space, ' ')
+    return f" {' '.join(word for word in name.split(' ') if word)} "
+
+# SQL for _trigram_text() of the column {}. Spaces get a \x01 marker after
+# them, a marker followed by a space is dropped and so is any left over,
+# which leaves one space from every run.
+_TRIGRAM_TEXT = (
+    "' ' || trim(replace(replace(replace("
+    "replace(replace(replace({}, char(9), ' '), char(10), ' '), char(13), ' '), "
+    "' ', ' ' || char(1)), char(1) || ' ', ''), char(1), '')) || ' '"
+)
+
+def _trigrams(name):
+    # The set of three letter runs in a name, lower cased and normalised as
+    # the trigram indexes store it
+    text = _trigram_text(name.lower())
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+# table -> (trigram index, its term statistics, key column) for find_similar()
+SIMILAR_TABLES = {
+    'publisher': ('publisher_trigrams', 'publisher_trigram_terms', 'publisher_id'),
+    'series': ('series_trigrams', 'series_trigram_terms', 'series_id'),
+}
+
+def _add_name_trigrams(cursor):
+    # Trigram indexes over publisher and series names for find_similar(). The
+    # name is stored with a space either side so word starts and ends count
+    # as trigrams too; the vocab tables give how many names hold each one.
+    for table, (index, terms, key) in SIMILAR_TABLES.items():
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(name, tokenize='trigram')")
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {terms} USING fts5vocab({index}, 'row')")
+        cursor.execute(f"INSERT INTO {index} (rowid, name) SELECT {key}, ' ' || name || ' ' FROM {table}")
+
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {index} (rowid, name) VALUES (new.{key}, ' ' || new.name || ' ');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF name ON {table} BEGIN
+                DELETE FROM {index} WHERE rowid = old.{key};
+                INSERT INTO {index} (rowid, name) VALUES (new.{key}, ' ' || new.name || ' ');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM {index} WHERE rowid = old.{key};
+            END
+        ''')
+
+def _normalise_name_trigrams(cursor):
+    # The trigram indexes first stored names as written, while queries
+    # collapse whitespace, so a name with doubled spaces or a tab held
+    # trigrams no query could produce. The triggers are replaced and the
+    # indexes rebuilt from the normalised names.
+    for table, (index, terms, key) in SIMILAR_TABLES.items():
+        for action in ('insert', 'update', 'delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {index}_{action}')
+        cursor.execute(f'DELETE FROM {index}')
+        cursor.execute(f'INSERT INTO {index} (rowid, name) SELECT {key}, {_TRIGRAM_TEXT.format("name")} FROM {table}')
+
+        cursor.execute(f'''
+            CREATE TRIGGER {index}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {index} (rowid, name) VALUES (new.{key}, {_TRIGRAM_TEXT.format("new.name")});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER {index}_update AFTER UPDATE OF name ON {table} BEGIN
+                DELETE FROM {index} WHERE rowid = old.{key};
+                INSERT INTO {index} (rowid, name) VALUES (new.{key}, {_TRIGRAM_TEXT.format("new.name")});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER {index}_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM {index} WHERE rowid = old.{key};
+            END
+        ''')
+
+# Schema migrations in order; the database's PRAGMA user_version records how
+# many of them have been applied. Only ever append to this list.
+MIGRATIONS = [
+    _add_lookup_indexes,
+    _add_comic_search,
+    _add_price_history,
+    _hash_passwords,
+    _add_delete_actions,
+    _add_cover_cache,
+    _add_collection_quantities,
+    _add_change_log,
+    _add_name_trigrams,
+    _normalise_name_trigrams,
+]
+
+# Connection settings applied by Manager.connect(). WAL lets readers carry on
+# while a write commits, and synchronous=NORMAL only fsyncs at checkpoints.
+PRAGMA_PROFILES = {
+    'default': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 256 * 1024 * 1024,
+        'busy_timeout': 5000,
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -16000,
+        'busy_timeout': 5000,
+    },
+    # SQLite's own defaults: rollback journal and a full fsync per commit
+    'legacy': {},
+}
+
+# Set by create_comicdb() on a new database and by maintain(full=True), so
+# maintain() can return free pages a few at a time. Setting it takes the write
+# lock, so it is not part of the per-connection pragmas.
+AUTO_VACUUM = 'INCREMENTAL'
+
+# Rows per page for the show_*_page methods and per fetch for the iter_* ones
+PAGE_SIZE = 50
+CHUNK_SIZE = 1000
+
+# Default share of trigrams two names need in common to count as similar,
+# enough for 'Marvel' and 'Marvel Comics'
+SIMILAR_THRESHOLD = 0.4
+# Most names scored per find_similar() call
+SIMILAR_CANDIDATES = 2000
+
+COMIC_FIELDS = ('image_url', 'description', 'series_id', 'current_price', 'issue_num', 'cover_price')
 
 class Manager:
-    def __init__(self, db_name='comicdb.db'):
+    def __init__(self, db_name='comicdb.db', profile='default', password_cost=None):
         self.db_name = db_name
+        # A PRAGMA_PROFILES name or a dict of pragma -> value
+        self.pragmas = PRAGMA_PROFILES[profile] if isinstance(profile, str) else dict(profile)
+        # scrypt n, r and p for new hashes; older hashes are upgraded at login
+        self.password_cost = dict(password_cost or PASSWORD_COST)
         self.username = None
         self.user_id = None
         self.clearance_level = None
+        self.tokens = SessionTokens()
+
+        # One persistent connection per thread, opened lazily by connect()
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._migrated = False
+
+        # In-process copies of the rarely changing reference tables
+        self._cache = {}
+        self._cache_generation = 0
+        self._cache_stats = {}
+
+        # Set by enable_group_commit()
+        self._write_queue = None
+        # Set by enable_metrics()
+        self.metrics = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _open(self):
+        # A new connection with the profile's pragmas applied.
+        # check_same_thread is off so close() can release every thread's
+        # connection; each connection is still only used by its own thread
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        conn.execute('PRAGMA foreign_keys = ON')
+        if self.metrics is not None:
+            conn.set_trace_callback(self.metrics.trace)
+        return conn
 
     def connect(self):
-        return sqlite3.connect(self.db_name)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+            if not self._migrated:
+                self._migrate(conn)
+        return conn
+
+    def close(self):
+        self.disable_group_commit()
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+        for conn in connections:
+            conn.close()
+        # Connections belonging to other threads are reopened on their next call
+        self._local = threading.local()
+
+    def release(self):
+        # Closes the calling thread's connection, for threads about to finish
+        # such as the server's per-client ones; a later connect() reopens it
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._connections = [other for other in self._connections if other is not conn]
+        conn.close()
+
+    def enable_group_commit(self, max_batch=256, max_delay=0.0):
+        # Routes add_comic and add_to_collection through a WriteQueue so writes
+        # from many threads are committed together. max_delay bounds how long
+        # a write may wait for others to join its commit.
+        if self._write_queue is None:
+            self._write_queue = WriteQueue(self.connect, max_batch, max_delay)
+
+    def disable_group_commit(self):
+        if self._write_queue is not None:
+            self._write_queue.close()
+            self._write_queue = None
+
+    def enable_metrics(self, slow_ms=None):
+        # Instruments every public method until disable_metrics(); calls taking
+        # slow_ms or longer are logged to the comicdb.slow logger with their SQL
+        from comic_metrics import Metrics
+
+        if self.metrics is None:
+            self.metrics = Metrics(self, slow_ms)
+            self.metrics.attach()
+        self.metrics.slow_ms = slow_ms
+        return self.metrics
+
+    def disable_metrics(self):
+        if self.metrics is not None:
+            self.metrics.detach()
+            self.metrics = None
+
+    def _write(self, sql, params):
+        # A single-statement write, grouped with others when group commit is on
+        if self._write_queue is not None:
+            return self._write_queue.execute(sql, params)
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        # A statement with a RETURNING clause gives back its first value instead
+        return rows[0][0] if rows else cursor.lastrowid
+
+    def migrate(self):
+        self._migrate(self.connect())
+
+    def _migrate(self, conn):
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'collection'")
+        if cursor.fetchone() is None:
+            # Nothing to upgrade until create_comicdb() has built the tables
+            return
+
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        # Migrations rebuild tables, which must not trigger foreign key actions.
+        # The pragma can only change outside a transaction.
+        cursor.execute('PRAGMA foreign_keys = OFF')
+        try:
+            while version < len(MIGRATIONS):
+                # Take the write lock first so concurrent processes migrate once
+                cursor.execute('BEGIN IMMEDIATE')
+                version = cursor.execute('PRAGMA user_version').fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    conn.rollback()
+                    break
+                try:
+                    MIGRATIONS[version](cursor)
+                    version += 1
+                    cursor.execute(f'PRAGMA user_version = {version}')
+                except Exception:
+                    conn.rollback()
+                    raise
+                conn.commit()
+        finally:
+            cursor.execute('PRAGMA foreign_keys = ON')
+
+        self._migrated = True
+
+    def _cached_rows(self, table, sql, record=None):
+        # Served from memory until an add_*, update_* or delete_* call on the
+        # table invalidates it. Writes from other processes are not seen.
+        with self._lock:
+            stats = self._cache_stats.setdefault(table, {'hits': 0, 'misses': 0})
+            rows = self._cache.get(table)
+            if rows is not None:
+                stats['hits'] += 1
+                return list(rows)
+            stats['misses'] += 1
+            generation = self._cache_generation
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(sql)
+        rows = cursor.fetchall() if record is None else build_records(record, cursor)
+
+        with self._lock:
+            # Skip storing if the table was written to while we were reading
+            if generation == self._cache_generation:
+                self._cache[table] = rows
+        return list(rows)
+
+    def _cached_ids(self, table, load_rows):
+        # name -> id for a cached table; the first id wins for repeated names
+        key = f'{table}_ids'
+        with self._lock:
+            stats = self._cache_stats.setdefault(key, {'hits': 0, 'misses': 0})
+            ids = self._cache.get(key)
+            if ids is not None:
+                stats['hits'] += 1
+                return ids
+            stats['misses'] += 1
+            generation = self._cache_generation
+
+        ids = {}
+        for row in load_rows():
+            ids.setdefault(row[1], row[0])
+
+        with self._lock:
+            if generation == self._cache_generation:
+                self._cache[key] = ids
+        return ids
+
+    def invalidate_cache(self, *tables):
+        # Drops the cached copies of the given tables, or of all of them
+        with self._lock:
+            self._cache_generation += 1
+            if tables:
+                for table in tables:
+                    self._cache.pop(table, None)
+                    self._cache.pop(f'{table}_ids', None)
+            else:
+                self._cache.clear()
+
+    def cache_stats(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._cache_stats.items()}
+
+    def publisher_ids(self):
+        # The returned dicts are shared with the cache, copy them before changing
+        return self._cached_ids('publisher', self.show_all_publishers)
+
+    def volume_ids(self):
+        return self._cached_ids('volume', self.show_all_volumes)
+
+    def series_ids(self):
+        return self._cached_ids('series', self.show_all_series)
+
+    def _update_row(self, table, key, row_id, fields):
+        # One UPDATE for every supplied field; None means leave the column as is
+        fields = {name: value for name, value in fields.items() if value is not None}
+        if not fields:
+            return
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        try:
+            cursor.execute(f'UPDATE {table} SET {assignments} WHERE {key} = ?', (*fields.values(), row_id))
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+
+    def _fetch_page(self, sql, params, record=None):
+        # Keyset pagination: callers pass the last key they saw as after_id.
+        # Rows come back as record instances when a Record class is given.
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(sql, params)
+        return cursor.fetchall() if record is None else list(map(record, cursor))
+
+    def _iter_rows(self, sql, params, chunk_size, record=None):
+        # Streams rows from a dedicated cursor, chunk_size rows at a time
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows if record is None else map(record, rows)
+        finally:
+            cursor.close()
+
+    def _fetch_all(self, sql, params, record, columnar=False):
+        # Every row as a list of records, or as Columns when columnar
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(sql, params)
+        if columnar:
+            return Columns.from_cursor(record, cursor)
+        return build_records(record, cursor)
+
+    def _insert_bulk(self, sql, rows):
+        # All rows go in with one executemany inside a single transaction
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            cursor.executemany(sql, rows)
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        return cursor.rowcount
 
     def create_comicdb(self):
         conn = self.connect()
         cursor = conn.cursor()
 
+        cursor.execute('SELECT 1 FROM sqlite_master LIMIT 1')
+        if cursor.fetchone() is None:
+            # A new database; the VACUUM applies auto_vacuum now that WAL has
+            # already written the header
+            cursor.execute(f'PRAGMA auto_vacuum = {AUTO_VACUUM}')
+            cursor.execute('VACUUM')
+
         # Create volume table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS volume (
@@ -78,293 +912,1142 @@ class Manager:
         ''')
 
         conn.commit()
-        conn.close()
+        self._migrate(conn)
     
     def reset_data(self):
         conn = self.connect()
         cursor = conn.cursor()
 
-        # Delete all rows from each table
-        cursor.execute('DELETE FROM volume')
-        cursor.execute('DELETE FROM publisher')
-        cursor.execute('DELETE FROM series')
-        cursor.execute('DELETE FROM comic')
-        cursor.execute('DELETE FROM user WHERE username != ?', ('admin',))
-        cursor.execute('DELETE FROM collection')
+        # Delete all rows from each table, children before the rows they reference
+        try:
+            cursor.execute('DELETE FROM collection')
+            cursor.execute('DELETE FROM comic')
+            cursor.execute('DELETE FROM series')
+            cursor.execute('DELETE FROM publisher')
+            cursor.execute('DELETE FROM volume')
+            cursor.execute('DELETE FROM user WHERE username != ?', ('admin',))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
+        self.invalidate_cache()
+        self.tokens.clear()
+
+    def sweep_orphans(self):
+        # Deletes rows left pointing at missing parents, from before foreign
+        # keys were enforced, in one transaction. Returns the count per table.
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        counts = {}
+        try:
+            cursor.execute('''
+                DELETE FROM series
+                WHERE NOT EXISTS (SELECT 1 FROM volume v WHERE v.volume_id = series.volume_id)
+                OR NOT EXISTS (SELECT 1 FROM publisher p WHERE p.publisher_id = series.publisher_id)
+            ''')
+            counts['series'] = cursor.rowcount
+            # Removing a comic cascades to its collection rows
+            cursor.execute('''
+                DELETE FROM comic WHERE NOT EXISTS (SELECT 1 FROM series s WHERE s.series_id = comic.series_id)
+            ''')
+            counts['comic'] = cursor.rowcount
+            cursor.execute('''
+                DELETE FROM collection
+                WHERE NOT EXISTS (SELECT 1 FROM user u WHERE u.user_id = collection.user_id)
+                OR NOT EXISTS (SELECT 1 FROM comic c WHERE c.comic_id = collection.comic_id)
+            ''')
+            counts['collection'] = cursor.rowcount
+            cursor.execute('''
+                DELETE FROM price_history WHERE NOT EXISTS (SELECT 1 FROM comic c WHERE c.comic_id = price_history.comic_id)
+            ''')
+            counts['price_history'] = cursor.rowcount
+            cursor.execute('DELETE FROM comic_search WHERE rowid NOT IN (SELECT comic_id FROM comic)')
+            counts['comic_search'] = cursor.rowcount
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        self.invalidate_cache()
+        return counts
+
+    def snapshot(self, path, pages=1024, progress=None):
+        # Copies the database to path with the backup API, pages at a time.
+        # The copy is read inside one read transaction, so it is consistent
+        # and, in WAL mode, writers carry on meanwhile; without it every write
+        # from another connection would restart the backup.
+        source = sqlite3.connect(self.db_name, isolation_level=None)
+        target = sqlite3.connect(path)
+        try:
+            source.execute('BEGIN')
+            source.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+            source.backup(target, pages=pages, progress=progress)
+            source.execute('COMMIT')
+        finally:
+            target.close()
+            source.close()
+
+    def maintain(self, vacuum_pages=1000, analyze=True, full=False):
+        # Incremental upkeep, cheap enough to run often: frees up to
+        # vacuum_pages unused pages and refreshes planner statistics for
+        # tables that need it. full=True runs a complete VACUUM and ANALYZE,
+        # which also switches older databases to incremental auto_vacuum.
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        free_before = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        try:
+            if full:
+                cursor.execute(f'PRAGMA auto_vacuum = {AUTO_VACUUM}')
+                cursor.execute('VACUUM')
+                if analyze:
+                    cursor.execute('ANALYZE')
+            else:
+                if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                    # execute() would only step the pragma once, freeing one page
+                    conn.executescript(f'PRAGMA incremental_vacuum({int(vacuum_pages)})')
+                if analyze:
+                    # Bounds the rows each ANALYZE samples
+                    cursor.execute('PRAGMA analysis_limit = 1000')
+                    cursor.execute('PRAGMA optimize')
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+        free_after = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        return {'pages_freed': free_before - free_after, 'free_pages': free_after}
 
     def add_user(self, username, password):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO user (username, password, clearance_level) VALUES (?, ?, 1)
-        ''', (username, password))
+        try:
+            cursor.execute('''
+                INSERT INTO user (username, password, clearance_level) VALUES (?, ?, 1)
+            ''', (username, hash_password(password, **self.password_cost)))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
 
     def add_admin(self, username, password):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO user (username, password, clearance_level) VALUES (?, ?, 5)
-        ''', (username, password))
+        try:
+            cursor.execute('''
+                INSERT INTO user (username, password, clearance_level) VALUES (?, ?, 5)
+            ''', (username, hash_password(password, **self.password_cost)))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
-    
-    def add_series(self, name, volume_id, publisher_id):
+
+    def change_password(self, user_id, password):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO series (name, volume_id, publisher_id) VALUES (?, ?, ?)
-        ''', (name, volume_id, publisher_id))
+        try:
+            cursor.execute('''
+                UPDATE user SET password = ? WHERE user_id = ?
+            ''', (hash_password(password, **self.password_cost), user_id))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
+        # Sessions signed in with the old password end with it
+        self.tokens.revoke_user(user_id)
 
-    def show_all_series(self):
+    def delete_user(self, user_id):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
+        # The user's collection goes with them
+        try:
+            cursor.execute('''
+                DELETE FROM user WHERE user_id = ?
+            ''', (user_id,))
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        self.tokens.revoke_user(user_id)
+    
+    def add_series(self, name, volume_id, publisher_id):
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('''
+                INSERT INTO series (name, volume_id, publisher_id) VALUES (?, ?, ?)
+            ''', (name, volume_id, publisher_id))
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        self.invalidate_cache('series')
+        return cursor.lastrowid
+
+    def add_series_bulk(self, series):
+        # series is an iterable of (name, volume_id, publisher_id)
+        count = self._insert_bulk('''
+            INSERT INTO series (name, volume_id, publisher_id) VALUES (?, ?, ?)
+        ''', series)
+        self.invalidate_cache('series')
+        return count
+
+    def show_all_series(self):
+        series = self._cached_rows('series', '''
             SELECT * FROM series
-        ''')
-        series = cursor.fetchall()
-        conn.close()
+        ''', Series)
         return series
 
+    def show_series_page(self, after_id=0, limit=PAGE_SIZE):
+        return self._fetch_page('''
+            SELECT * FROM series WHERE series_id > ? ORDER BY series_id LIMIT ?
+        ''', (after_id, limit), Series)
+
+    def iter_series(self, chunk_size=CHUNK_SIZE):
+        return self._iter_rows('''
+            SELECT * FROM series ORDER BY series_id
+        ''', (), chunk_size, Series)
+
+    def iter_series_details(self, chunk_size=CHUNK_SIZE):
+        # (series_id, name, volume, publisher), as the series importer reads them
+        return self._iter_rows('''
+            SELECT s.series_id, s.name, v.name, p.name
+            FROM series s
+            INNER JOIN volume v ON v.volume_id = s.volume_id
+            INNER JOIN publisher p ON p.publisher_id = s.publisher_id
+            ORDER BY s.series_id
+        ''', (), chunk_size)
+
     def add_publisher(self, name):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO publisher (name) VALUES (?)
-        ''', (name,))
+        try:
+            cursor.execute('''
+                INSERT INTO publisher (name) VALUES (?)
+            ''', (name,))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
+        self.invalidate_cache('publisher')
+        return cursor.lastrowid
+
+    def add_publishers_bulk(self, names):
+        count = self._insert_bulk('''
+            INSERT INTO publisher (name) VALUES (?)
+        ''', ((name,) for name in names))
     
-    def show_all_publishers(self):
-        conn = self.connect()
-        cursor = conn.cursor()
+        self.invalidate_cache('publisher')
+        return count
 
-        cursor.execute('''
+    def show_all_publishers(self):
+        publishers = self._cached_rows('publisher', '''
             SELECT * FROM publisher
-        ''')
+        ''', Publisher)
+        return publishers
 
-        publishers = cursor.fetchall()
+    def show_publishers_page(self, after_id=0, limit=PAGE_SIZE):
+        return self._fetch_page('''
+            SELECT * FROM publisher WHERE publisher_id > ? ORDER BY publisher_id LIMIT ?
+        ''', (after_id, limit), Publisher)
 
-        conn.close()
-        return publishers
+    def iter_publishers(self, chunk_size=CHUNK_SIZE):
+        return self._iter_rows('''
+            SELECT * FROM publisher ORDER BY publisher_id
+        ''', (), chunk_size, Publisher)
 
     def add_volume(self, num):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO volume (name) VALUES (?)
-        ''', (f'Vol. {num}',))
+        try:
+            cursor.execute('''
+                INSERT INTO volume (name) VALUES (?)
+            ''', (f'Vol. {num}',))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
+        self.invalidate_cache('volume')
+        return cursor.lastrowid
 
-    def show_all_volumes(self):
-        conn = self.connect()
-        cursor = conn.cursor()
+    def add_volumes_bulk(self, nums):
+        count = self._insert_bulk('''
+            INSERT INTO volume (name) VALUES (?)
+        ''', ((f'Vol. {num}',) for num in nums))
+        self.invalidate_cache('volume')
+        return count
 
-        cursor.execute('''
+    def show_all_volumes(self):
+        volumes = self._cached_rows('volume', '''
             SELECT * FROM volume
-        ''')
+        ''', Volume)
+        return volumes
 
-        volumes = cursor.fetchall()
+    def show_volumes_page(self, after_id=0, limit=PAGE_SIZE):
+        return self._fetch_page('''
+            SELECT * FROM volume WHERE volume_id > ? ORDER BY volume_id LIMIT ?
+        ''', (after_id, limit), Volume)
 
-        conn.close()
-        return volumes
+    def iter_volumes(self, chunk_size=CHUNK_SIZE):
+        return self._iter_rows('''
+            SELECT * FROM volume ORDER BY volume_id
+        ''', (), chunk_size, Volume)
         
     def delete_series(self, series_id):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            DELETE FROM series WHERE series_id = ?
-        ''', (series_id,))
+        try:
+            cursor.execute('''
+                DELETE FROM series WHERE series_id = ?
+            ''', (series_id,))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
+        self.invalidate_cache('series')
 
     def delete_volume(self, volume_id):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            DELETE FROM volume WHERE volume_id = ?
-        ''', (volume_id,))
+        # Raises sqlite3.IntegrityError while a series still uses the volume
+        try:
+            cursor.execute('''
+                DELETE FROM volume WHERE volume_id = ?
+            ''', (volume_id,))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
+        self.invalidate_cache('volume')
 
     def delete_publisher(self, publisher_id):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            DELETE FROM publisher WHERE publisher_id = ?
-        ''', (publisher_id,))
+        # Raises sqlite3.IntegrityError while a series still uses the publisher
+        try:
+            cursor.execute('''
+                DELETE FROM publisher WHERE publisher_id = ?
+            ''', (publisher_id,))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
-
-    def show_all_comics(self):
-        conn = self.connect()
-        cursor = conn.cursor()
+        self.invalidate_cache('publisher')
 
-        cursor.execute('''
-            SELECT c.comic_id, s.name, c.issue_num 
+    def show_all_comics(self, columnar=False):
+        # columnar returns Columns instead of a list, for very large catalogues
+        comics = self._fetch_all('''
+            SELECT c.comic_id, s.name, c.issue_num
             FROM comic c
             INNER JOIN series s ON s.series_id = c.series_id
-        ''')
-
-        comics = cursor.fetchall()
-
-        conn.close()
+        ''', (), Comic, columnar)
         if comics:
             return comics
         else:
             return None
 
+    def show_comics_page(self, after_id=0, limit=PAGE_SIZE):
+        return self._fetch_page('''
+            SELECT c.comic_id, s.name, c.issue_num
+            FROM comic c
+            INNER JOIN series s ON s.series_id = c.series_id
+            WHERE c.comic_id > ?
+            ORDER BY c.comic_id
+            LIMIT ?
+        ''', (after_id, limit), Comic)
+
+    def show_covers_page(self, after_id=0, limit=PAGE_SIZE):
+        # (comic_id, series name, issue_num, image_url, image_path, thumb_path);
+        # the paths are relative to the ImageStore root and None until cached
+        return self._fetch_page('''
+            SELECT c.comic_id, s.name, c.issue_num, c.image_url, c.image_path, c.thumb_path
+            FROM comic c
+            INNER JOIN series s ON s.series_id = c.series_id
+            WHERE c.comic_id > ?
+            ORDER BY c.comic_id
+            LIMIT ?
+        ''', (after_id, limit))
+
+    def iter_comics(self, chunk_size=CHUNK_SIZE):
+        return self._iter_rows('''
+            SELECT c.comic_id, s.name, c.issue_num
+            FROM comic c
+            INNER JOIN series s ON s.series_id = c.series_id
+            ORDER BY c.comic_id
+        ''', (), chunk_size, Comic)
+
+    def iter_comic_details(self, chunk_size=CHUNK_SIZE):
+        # Every comic with its names spelled out, in the columns the comics
+        # importer reads: (comic_id, series, volume, publisher, issue_num,
+        # cover_price, current_price, description, image_url)
+        return self._iter_rows('''
+            SELECT c.comic_id, s.name, v.name, p.name, c.issue_num,
+                c.cover_price, c.current_price, c.description, c.image_url
+            FROM comic c
+            INNER JOIN series s ON s.series_id = c.series_id
+            INNER JOIN volume v ON v.volume_id = s.volume_id
+            INNER JOIN publisher p ON p.publisher_id = s.publisher_id
+            ORDER BY c.comic_id
+        ''', (), chunk_size)
+
     def delete_comic(self, comic_id):
         conn = self.connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            DELETE FROM comic WHERE comic_id = ?
-        ''', (comic_id,))
+        try:
+            cursor.execute('''
+                DELETE FROM comic WHERE comic_id = ?
+            ''', (comic_id,))
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
 
     def add_comic(self, series_id, issue_num, cover_price):
-        conn = self.connect()
-        cursor = conn.cursor()
-
-        cursor.execute('''
+        return self._write('''
             INSERT INTO comic (series_id, issue_num, cover_price) VALUES (?, ?, ?)
         ''', (series_id, issue_num, cover_price))
 
-        conn.commit()
-        conn.close()
+    def add_comics_bulk(self, comics):
+        # comics is an iterable of (series_id, issue_num, cover_price), optionally
+        # followed by current_price, description and image_url
+        return self._insert_bulk('''
+            INSERT INTO comic (series_id, issue_num, cover_price, current_price, description, image_url)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (tuple(comic) + (None,) * (6 - len(comic)) for comic in comics))
 
     def update_comic(self, comic_id, image_url=None, description=None, series_id=None, current_price=None, issue_num=None, cover_price=None):
+        self._update_row('comic', 'comic_id', comic_id, {
+            'image_url': image_url,
+            'description': description,
+            'series_id': series_id,
+            'current_price': current_price,
+            'issue_num': issue_num,
+            'cover_price': cover_price,
+        })
+
+    def update_comics_bulk(self, updates):
+        # updates is an iterable of dicts holding comic_id plus the fields to
+        # change, e.g. {'comic_id': 4, 'current_price': 3.5}. Edits touching the
+        # same fields share one executemany, all inside a single transaction.
+        groups = {}
+        for update in updates:
+            fields = tuple(sorted(
+                name for name, value in update.items() if name != 'comic_id' and value is not None
+            ))
+            unknown = set(fields).difference(COMIC_FIELDS)
+            if unknown:
+                raise ValueError(f'Unknown comic fields: {", ".join(sorted(unknown))}')
+            if fields:
+                groups.setdefault(fields, []).append(
+                    tuple(update[name] for name in fields) + (update['comic_id'],)
+                )
+
         conn = self.connect()
         cursor = conn.cursor()
 
-        if image_url:
-            cursor.execute('UPDATE comic SET image_url = ? WHERE comic_id = ?', (image_url, comic_id))
-        if description:
-            cursor.execute('UPDATE comic SET description = ? WHERE comic_id = ?', (description, comic_id))
-        if series_id:
-            cursor.execute('UPDATE comic SET series_id = ? WHERE comic_id = ?', (series_id, comic_id))
-        if current_price:
-            cursor.execute('UPDATE comic SET current_price = ? WHERE comic_id = ?', (current_price, comic_id))
-        if issue_num:
-            cursor.execute('UPDATE comic SET issue_num = ? WHERE comic_id = ?', (issue_num, comic_id))
-        if cover_price:
-            cursor.execute('UPDATE comic SET cover_price = ? WHERE comic_id = ?', (cover_price, comic_id))
+        count = 0
+        try:
+            for fields, rows in groups.items():
+                assignments = ', '.join(f'{name} = ?' for name in fields)
+                cursor.executemany(f'UPDATE comic SET {assignments} WHERE comic_id = ?', rows)
+                count += cursor.rowcount
+        except Exception:
+            conn.rollback()
+            raise
 
         conn.commit()
-        conn.close()
+        return count
     
-    def add_to_collection(self, comic_id):
+    def refresh_prices(self, prices):
+        # prices is an iterable of (comic_id, price); one transaction, and the
+        # price_history triggers record every price that actually changed
+        return self.update_comics_bulk(
+            {'comic_id': comic_id, 'current_price': price} for comic_id, price in prices
+        )
+
+    def record_prices(self, points):
+        # Backfills history from (comic_id, recorded_at, price) points, where
+        # recorded_at is unix seconds. comic.current_price is left alone.
+        return self._insert_bulk('''
+            INSERT OR REPLACE INTO price_history (comic_id, recorded_at, price) VALUES (?, ?, ?)
+        ''', points)
+
+    def get_price_history(self, comic_id, start=None, end=None):
+        # [(recorded_at, price)] oldest first, optionally within [start, end]
         conn = self.connect()
         cursor = conn.cursor()
 
         cursor.execute('''
-            INSERT INTO collection (user_id, comic_id) VALUES (?, ?)
-        ''', (self.user_id, comic_id))
+            SELECT recorded_at, price FROM price_history
+            WHERE comic_id = ? AND recorded_at >= ? AND recorded_at <= ?
+            ORDER BY recorded_at
+        ''', (comic_id, start if start is not None else 0, end if end is not None else 2 ** 62))
 
-        conn.commit()
-        conn.close()
+        history = cursor.fetchall()
+        return history
 
-    def show_user_comics(self):
+    def get_series_price_history(self, series_id, start=None, end=None):
+        # [(comic_id, recorded_at, price)] for every comic in the series
         conn = self.connect()
         cursor = conn.cursor()
 
         cursor.execute('''
-            SELECT s.name AS series_name, c.issue_num
+            SELECT ph.comic_id, ph.recorded_at, ph.price
+            FROM comic c
+            INNER JOIN price_history ph ON ph.comic_id = c.comic_id
+            WHERE c.series_id = ? AND ph.recorded_at >= ? AND ph.recorded_at <= ?
+            ORDER BY ph.comic_id, ph.recorded_at
+        ''', (series_id, start if start is not None else 0, end if end is not None else 2 ** 62))
+
+        history = cursor.fetchall()
+        return history
+
+    def latest_price(self, comic_id, at=None):
+        # (recorded_at, price) of the newest point, or the newest at or before `at`
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT recorded_at, price FROM price_history
+            WHERE comic_id = ? AND recorded_at <= ?
+            ORDER BY recorded_at DESC
+            LIMIT 1
+        ''', (comic_id, at if at is not None else 2 ** 62))
+
+        price = cursor.fetchone()
+        return price
+
+    def compact_price_history(self, older_than_days=365):
+        # Points older than the cutoff are downsampled to the last point of
+        # each month per comic. Returns the number of points removed.
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cutoff = int(time.time()) - older_than_days * 86400
+        try:
+            cursor.execute('''
+                DELETE FROM price_history
+                WHERE recorded_at < :cutoff
+                AND (comic_id, recorded_at) NOT IN (
+                    SELECT comic_id, MAX(recorded_at) FROM price_history
+                    WHERE recorded_at < :cutoff
+                    GROUP BY comic_id, strftime('%Y-%m', recorded_at, 'unixepoch')
+                )
+            ''', {'cutoff': cutoff})
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        return cursor.rowcount
+
+    def add_to_collection(self, comic_id, user_id=None, quantity=1, grade=None, purchase_price=None, acquired_on=None):
+        # Adds quantity copies to the user's row for the comic, creating it if
+        # needed; grade, purchase_price and acquired_on replace the stored
+        # values when given. Returns the collection_id.
+        if quantity < 1:
+            raise ValueError('quantity must be at least 1')
+        return self._write('''
+            INSERT INTO collection (user_id, comic_id, quantity, grade, purchase_price, acquired_on)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, comic_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                grade = COALESCE(excluded.grade, grade),
+                purchase_price = COALESCE(excluded.purchase_price, purchase_price),
+                acquired_on = COALESCE(excluded.acquired_on, acquired_on)
+            RETURNING collection_id
+        ''', (self.user_id if user_id is None else user_id, comic_id, quantity, grade, purchase_price, acquired_on))
+
+    def update_collection(self, collection_id, quantity=None, grade=None, purchase_price=None, acquired_on=None,
+                          user_id=None):
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        fields = {'quantity': quantity, 'grade': grade, 'purchase_price': purchase_price, 'acquired_on': acquired_on}
+        fields = {name: value for name, value in fields.items() if value is not None}
+        if not fields:
+            return 0
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        try:
+            cursor.execute(f'UPDATE collection SET {assignments} WHERE collection_id = ? AND user_id = ?', (
+                *fields.values(), collection_id, self.user_id if user_id is None else user_id
+            ))
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        return cursor.rowcount
+
+    def delete_collection(self, collection_id, quantity=None, user_id=None):
+        # Removes quantity copies, or the whole row when quantity is None or
+        # covers every copy. Only the user's own rows are touched; returns
+        # how many rows changed.
+        if quantity is not None and quantity < 1:
+            raise ValueError('quantity must be at least 1')
+        user_id = self.user_id if user_id is None else user_id
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            changed = 0
+            if quantity is not None:
+                cursor.execute('''
+                    UPDATE collection SET quantity = quantity - ?
+                    WHERE collection_id = ? AND user_id = ? AND quantity > ?
+                ''', (quantity, collection_id, user_id, quantity))
+                changed = cursor.rowcount
+            if not changed:
+                cursor.execute('''
+                    DELETE FROM collection WHERE collection_id = ? AND user_id = ?
+                ''', (collection_id, user_id))
+                changed = cursor.rowcount
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        return changed
+
+    def show_user_comics(self, user_id=None, columnar=False):
+        # The same CollectionEntry rows as show_user_comics_page
+        return self._fetch_all('''
+            SELECT co.collection_id, s.name AS series_name, c.issue_num, co.quantity
+            FROM collection co
+            INNER JOIN comic c ON c.comic_id = co.comic_id
+            INNER JOIN series s ON c.series_id = s.series_id
+            WHERE co.user_id = ?
+            ORDER BY co.collection_id
+        ''', (self.user_id if user_id is None else user_id,), CollectionEntry, columnar)
+
+    def show_user_comics_page(self, after_id=0, limit=PAGE_SIZE, user_id=None):
+        # Rows are (collection_id, series_name, issue_num, quantity), keyed on collection_id
+        return self._fetch_page('''
+            SELECT co.collection_id, s.name AS series_name, c.issue_num, co.quantity
             FROM collection co
             INNER JOIN comic c ON c.comic_id = co.comic_id
             INNER JOIN series s ON c.series_id = s.series_id
+            WHERE co.user_id = ? AND co.collection_id > ?
+            ORDER BY co.collection_id
+            LIMIT ?
+        ''', (self.user_id if user_id is None else user_id, after_id, limit), CollectionEntry)
+
+    def iter_user_comics(self, chunk_size=CHUNK_SIZE, user_id=None):
+        return self._iter_rows('''
+            SELECT co.collection_id, s.name AS series_name, c.issue_num, co.quantity
+            FROM collection co
+            INNER JOIN comic c ON c.comic_id = co.comic_id
+            INNER JOIN series s ON c.series_id = s.series_id
+            WHERE co.user_id = ?
+            ORDER BY co.collection_id
+        ''', (self.user_id if user_id is None else user_id,), chunk_size, CollectionEntry)
+
+    def iter_collection_details(self, chunk_size=CHUNK_SIZE, user_id=None):
+        # (collection_id, comic_id, series, volume, publisher, issue_num,
+        # cover_price, current_price, quantity, grade, purchase_price,
+        # acquired_on) for each comic the user owns
+        return self._iter_rows('''
+            SELECT co.collection_id, c.comic_id, s.name, v.name, p.name, c.issue_num,
+                c.cover_price, c.current_price, co.quantity, co.grade, co.purchase_price, co.acquired_on
+            FROM collection co
+            INNER JOIN comic c ON c.comic_id = co.comic_id
+            INNER JOIN series s ON s.series_id = c.series_id
+            INNER JOIN volume v ON v.volume_id = s.volume_id
+            INNER JOIN publisher p ON p.publisher_id = s.publisher_id
             WHERE co.user_id = ?
-        ''', (self.user_id,))
+            ORDER BY co.collection_id
+        ''', (self.user_id if user_id is None else user_id,), chunk_size)
+
+    def missing_issues(self, series_id=None, user_id=None):
+        # IssueGap records for every run of issue numbers missing from the
+        # user's collection, per series they own part of, or just series_id.
+        # Runs count from issue 1 up to the series' highest catalogued issue.
+        # One window pass pairs each owned issue with the one before it (or
+        # 0), and the last owned issue of a series with the catalogue's end,
+        # so the work grows with the issues owned rather than the gap sizes.
+        conn = self.connect()
+        cursor = conn.cursor()
 
-        comics = cursor.fetchall()
+        if series_id is None:
+            owned = '''
+                SELECT c.series_id, c.issue_num
+                FROM collection co
+                INNER JOIN comic c ON c.comic_id = co.comic_id
+                WHERE co.user_id = :user_id
+            '''
+        else:
+            # Read from the series' own issues, which has an index to use
+            owned = '''
+                SELECT c.series_id, c.issue_num
+                FROM comic c
+                WHERE c.series_id = :series_id AND EXISTS (
+                    SELECT 1 FROM collection co WHERE co.user_id = :user_id AND co.comic_id = c.comic_id
+                )
+            '''
+
+        cursor.execute(f'''
+            WITH owned AS ({owned}),
+            runs AS (
+                SELECT series_id, issue_num,
+                    LAG(issue_num, 1, 0) OVER issues AS prev_num,
+                    LEAD(issue_num) OVER issues IS NULL AS last
+                FROM owned
+                WINDOW issues AS (PARTITION BY series_id ORDER BY issue_num)
+            ),
+            gaps AS (
+                SELECT series_id, prev_num AS after_num, issue_num AS before_num FROM runs
+                UNION ALL
+                SELECT series_id, issue_num,
+                    (SELECT MAX(c.issue_num) FROM comic c WHERE c.series_id = runs.series_id) + 1
+                FROM runs WHERE last
+            )
+            SELECT g.series_id, s.name, g.after_num + 1, g.before_num - 1, g.before_num - g.after_num - 1,
+                (
+                    SELECT COUNT(DISTINCT c.issue_num) FROM comic c
+                    WHERE c.series_id = g.series_id AND c.issue_num > g.after_num AND c.issue_num < g.before_num
+                )
+            FROM gaps g
+            INNER JOIN series s ON s.series_id = g.series_id
+            WHERE g.before_num > g.after_num + 1
+            ORDER BY s.name, g.series_id, g.after_num
+        ''', {'user_id': self.user_id if user_id is None else user_id, 'series_id': series_id})
+
+        gaps = build_records(IssueGap, cursor)
+        return gaps
+
+    def search_comics(self, query, limit=20):
+        # Words match as prefixes (numbers exactly), best bm25 rank first. Every
+        # match is ranked, so the cost grows with the number of matches: a few
+        # ms for selective queries, tens of ms for words in most of the catalogue.
+        terms = [f'"{word}"' if word.isdigit() else f'"{word}"*' for word in re.findall(r'\w+', query)]
+        if not terms:
+            return []
 
-        conn.close()
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT c.comic_id, s.name, c.issue_num
+            FROM (
+                SELECT rowid, rank FROM comic_search WHERE comic_search MATCH ? ORDER BY rank LIMIT ?
+            ) AS hits
+            INNER JOIN comic c ON c.comic_id = hits.rowid
+            INNER JOIN series s ON s.series_id = c.series_id
+            ORDER BY hits.rank
+        ''', (' '.join(terms), limit))
+
+        comics = list(map(Comic, cursor))
         return comics
 
-    def login_user(self, username, password):
+    def find_similar(self, name, threshold=SIMILAR_THRESHOLD, table='publisher', limit=10):
+        # SimilarName records for the publisher or series names sharing at
+        # least threshold of their trigrams with name, most similar first.
+        # Only names holding one of name's rarest trigrams are read and scored.
+        if table not in SIMILAR_TABLES:
+            raise ValueError(f'Unknown table {table!r}, expected one of {", ".join(SIMILAR_TABLES)}')
+        index, terms, key = SIMILAR_TABLES[table]
+        trigrams = _trigrams(name)
+        if not trigrams:
+            return []
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            SELECT term, doc FROM {terms} WHERE term IN ({', '.join('?' * len(trigrams))})
+        ''', list(trigrams))
+        counts = dict(cursor.fetchall())
+        # A name needing `shared` trigrams in common with name must hold one
+        # of its len - shared + 1 rarest (the epsilon keeps float error from
+        # raising shared). Those are read rarest first until SIMILAR_CANDIDATES
+        # names have been, so a name sharing only common trigrams like 'the'
+        # can be missed, but lookups stay quick however many names there are.
+        shared = math.ceil(threshold * len(trigrams) - 1e-9)
+        rarest = sorted((trigram for trigram in trigrams if counts.get(trigram)), key=counts.get)
+        probes = []
+        budget = SIMILAR_CANDIDATES
+        for trigram in rarest[:len(trigrams) - shared + 1]:
+            if probes and counts[trigram] > budget:
+                break
+            probes.append(trigram)
+            budget -= counts[trigram]
+        if not probes:
+            return []
+
+        cursor.execute(f'''
+            SELECT t.rowid, n.name
+            FROM {index} t
+            INNER JOIN {table} n ON n.{key} = t.rowid
+            WHERE {index} MATCH ?
+        ''', (' OR '.join('"' + trigram.replace('"', '""') + '"' for trigram in probes),))
+
+        matches = []
+        for row_id, other in cursor:
+            other_trigrams = _trigrams(other)
+            common = len(trigrams & other_trigrams)
+            similarity = common / (len(trigrams) + len(other_trigrams) - common)
+            if similarity >= threshold:
+                matches.append(SimilarName((row_id, other, round(similarity, 3))))
+        matches.sort(key=lambda match: (-match.similarity, match.row_id))
+        return matches[:limit]
+
+    def _merge(self, table, key, child, keep_id, merge_ids):
+        # Re-points child rows from merge_ids to keep_id and deletes the
+        # merged rows in one transaction; returns how many rows moved
+        merge_ids = [row_id for row_id in dict.fromkeys(merge_ids) if row_id != keep_id]
+        if not merge_ids:
+            return 0
+        marks = ', '.join('?' * len(merge_ids))
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(f'SELECT 1 FROM {table} WHERE {key} = ?', (keep_id,))
+            if cursor.fetchone() is None:
+                raise ValueError(f'No {table} {keep_id}')
+            cursor.execute(f'UPDATE {child} SET {key} = ? WHERE {key} IN ({marks})', (keep_id, *merge_ids))
+            moved = cursor.rowcount
+            cursor.execute(f'DELETE FROM {table} WHERE {key} IN ({marks})', merge_ids)
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        self.invalidate_cache(table, child)
+        return moved
+
+    def merge_publishers(self, keep_id, publisher_ids):
+        # Moves every series of publisher_ids to keep_id and deletes them
+        return self._merge('publisher', 'publisher_id', 'series', keep_id, publisher_ids)
+
+    def merge_series(self, keep_id, series_ids):
+        # Moves every comic of series_ids to keep_id and deletes them. Issues
+        # both series had are kept as separate comics.
+        return self._merge('series', 'series_id', 'comic', keep_id, series_ids)
+
+    def collection_value(self, user_id=None):
+        # (comics, cover_total, current_total, gain) for the user, in one pass
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT COALESCE(SUM(co.quantity), 0),
+                ROUND(COALESCE(SUM(c.cover_price * co.quantity), 0), 2),
+                ROUND(COALESCE(SUM(COALESCE(c.current_price, c.cover_price) * co.quantity), 0), 2),
+                ROUND(COALESCE(SUM((COALESCE(c.current_price, c.cover_price) - c.cover_price) * co.quantity), 0), 2)
+            FROM collection co
+            INNER JOIN comic c ON c.comic_id = co.comic_id
+            WHERE co.user_id = ?
+        ''', (self.user_id if user_id is None else user_id,))
+
+        value = cursor.fetchone()
+        return value
+
+    def collection_value_by_series(self, user_id=None):
+        # (series_id, name, comics, cover_total, current_total, gain), most valuable first
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT s.series_id, s.name, SUM(co.quantity),
+                ROUND(SUM(c.cover_price * co.quantity), 2),
+                ROUND(SUM(COALESCE(c.current_price, c.cover_price) * co.quantity), 2),
+                ROUND(SUM((COALESCE(c.current_price, c.cover_price) - c.cover_price) * co.quantity), 2) AS gain
+            FROM collection co
+            INNER JOIN comic c ON c.comic_id = co.comic_id
+            INNER JOIN series s ON s.series_id = c.series_id
+            WHERE co.user_id = ?
+            GROUP BY s.series_id
+            ORDER BY 5 DESC
+        ''', (self.user_id if user_id is None else user_id,))
+
+        series = cursor.fetchall()
+        return series
+
+    def collection_value_by_publisher(self, user_id=None):
+        # (publisher_id, name, comics, cover_total, current_total, gain), most valuable first
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT p.publisher_id, p.name, SUM(co.quantity),
+                ROUND(SUM(c.cover_price * co.quantity), 2),
+                ROUND(SUM(COALESCE(c.current_price, c.cover_price) * co.quantity), 2),
+                ROUND(SUM((COALESCE(c.current_price, c.cover_price) - c.cover_price) * co.quantity), 2)
+            FROM collection co
+            INNER JOIN comic c ON c.comic_id = co.comic_id
+            INNER JOIN series s ON s.series_id = c.series_id
+            INNER JOIN publisher p ON p.publisher_id = s.publisher_id
+            WHERE co.user_id = ?
+            GROUP BY p.publisher_id
+            ORDER BY 5 DESC
+        ''', (self.user_id if user_id is None else user_id,))
+
+        publishers = cursor.fetchall()
+        return publishers
+
+    def enable_value_summary(self):
+        # Materializes per-user totals in collection_value_summary, maintained
+        # by triggers from then on; costs a little on every collection write
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            _create_value_summary(cursor)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def disable_value_summary(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for trigger in VALUE_SUMMARY_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            cursor.execute('DROP TABLE IF EXISTS collection_value_summary')
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+
+    def value_summary(self, user_id=None):
+        # Same shape as collection_value(), read from the materialized table
+        # when enable_value_summary() has been called
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'collection_value_summary'")
+        if cursor.fetchone() is None:
+            return self.collection_value(user_id)
+
+        cursor.execute('''
+            SELECT comics, ROUND(cover_total, 2), ROUND(current_total, 2), ROUND(current_total - cover_total, 2)
+            FROM collection_value_summary WHERE user_id = ?
+        ''', (self.user_id if user_id is None else user_id,))
+
+        value = cursor.fetchone()
+        return value or (0, 0.0, 0.0, 0.0)
+
+    def change_cursor(self):
+        # The newest change_id. A client pulling the catalogue in full reads
+        # this first, then asks changes_since() for what it missed.
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0)")
+        return cursor.fetchone()[0]
+
+    def change_floor(self):
+        # The oldest cursor changes_since() can still answer from; anything
+        # older has had changes truncated away and needs a full pull
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT COALESCE(
+                (SELECT MIN(change_id) - 1 FROM change_log),
+                (SELECT seq FROM sqlite_sequence WHERE name = 'change_log'),
+                0
+            )
+        ''')
+        return cursor.fetchone()[0]
+
+    def changes_since(self, cursor_id=0, limit=1000, user_id=None):
+        # Change records for the next limit changes after cursor_id, oldest
+        # first. A row changed several times within them appears once, with
+        # its latest action and data, so a batch can hold fewer than limit.
+        # Collection changes are only included for user_id. Pass the last
+        # change_id back as cursor_id for the next batch; an empty batch means
+        # the client has caught up.
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        # The window is read in change_id order off the primary key, so each
+        # batch costs its own size however far behind the client is. The bare
+        # columns come from the row holding MAX(change_id).
+        cursor.execute('''
+            SELECT MAX(change_id), table_name, row_id, action, data
+            FROM (
+                SELECT change_id, table_name, row_id, action, data FROM change_log
+                WHERE change_id > ? AND (user_id IS NULL OR user_id = ?)
+                ORDER BY change_id
+                LIMIT ?
+            )
+            GROUP BY table_name, row_id
+            ORDER BY 1
+        ''', (cursor_id, user_id, limit))
+
+        changes = [
+            Change((change_id, table, row_id, action, json.loads(data) if data else None))
+            for change_id, table, row_id, action, data in cursor
+        ]
+        # Checked after reading, so a truncation that raced the query is caught
+        if cursor_id < self.change_floor():
+            raise ValueError(f'Changes after {cursor_id} have been truncated, pull the catalogue in full')
+        return changes
+
+    def truncate_changes(self, older_than_days=30):
+        # Drops log entries older than the retention window and returns how
+        # many went. The log is in time order, so only the rows being removed
+        # are read.
+        cutoff = int(time.time()) - older_than_days * 86400
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('''
+                DELETE FROM change_log WHERE change_id < COALESCE(
+                    (SELECT change_id FROM change_log WHERE changed_at >= ? ORDER BY change_id LIMIT 1),
+                    (SELECT MAX(change_id) + 1 FROM change_log)
+                )
+            ''', (cutoff,))
+        except Exception:
+            conn.rollback()
+            raise
+
+        conn.commit()
+        return cursor.rowcount
+
+    def authenticate(self, username, password, rehash=True):
+        # (user_id, username, clearance_level) for valid credentials, else None.
+        # Unlike login_user this leaves the Manager's session state alone.
+        # rehash=False skips the write of an outdated hash; the caller then
+        # passes the user to rehash_password() on a connection that may write.
         conn = self.connect()
         cursor = conn.cursor()
 
         cursor.execute('''
-            SELECT user_id, username, clearence_level FROM user WHERE username = ? AND password = ?
-        ''', (username, password))
+            SELECT user_id, username, clearance_level, password FROM user WHERE username = ?
+        ''', (username,))
+
+        row = cursor.fetchone()
+        if row is None:
+            # Hash anyway so unknown usernames take as long as wrong passwords
+            hash_password(password, **self.password_cost)
+            return None
+        if not verify_password(password, row[3]):
+            return None
+
+        if rehash and needs_rehash(row[3], **self.password_cost):
+            self.rehash_password(row[0], password)
+        return row[:3]
+
+    def rehash_password(self, user_id, password):
+        # Re-stores an already verified password if its hash is weaker than
+        # password_cost; True if it was rewritten
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT password FROM user WHERE user_id = ?', (user_id,))
+        row = cursor.fetchone()
+        if row is None or not needs_rehash(row[0], **self.password_cost):
+            return False
+
+        try:
+            cursor.execute('UPDATE user SET password = ? WHERE user_id = ?', (
+                hash_password(password, **self.password_cost), user_id
+            ))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        return True
+
+    def login_token(self, username, password):
+        # Checks the password once and returns (token, user); later calls pass
+        # the token to token_user() instead of re-hashing the password
+        user = self.authenticate(username, password)
+        if user is None:
+            return None
+        return self.tokens.issue(user), user
+
+    def token_user(self, token):
+        return self.tokens.lookup(token)
 
-        user = cursor.fetchone()
+    def logout_token(self, token):
+        self.tokens.revoke(token)
+
+    def login_user(self, username, password):
+        user = self.authenticate(username, password)
 
         if user:
             self.user_id = user[0]
             self.username = user[1]
             self.clearance_level = user[2]
 
-        conn.close()
-
         return user
     
     def update_volume(self, volume_id, name=None):
         conn = self.connect()
         cursor = conn.cursor()
 
-        if name:
-            cursor.execute('UPDATE volume SET name = ? WHERE volume_id = ?', (f'Vol. {name}', volume_id))
+        if name is not None:
+            try:
+                cursor.execute('UPDATE volume SET name = ? WHERE volume_id = ?', (f'Vol. {name}', volume_id))
+            except Exception:
+                conn.rollback()
+                raise
 
         conn.commit()
-        conn.close()
+        self.invalidate_cache('volume')
 
     def update_publisher(self, publisher_id, name=None):
         conn = self.connect()
         cursor = conn.cursor()
 
-        if name:
-            cursor.execute('UPDATE publisher SET name = ? WHERE publisher_id = ?', (name, publisher_id))
+        if name is not None:
+            try:
+                cursor.execute('UPDATE publisher SET name = ? WHERE publisher_id = ?', (name, publisher_id))
+            except Exception:
+                conn.rollback()
+                raise
 
         conn.commit()
-        conn.close()
+        self.invalidate_cache('publisher')
 
     def update_series(self, series_id, name=None, volume_id=None, publisher_id=None):
-        conn = self.connect()
-        cursor = conn.cursor()
-
-        if name:
-            cursor.execute('UPDATE series SET name = ? WHERE series_id = ?', (name, series_id))
-        if volume_id:
-            cursor.execute('UPDATE series SET volume_id = ? WHERE series_id = ?', (volume_id, series_id))
-        if publisher_id:
-            cursor.execute('UPDATE series SET publisher_id = ? WHERE series_id = ?', (publisher_id, series_id))
-
-        conn.commit()
-        conn.close()
+        self._update_row('series', 'series_id', series_id, {
+            'name': name,
+            'volume_id': volume_id,
+            'publisher_id': publisher_id,
+        })
+        self.invalidate_cache('series')
 
     def get_series(self, series_id):
         conn = self.connect()
         cursor = conn.cursor()
 
+        cursor.row_factory = Series.row_factory
         cursor.execute('''SELECT * FROM series WHERE series_id = ?''', (series_id,))
 
         series = cursor.fetchone()
@@ -374,7 +2057,147 @@ class Manager:
         else:
             return None
 
+def run_command(argv):
+    # Non-interactive commands, e.g. python comic_manager.py import comics issues.csv
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='comic_manager.py')
+    parser.add_argument('--db', default='comicdb.db', help='database file to use')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='bulk import a CSV or JSON Lines file')
+    import_parser.add_argument('kind', choices=('comics', 'series', 'publishers', 'volumes', 'prices'))
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=('csv', 'jsonl'), help='defaults to the file extension')
+    import_parser.add_argument('--chunk-size', type=int, default=5000)
+    import_parser.add_argument('--match-similar', type=float, metavar='THRESHOLD',
+                               help='reuse a publisher or series whose name is at least this similar, e.g. 0.6')
+
+    export_parser = commands.add_parser('export', help='stream a table to a CSV, JSON Lines or Parquet file')
+    export_parser.add_argument('kind', choices=('comics', 'series', 'publishers', 'volumes', 'collection'))
+    export_parser.add_argument('path')
+    export_parser.add_argument('--format', choices=('csv', 'jsonl', 'parquet'), help='defaults to the file extension')
+    export_parser.add_argument('--user-id', type=int, help='whose collection to export')
+    export_parser.add_argument('--chunk-size', type=int, default=5000)
+
+    snapshot_parser = commands.add_parser('snapshot', help='online backup to a new database file')
+    snapshot_parser.add_argument('path')
+    snapshot_parser.add_argument('--pages', type=int, default=1024, help='pages copied per step')
+
+    compact_parser = commands.add_parser('compact-prices', help='downsample old price history to monthly points')
+    compact_parser.add_argument('--older-than-days', type=int, default=365)
+
+    truncate_parser = commands.add_parser('truncate-changes', help='drop change log entries past the retention window')
+    truncate_parser.add_argument('--older-than-days', type=int, default=30)
+
+    commands.add_parser('sweep-orphans', help='delete rows whose parent row no longer exists')
+
+    maintain_parser = commands.add_parser('maintain', help='incremental vacuum and statistics refresh')
+    maintain_parser.add_argument('--pages', type=int, default=1000, help='most free pages to release')
+    maintain_parser.add_argument('--full', action='store_true', help='full VACUUM and ANALYZE instead')
+    maintain_parser.add_argument('--no-analyze', action='store_true')
+
+    covers_parser = commands.add_parser('cache-covers', help='download and cache comic cover images')
+    covers_parser.add_argument('--root', help='image store directory, default covers/ next to the database')
+    covers_parser.add_argument('--max-mb', type=int, default=512, help='evict least recently used covers past this size')
+    covers_parser.add_argument('--limit', type=int, help='most comics to fetch')
+    covers_parser.add_argument('--workers', type=int, default=4, help='parallel downloads')
+
+    serve_parser = commands.add_parser('serve', help='serve the database as a local JSON API')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--quiet', action='store_true', help='do not log each request')
+    serve_parser.add_argument('--metrics', action='store_true', help='instrument Manager and serve /metrics')
+    serve_parser.add_argument('--slow-ms', type=float, help='log Manager calls slower than this, implies --metrics')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        from comic_server import serve
+
+        logging.basicConfig(format='%(asctime)s %(name)s %(message)s')
+        serve(args.db, args.host, args.port, args.quiet, args.metrics, args.slow_ms)
+        return
+
+    with Manager(args.db) as manager:
+        manager.create_comicdb()
+        if args.command == 'import':
+            from comic_import import Importer
+
+            def progress(rows, rate):
+                print(f'{rows} rows ({rate:.0f} rows/sec)')
+
+            importer = Importer(manager, args.chunk_size, progress, args.match_similar)
+            importer.import_file(args.path, args.kind, args.format)
+            print(f'Imported {importer.inserted} new {args.kind} from {importer.rows} rows '
+                  f'in {importer.seconds:.2f}s ({importer.rows_per_second:.0f} rows/sec)')
+            for (table, name), existing in importer.matched.items():
+                print(f'Matched {table} {name!r} to {existing!r}')
+        elif args.command == 'export':
+            from comic_export import Exporter
+
+            if args.kind == 'collection' and args.user_id is None:
+                parser.error('exporting a collection needs --user-id')
+
+            def progress(rows, rate):
+                print(f'{rows} rows ({rate:.0f} rows/sec)')
+
+            exporter = Exporter(manager, args.chunk_size, progress)
+            try:
+                exporter.export_file(args.path, args.kind, args.format, args.user_id)
+            except ValueError as error:
+                parser.error(str(error))
+            print(f'Exported {exporter.rows} {args.kind} to {args.path} '
+                  f'in {exporter.seconds:.2f}s ({exporter.rows_per_second:.0f} rows/sec)')
+        elif args.command == 'snapshot':
+            start = time.perf_counter()
+            manager.snapshot(args.path, args.pages)
+            print(f'Snapshot written to {args.path} in {time.perf_counter() - start:.2f}s')
+        elif args.command == 'compact-prices':
+            removed = manager.compact_price_history(args.older_than_days)
+            print(f'Removed {removed} price points older than {args.older_than_days} days')
+        elif args.command == 'truncate-changes':
+            removed = manager.truncate_changes(args.older_than_days)
+            print(f'Removed {removed} change log entries older than {args.older_than_days} days')
+        elif args.command == 'cache-covers':
+            from comic_images import ImageStore
+
+            store = ImageStore(manager, args.root, args.max_mb * 1024 * 1024)
+            cached, failed = store.cache_missing(args.limit, args.workers)
+            print(f'Cached {cached} covers, {failed} failed, store holds {store.total_bytes()} bytes')
+        elif args.command == 'sweep-orphans':
+            counts = manager.sweep_orphans()
+            print(', '.join(f'{count} {table}' for table, count in counts.items()) + ' orphaned rows removed')
+        elif args.command == 'maintain':
+            result = manager.maintain(args.pages, not args.no_analyze, args.full)
+            print(f'Freed {result["pages_freed"]} pages, {result["free_pages"]} still free')
+
 if __name__ == '__main__':
+    from comic_menu import Picker
+
+    if len(sys.argv) > 1:
+        run_command(sys.argv[1:])
+        sys.exit()
+
+    def describe_name(row):
+        return row.name
+
+    def describe_comic(comic):
+        return f'{comic.series} #{comic.issue_num}'
+
+    def describe_owned(comic):
+        # Collection rows also carry how many copies are owned
+        return f'{comic.series} #{comic.issue_num} x{comic.quantity}' if comic.quantity > 1 else describe_comic(comic)
+
+    def confirm_new(matches, kind):
+        # Lists existing names close to a new one and asks before adding it
+        if not matches:
+            return True
+        print(f'Similar {kind} already exist:')
+        for match in matches:
+            print(f'  {match.name} ({match.similarity:.0%} similar)')
+        return input('Add it anyway? (y/n): ').strip().lower() == 'y'
+
     while True:
         manager = Manager()
         print('''
@@ -399,7 +2222,12 @@ if __name__ == '__main__':
         elif beginning_num == '2':
             username = input('Please enter your username: ')
             password = input('Please enter your password: ')
-            manager.add_user(username, password)
+            try:
+                manager.add_user(username, password)
+            except sqlite3.IntegrityError:
+                print('That username is already taken')
+                manager.close()
+                continue
             while True:
                 username = input('Please enter your username: ')
                 password = input('Please enter your password: ')
@@ -416,13 +2244,12 @@ if __name__ == '__main__':
         if manager.username is not None:
             while True:
                 print('What would you like to do?')
-                print('1.) Select\n2.) Insert\n3.) Delete\n4.) Update\n5.) Return to Menu')
+                print('1.) Select\n2.) Insert\n3.) Delete\n4.) Update\n5.) Search\n6.) Missing Issues\n7.) Recommendations\n8.) Return to Menu')
                 action_num = input('Please Select An option: ')
                 if action_num == '1' and manager.clearance_level > 0:
-                    collection_table = manager.show_user_comics()
-                    for comic in collection_table:
-                        print(f'{collection_table.index(comic) + 1}.) {comic[0]} #{comic[1]}')
-                    input('Hit Enter to continue')
+                    comics, cover_total, current_total, gain = manager.value_summary()
+                    print(f'\n{comics} comics worth ${current_total:.2f} (cover ${cover_total:.2f}, gain ${gain:.2f})\n')
+                    Picker.from_pages(manager.show_user_comics_page, describe_owned).choose()
                 elif action_num == '2' and manager.clearance_level > 1:
                     print('What would you like to Insert?')
                     print('1.) Volume\n2.) Publisher\n3.) Series\n4.) Comic\n5.) Add to Collection')
@@ -440,44 +2267,24 @@ if __name__ == '__main__':
                     elif crud_num == '2':
                         print('Enter Publisher')
                         name = input('Please enter a publisher name: ')
-                        manager.add_publisher(name)
-                        print("\nPublisher Successfully Added\n")
+                        if confirm_new(manager.find_similar(name), 'publishers'):
+                            manager.add_publisher(name)
+                            print("\nPublisher Successfully Added\n")
                     elif crud_num == '3':
                         print('Enter Series')
                         publishers = manager.show_all_publishers()
                         volumes = manager.show_all_volumes()
-                        while True:
-                            if publishers and volumes:
-                                while True:
-                                    print('Please select a publisher:')
-                                    for publisher in publishers:
-                                        print(f'{publishers.index(publisher) + 1}.) {publisher[1]}')
-                                    try:
-                                        publisher_num = int(input('Please Select a number: '))
-                                        if 0 <= publisher_num - 1 < len(publishers):
-                                            break
-                                        else:
-                                            print('Please enter a valid option')
-                                    except ValueError:
-                                        print("That's not a valid number. Please enter an integer.")
-                                print('Please select a Volume')
-                                while True:
-                                    for volume in volumes:
-                                        print(f'{volumes.index(volume) + 1}.) {volume[1]}')
-                                    try:
-                                        volume_num = int(input('Please Select a number: '))
-                                        if 0 <= volume_num - 1 < len(volumes):
-                                            break
-                                        else:
-                                            print('Please enter a valid option')
-                                    except ValueError:
-                                        print("That's not a valid number. Please enter an integer.")
-                                name = input('Please enter the series name: ')
-                                manager.add_series(name, volumes[volume_num-1][0], publishers[publisher_num-1][0])
+                        if publishers and volumes:
+                            print('Please select a publisher:')
+                            publisher = Picker.from_rows(publishers, describe_name).choose('Please Select a number: ')
+                            print('Please select a Volume')
+                            volume = Picker.from_rows(volumes, describe_name).choose('Please Select a number: ')
+                            name = input('Please enter the series name: ')
+                            if confirm_new(manager.find_similar(name, table='series'), 'series'):
+                                manager.add_series(name, volume.volume_id, publisher.publisher_id)
                                 print("\nSeries Successfully Added\n")
-                                break
-                            else:
-                                print('Please add a publisher and volume first')
+                        else:
+                            print('Please add a publisher and volume first')
                     elif crud_num == '4':
                         print('Enter Comic')
                         while True:
@@ -488,42 +2295,18 @@ if __name__ == '__main__':
                                 break
                             except ValueError:
                                 print('Enter a valid number')
-                        series_table = manager.show_all_series()
-                        if not series_table:
-                            print("Please add a Series")
-                            break
+                        print('\nPlease Pick a Series')
+                        series = Picker.from_pages(manager.show_series_page, describe_name).choose('Please Chose a Series Name: ')
+                        if series:
+                            manager.add_comic(series.series_id, issue_num, cover_price)
+                            print("\nComic Successfully Added\n")
                         else:
-                            if issue_num and cover_price:
-                                while True:
-                                    print('\nPlease Pick a Series')
-                                    for series in series_table:
-                                        print(f'{series_table.index(series)+1}.) {series[1]}')
-                                    try:
-                                        series_num = int(input('Please Chose a Series Name: '))
-                                        if 0 <= series_num - 1 < len(series_table):
-                                            break
-                                        else:
-                                            raise ValueError
-                                    except ValueError:
-                                        print('Enter a valid number that is in the list')
-                                manager.add_comic(series_table[series_num-1][0], issue_num, cover_price)
-                                print("\nComic Successfully Added\n")
+                            print("Please add a Series")
                     elif crud_num == '5':
                         print('Enter Collection')
-                        comics_table = manager.show_all_comics()
-                        if comics_table:
-                            while True:
-                                for comic in comics_table:
-                                    print(f'{comics_table.index(comic) + 1}.) {comic[1]} #{comic[2]}')
-                                try:
-                                    comic_num = int(input('Please choose a Comic: '))
-                                    if 0 <= comic_num - 1 < len(comics_table):
-                                        break
-                                    else:
-                                        raise ValueError
-                                except ValueError:
-                                    print('Please enter a valid number that is within the range')
-                            manager.add_to_collection(comics_table[comic_num-1][0])
+                        comic = Picker.from_pages(manager.show_comics_page, describe_comic).choose('Please choose a Comic: ')
+                        if comic:
+                            manager.add_to_collection(comic.comic_id)
                             print("\nComic Successfully Added\n")
                         else:
                             print("Please Add A Comic Before Adding to Collection")
@@ -533,188 +2316,98 @@ if __name__ == '__main__':
                     crud_num = input('Please Select an Option: ')
                     if crud_num == '1':
                         print('Delete Volume')
-                        while True:
-                            volume_table = manager.show_all_volumes()
-                            for volume in volume_table:
-                                print(f'{volume_table.index(volume)+1}.) {volume[1]}')
+                        volume = Picker.from_rows(manager.show_all_volumes(), describe_name).choose('Please Enter a Volume Number: ')
+                        if volume:
                             try:
-                                volume_num = int(input('Please Enter a Volume Number: '))
-                                if 0 <= volume_num - 1 < len(volume_table):
-                                    break
-                                else:
-                                    raise ValueError
-                            except ValueError:
-                                print("That's not a valid number. Please enter an integer.")
-                        manager.delete_volume(volume_table[volume_num-1][0])
-                        print("\nVolume Successfully Deleted\n")
+                                manager.delete_volume(volume.volume_id)
+                                print("\nVolume Successfully Deleted\n")
+                            except sqlite3.IntegrityError:
+                                print("\nThat volume still has series, delete them first\n")
+                        else:
+                            print('Please Enter a Volume First')
                     elif crud_num == '2':
                         print('Delete Publisher')
-                        publisher_table = manager.show_all_publishers()
-                        if publisher_table:
-                            while True:
-                                for publisher in publisher_table:
-                                    print(f'{publisher_table.index(publisher) + 1}.) {publisher[1]}')
-                                try:
-                                    publisher_num = int(input('Please select a publisher name: '))
-                                    if 0 <= publisher_num - 1 < len(publisher_table):
-                                        break
-                                    else:
-                                        raise ValueError
-                                except ValueError:
-                                    print('Please enter a valid number')
-                            manager.delete_publisher(publisher_table[publisher_num-1][0])
-                            print("\nPublisher Successfully Deleted\n")
+                        publisher = Picker.from_rows(manager.show_all_publishers(), describe_name).choose('Please select a publisher name: ')
+                        if publisher:
+                            try:
+                                manager.delete_publisher(publisher.publisher_id)
+                                print("\nPublisher Successfully Deleted\n")
+                            except sqlite3.IntegrityError:
+                                print("\nThat publisher still has series, delete them first\n")
+                        else:
+                            print('Please Enter a Publisher First')
                     elif crud_num == '3':
                         print('Delete Series')
-                        series_table = manager.show_all_series()
-                        if series_table:
-                            while True:
-                                for series in series_table:
-                                    print(f'{series_table.index(series) + 1}.) {series[1]}')
-                                try:
-                                    series_num = int(input('Please Select a number: '))
-                                    if 0 <= series_num - 1 < len(series_table):
-                                        break
-                                    else:
-                                        raise ValueError
-                                except ValueError:
-                                    print("That's not a valid number. Please enter an integer.")
-                            manager.delete_series(series_table[series_num-1][0])
+                        series = Picker.from_pages(manager.show_series_page, describe_name).choose('Please Select a number: ')
+                        if series:
+                            manager.delete_series(series.series_id)
                             print("\nSeries Successfully Deleted\n")
                         else:
                             print("Please Enter a Series First")
                     elif crud_num == '4':
                         print('Delete Comic')
-                        comic_table = manager.show_all_comics()
-                        if comic_table:
-                            while True:
-                                for comic in comic_table:
-                                    print(f'{comic_table.index(comic) + 1}.) {comic[1]} #{comic[2]}')
-                                try:
-                                    comic_num = int(input('Please Choose a Comic: '))
-                                    if 0 <= comic_num - 1 < len(comic_table):
-                                        break
-                                    else:
-                                        raise ValueError
-                                except ValueError:
-                                    print('Please enter a valid number that is in the list')
-                            manager.delete_comic(comic_table[comic_num-1][0])
+                        comic = Picker.from_pages(manager.show_comics_page, describe_comic).choose('Please Choose a Comic: ')
+                        if comic:
+                            manager.delete_comic(comic.comic_id)
                             print("\nComic Successfully Deleted\n")
                         else:
                             print('\nPlease Enter a Comic First\n')
                     elif crud_num == '5':
                         print('Delete From Collection')
-                        while True:
-                            collection_table = manager.show_user_comics()
-                            if collection_table:
+                        comic = Picker.from_pages(manager.show_user_comics_page, describe_owned).choose('Please Choose a Comic: ')
+                        if comic:
+                            quantity = None
+                            if comic.quantity > 1:
                                 while True:
-                                    for comic in collection_table:
-                                        print(f'{collection_table.index(comic) + 1}.) {comic[1]} #{comic[2]}')
                                     try:
-                                        comic_num = int(input('Please Choose a Comic: '))
-                                        if 0 <= comic_num - 1 < len(collection_table):
+                                        quantity = int(input(f'How many of your {comic.quantity} copies should be removed? '))
+                                        if quantity > 0:
                                             break
-                                        else:
-                                            raise ValueError
                                     except ValueError:
-                                        print('Please enter a valid number')
-                                manager.delete_collection(collection_table[comic_num-1][0])
-                                print("\nComic Successfully Deleted\n")
-                                break
-                            else:
-                                print("\nPlease Enter a Comic to Collection First\n")
-                                break
+                                        pass
+                                    print('Enter a valid number')
+                            manager.delete_collection(comic.collection_id, quantity)
+                            print("\nComic Successfully Deleted\n")
+                        else:
+                            print("\nPlease Enter a Comic to Collection First\n")
                 elif action_num == '4' and manager.clearance_level > 3:
                     print('What would you like to Update?')
-                    print('1.) Volume\n2.) Publisher\n3.) Series\n4.) Comic')
+                    print('1.) Volume\n2.) Publisher\n3.) Series\n4.) Comic\n5.) Merge Publishers\n6.) Merge Series')
                     crud_num = input('Please Select an Option: ')
                     if crud_num == '1':
                         print('Update Volume')
-                        volume_table = manager.show_all_volumes()
-                        while True:
-                            for volume in volume_table:
-                                print(f'{volume_table.index(volume) + 1}.) {volume[1]}')
-                            try:
-                                volume_num = int(input('Please Choose a Volume: '))
-                                if 0 <= volume_num - 1 < len(volume_table):
-                                    break
-                                else:
-                                    raise ValueError
-                            except ValueError:
-                                print('Please enter a valid number')
-                        while True:
-                            try:
-                                volume_id = volume_table[volume_num-1][0]
-                                volume_num = int(input('Please Enter a Volume Number: '))
-                                break
-                            except ValueError:
-                                print("That's not a valid number. Please enter an integer.")
-                        manager.update_volume(volume_id, volume_num)
-                        print("\nVolume Successfully Updated\n")
-                    elif crud_num == '2':
-                        print('Update Publisher')
-                        publisher_table = manager.show_all_publishers()
-                        if publisher_table:
+                        volume = Picker.from_rows(manager.show_all_volumes(), describe_name).choose('Please Choose a Volume: ')
+                        if volume:
                             while True:
-                                for publisher in publisher_table:
-                                    print(f'{publisher_table.index(publisher) + 1}.) {publisher[1]}')
                                 try:
-                                    publisher_num = int(input('Please Choose a Publisher: '))
-                                    if 0 <= publisher_num - 1 < len(publisher_table):
-                                        break
-                                    else:
-                                        raise ValueError
+                                    volume_num = int(input('Please Enter a Volume Number: '))
+                                    break
                                 except ValueError:
-                                    print('Please enter a valid number')
-                            publisher_id = publisher_table[publisher_num-1][0]
+                                    print("That's not a valid number. Please enter an integer.")
+                            manager.update_volume(volume.volume_id, volume_num)
+                            print("\nVolume Successfully Updated\n")
+                        else:
+                            print('Please Enter a Volume First')
+                    elif crud_num == '2':
+                        print('Update Publisher')
+                        publisher = Picker.from_rows(manager.show_all_publishers(), describe_name).choose('Please Choose a Publisher: ')
+                        if publisher:
                             name = input('Please enter a publisher name: ')
-                            manager.update_publisher(publisher_id, name)
+                            manager.update_publisher(publisher.publisher_id, name)
                             print("\nPublisher Successfully Updated\n")
                         else:
                             print('Please Enter a Publisher First')
                     elif crud_num == '3':
                         print('Update Series')
-                        series_table = manager.show_all_series()
-                        if series_table:
-                            while True:
-                                for series in series_table:
-                                    print(f'{series_table.index(series) + 1}.) {series[1]}')
-                                try:
-                                    series_num = int(input('Please Choose a Series: '))
-                                    if 0 <= series_num - 1 < len(series_table):
-                                        break
-                                    else:
-                                        raise ValueError
-                                except ValueError:
-                                    print('Please enter a valid number')
-                            series_id = series_table[series_num-1][0]
+                        series = Picker.from_pages(manager.show_series_page, describe_name).choose('Please Choose a Series: ')
+                        if series:
                             volumes = manager.show_all_volumes()
                             publishers = manager.show_all_publishers()
                             if publishers and volumes:
-                                while True:
-                                    for volume in volumes:
-                                        print(f'{volumes.index(volume) + 1}.) {volume[1]}')
-                                    try:
-                                        volume_num = int(input('Please select a Volume: '))
-                                        if 0 <= volume_num - 1 < len(volumes):
-                                            break
-                                        else:
-                                            print('Please enter a valid option')
-                                    except ValueError:
-                                        print("That's not a valid number. Please enter an integer.")
-                                while True:
-                                    for publisher in publishers:
-                                        print(f'{publishers.index(publisher) + 1}.) {publisher[1]}')
-                                    try:
-                                        publisher_num = int(input('Please select a Publisher: '))
-                                        if 0 <= publisher_num - 1 < len(publishers):
-                                            break
-                                        else:
-                                            print('Please enter a valid option')
-                                    except ValueError:
-                                        print("That's not a valid number. Please enter an integer.")
+                                volume = Picker.from_rows(volumes, describe_name).choose('Please select a Volume: ')
+                                publisher = Picker.from_rows(publishers, describe_name).choose('Please select a Publisher: ')
                                 name = input('Please enter the series name: ')
-                                manager.update_series(series_id, name, volumes[volume_num-1][0], publishers[publisher_num-1][0])
+                                manager.update_series(series.series_id, name, volume.volume_id, publisher.publisher_id)
                                 print("\nSeries Successfully Updated\n")
                             else:
                                 print('Please Add a Publisher and Volume First')
@@ -722,48 +2415,74 @@ if __name__ == '__main__':
                             print('Please Enter a Series First')
                     elif crud_num == '4':
                         print('Update Comic')
-                        comics_table = manager.show_all_comics()
-                        if comics_table:
+                        comic = Picker.from_pages(manager.show_comics_page, describe_comic).choose('Please Choose a Comic: ')
+                        if comic:
                             while True:
-                                for comic in comics_table:
-                                    print(f'{comics_table.index(comic) + 1}.) {comic[1]} #{comic[2]}')
                                 try:
-                                    comic_num = int(input('Please Choose a Comic: '))
-                                    if 0 <= comic_num - 1 < len(comics_table):
-                                        break
-                                    else:
-                                        raise ValueError
+                                    issue_num = int(input('Please enter an issue number: '))
+                                    print('Cover Price Example: 2.99')
+                                    cover_price = format(float(input('Please enter a Cover Price: ')), '.2f')
+                                    break
                                 except ValueError:
-                                    print('Please enter a valid number')
-                            series_table = manager.show_all_series()
-                            if series_table:
-                                comic_id = comics_table[comic_num-1][0]
-                                while True:
-                                    try:
-                                        issue_num = int(input('Please enter an issue number: '))
-                                        print('Cover Price Example: 2.99')
-                                        cover_price = format(float(input('Please enter a Cover Price: ')), '.2f')
-                                        break
-                                    except ValueError:
-                                        print('Enter a valid number')
-                                while True:
-                                    for series in series_table:
-                                        print(f'{series_table.index(series) + 1}.) {series[1]}')
-                                    try:
-                                        series_num = int(input('Please Pick a Series: '))
-                                        if 0 <= series_num - 1 < len(series_table):
-                                            break
-                                        else:
-                                            raise ValueError
-                                    except ValueError:
-                                        print('Enter a valid number that is in the list')
-                                manager.update_comic(comic_id, series_table[series_num-1][0], issue_num, cover_price)
+                                    print('Enter a valid number')
+                            series = Picker.from_pages(manager.show_series_page, describe_name).choose('Please Pick a Series: ')
+                            if series:
+                                manager.update_comic(comic.comic_id, series_id=series.series_id, issue_num=issue_num, cover_price=cover_price)
                                 print("\nComic Successfully Updated\n")
                             else:
                                 print("Please Add a Series First")
                         else:
                             print('Please Add a Comic First')
-                elif action_num == '5':
+                    elif crud_num == '5':
+                        print('Merge Publishers')
+                        publisher = Picker.from_rows(manager.show_all_publishers(), describe_name).choose('Please Choose the Publisher to Keep: ')
+                        if publisher:
+                            duplicates = [match for match in manager.find_similar(publisher.name) if match.row_id != publisher.publisher_id]
+                            duplicate = Picker.from_rows(duplicates, describe_name).choose('Please Choose a Publisher to Merge Into It: ')
+                            if duplicate:
+                                moved = manager.merge_publishers(publisher.publisher_id, [duplicate.row_id])
+                                print(f"\nPublishers Successfully Merged, {moved} series moved\n")
+                            else:
+                                print('No Similar Publishers Found')
+                    elif crud_num == '6':
+                        print('Merge Series')
+                        series = Picker.from_pages(manager.show_series_page, describe_name).choose('Please Choose the Series to Keep: ')
+                        if series:
+                            duplicates = [match for match in manager.find_similar(series.name, table='series') if match.row_id != series.series_id]
+                            duplicate = Picker.from_rows(duplicates, describe_name).choose('Please Choose a Series to Merge Into It: ')
+                            if duplicate:
+                                moved = manager.merge_series(series.series_id, [duplicate.row_id])
+                                print(f"\nSeries Successfully Merged, {moved} comics moved\n")
+                            else:
+                                print('No Similar Series Found')
+                elif action_num == '5' and manager.clearance_level > 0:
+                    query = input('Please enter a series, publisher, issue or description to search for: ')
+                    comics = manager.search_comics(query, PAGE_SIZE)
+                    if comics:
+                        Picker.from_rows(comics, describe_comic).choose()
+                    else:
+                        print('\nNo Comics Found\n')
+                elif action_num == '6' and manager.clearance_level > 0:
+                    gaps = manager.missing_issues()
+                    for gap in gaps:
+                        issues = f'#{gap.first_issue}' if gap.missing == 1 else f'#{gap.first_issue}-#{gap.last_issue}'
+                        print(f'{gap.series} {issues} ({gap.missing} missing, {gap.in_catalogue} in catalogue)')
+                    if not gaps:
+                        print('\nNo Missing Issues\n')
+                elif action_num == '7' and manager.clearance_level > 0:
+                    from comic_recommend import Recommender
+
+                    try:
+                        recommendations = Recommender(manager).recommend(manager.user_id)
+                    except ValueError as error:
+                        print(f'\n{error}\n')
+                        continue
+                    for recommendation in recommendations:
+                        print(f'{recommendation.series} ({recommendation.score:.2f})')
+                    if not recommendations:
+                        print('\nNo Recommendations Yet, Add More to Your Collection\n')
+                elif action_num == '8':
                     break
                 else:
-                    print("You do not have the required clearance level for this action")
\ No newline at end of file
+                    print("You do not have the required clearance level for this action")
+        manager.close()
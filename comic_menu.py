@@ -0,0 +1,87 @@
+PAGE_SIZE = 50
+
+
+class Picker:
+    # Numbered, paged and filterable menu over rows. Rows come from a source
+    # called as source(after, limit), returning a list of (key, row) pairs that
+    # continue after the given key, so a listing never has to be loaded whole.
+    def __init__(self, source, describe, page_size=PAGE_SIZE, input_func=input, print_func=print):
+        self.source = source
+        self.describe = describe
+        self.page_size = page_size
+        self.input = input_func
+        self.print = print_func
+        self.filter_text = ''
+
+    @classmethod
+    def from_rows(cls, rows, describe, **kwargs):
+        # The key is the position in the list
+        def source(after, limit):
+            return list(enumerate(rows[after:after + limit], after + 1))
+        return cls(source, describe, **kwargs)
+
+    @classmethod
+    def from_pages(cls, fetch_page, describe, **kwargs):
+        # fetch_page is a Manager.show_*_page method keyed on the row's first column
+        def source(after, limit):
+            return [(row[0], row) for row in fetch_page(after, limit)]
+        return cls(source, describe, **kwargs)
+
+    def matches(self, row):
+        return self.filter_text in self.describe(row).lower()
+
+    def load_page(self, after):
+        # Returns up to page_size matching (key, row) pairs and whether more follow
+        entries = []
+        while len(entries) <= self.page_size:
+            batch = self.source(after, self.page_size + 1)
+            if not batch:
+                break
+            after = batch[-1][0]
+            if self.filter_text:
+                entries.extend(entry for entry in batch if self.matches(entry[1]))
+            else:
+                entries.extend(batch)
+        return entries[:self.page_size], len(entries) > self.page_size
+
+    def render(self, rows, offset=0):
+        return [f'{number}.) {self.describe(row)}' for number, row in enumerate(rows, offset + 1)]
+
+    def choose(self, prompt=None):
+        # With a prompt the chosen row is returned; without one the rows are
+        # just shown. Returns None when there is nothing to pick from.
+        starts = [0]
+        while True:
+            entries, has_next = self.load_page(starts[-1])
+            if not entries and len(starts) == 1 and not self.filter_text:
+                return None
+
+            offset = (len(starts) - 1) * self.page_size
+            rows = [row for key, row in entries]
+            if rows:
+                self.print('\n'.join(self.render(rows, offset)))
+            else:
+                self.print(f'Nothing matches "{self.filter_text}"')
+
+            options = []
+            if has_next:
+                options.append('n = next page')
+            if len(starts) > 1:
+                options.append('p = previous page')
+            options.append('/text = filter')
+            self.print(', '.join(options))
+
+            choice = self.input(prompt or 'Hit Enter to continue: ').strip()
+            if choice.startswith('/'):
+                self.filter_text = choice[1:].strip().lower()
+                starts = [0]
+            elif choice.lower() == 'n' and has_next:
+                starts.append(entries[-1][0])
+            elif choice.lower() == 'p' and len(starts) > 1:
+                starts.pop()
+            elif prompt is None:
+                return None
+            elif choice.isdigit() and offset < int(choice) <= offset + len(rows):
+                return rows[int(choice) - offset - 1]
+            else:
+                self.print('Please enter a valid number that is in the list')
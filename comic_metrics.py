@@ -0,0 +1,192 @@
+import collections
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+from comic_records import Columns
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Manager methods that are plumbing rather than queries
+SKIPPED_METHODS = {'connect', 'close', 'enable_metrics', 'disable_metrics'}
+
+slow_log = logging.getLogger('comicdb.slow')
+
+
+class MethodStats:
+    __slots__ = ('calls', 'errors', 'seconds', 'rows', 'statements', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+class Metrics:
+    # Per-method call counts, latency histograms, rows returned and SQL for
+    # one Manager. attach() wraps the Manager's public methods on the instance
+    # and traces its connections; detach() puts the originals back, so a
+    # Manager without metrics runs exactly the uninstrumented code. Rows are
+    # counted for methods returning lists, Columns or iterators.
+    def __init__(self, manager, slow_ms=None, slow_kept=50):
+        self.manager = manager
+        self.slow_ms = slow_ms
+        self.slow_calls = collections.deque(maxlen=slow_kept)
+        self.methods = {}
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def attach(self):
+        for name, func in inspect.getmembers(type(self.manager), inspect.isfunction):
+            if name.startswith('_') or name in SKIPPED_METHODS:
+                continue
+            setattr(self.manager, name, self._wrap(name, getattr(self.manager, name)))
+        with self.manager._lock:
+            for conn in self.manager._connections:
+                conn.set_trace_callback(self.trace)
+
+    def detach(self):
+        for name in list(vars(self.manager)):
+            if getattr(vars(self.manager)[name], '__wrapped__', None) is not None:
+                delattr(self.manager, name)
+        with self.manager._lock:
+            for conn in self.manager._connections:
+                conn.set_trace_callback(None)
+
+    def trace(self, sql):
+        # sqlite3 trace callback: credits the statement to the innermost
+        # Manager method running on this thread
+        calls = getattr(self._local, 'calls', None)
+        if calls:
+            calls[-1].append(sql)
+
+    def _start(self):
+        # Returns the start time and the list this call's SQL is collected in
+        calls = getattr(self._local, 'calls', None)
+        if calls is None:
+            calls = self._local.calls = []
+        statements = []
+        calls.append(statements)
+        return time.perf_counter(), statements
+
+    def _finish(self, name, call, rows, failed):
+        start, statements = call
+        seconds = time.perf_counter() - start
+        # A half-read iter_* generator can finish after calls made since it
+        # started, so find this call's entry rather than popping the top
+        calls = self._local.calls
+        for index in range(len(calls) - 1, -1, -1):
+            if calls[index] is statements:
+                del calls[index]
+                if index:
+                    # Nested calls count towards the caller's SQL too
+                    calls[index - 1].extend(statements)
+                break
+
+        with self._lock:
+            stats = self.methods.get(name)
+            if stats is None:
+                stats = self.methods[name] = MethodStats()
+            stats.calls += 1
+            stats.errors += failed
+            stats.seconds += seconds
+            stats.rows += rows
+            stats.statements += len(statements)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                index = len(LATENCY_BUCKETS)
+            stats.buckets[index] += 1
+
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            self.slow_calls.append({'method': name, 'ms': round(seconds * 1000, 3), 'sql': statements})
+            slow_log.warning('%s took %.1f ms: %s', name, seconds * 1000, '; '.join(statements))
+
+    def _wrap(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            call = self._start()
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                self._finish(name, call, 0, True)
+                raise
+            if inspect.isgenerator(result):
+                return self._timed_rows(name, call, result)
+            self._finish(name, call, len(result) if isinstance(result, (list, Columns)) else 0, False)
+            return result
+        return wrapper
+
+    def _timed_rows(self, name, call, rows):
+        # iter_* methods are timed until their last row has been read
+        count = 0
+        try:
+            for row in rows:
+                count += 1
+                yield row
+        except Exception:
+            self._finish(name, call, count, True)
+            raise
+        except GeneratorExit:
+            # Closed early by the caller
+            self._finish(name, call, count, False)
+            raise
+        self._finish(name, call, count, False)
+
+    def reset(self):
+        with self._lock:
+            self.methods = {}
+            self.slow_calls.clear()
+
+    def snapshot(self):
+        with self._lock:
+            methods = {}
+            for name, stats in sorted(self.methods.items()):
+                methods[name] = {
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'seconds': stats.seconds,
+                    'mean_ms': stats.seconds * 1000 / stats.calls,
+                    'rows': stats.rows,
+                    'statements': stats.statements,
+                    'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], stats.buckets)),
+                }
+            return {'methods': methods, 'slow_calls': list(self.slow_calls)}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self):
+        # Prometheus text exposition format, version 0.0.4
+        lines = []
+        with self._lock:
+            methods = sorted(self.methods.items())
+
+            lines.append('# HELP comicdb_method_duration_seconds Time spent in Manager methods.')
+            lines.append('# TYPE comicdb_method_duration_seconds histogram')
+            for name, stats in methods:
+                total = 0
+                for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], stats.buckets):
+                    total += count
+                    lines.append(f'comicdb_method_duration_seconds_bucket{{method="{name}",le="{bound}"}} {total}')
+                lines.append(f'comicdb_method_duration_seconds_sum{{method="{name}"}} {stats.seconds}')
+                lines.append(f'comicdb_method_duration_seconds_count{{method="{name}"}} {stats.calls}')
+
+            for metric, attribute, help_text in [
+                ('comicdb_method_errors_total', 'errors', 'Manager method calls that raised.'),
+                ('comicdb_method_rows_total', 'rows', 'Rows returned by Manager methods.'),
+                ('comicdb_method_statements_total', 'statements', 'SQL statements run by Manager methods.'),
+            ]:
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} counter')
+                for name, stats in methods:
+                    lines.append(f'{metric}{{method="{name}"}} {getattr(stats, attribute)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,329 @@
+import threading
+
+from comic_records import Recommendation
+
+try:
+    import numpy as np
+except ImportError:
+    # Recommendations are only offered when numpy is installed
+    np = None
+
+# Pending co-occurrence changes held before they are folded into the arrays
+MERGE_AT = 100000
+# Most series pairs expanded at once while counting co-occurrences
+PAIR_CHUNK = 5000000
+# Rows read per fetchmany() while loading ownership
+CHUNK_SIZE = 100000
+
+
+def _fetch_array(cursor, chunk_size=CHUNK_SIZE):
+    # Every row of a query of integer columns as one 2-d int64 array
+    parts = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        parts.append(np.array(rows, dtype=np.int64))
+    if not parts:
+        return np.zeros((0, len(cursor.description)), dtype=np.int64)
+    return np.concatenate(parts)
+
+
+def _gather(indptr, rows):
+    # Positions of every entry of the given CSR rows, in row order
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+
+def _sum_keys(keys, counts):
+    # Sorted distinct keys with their counts added up
+    if not len(keys):
+        return keys, counts
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    counts = counts[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+def _csr(keys, counts, size):
+    # Row pointers, column indexes and values from keys of row * size + column
+    rows = keys // size
+    indptr = np.searchsorted(rows, np.arange(size + 1))
+    return indptr, (keys % size).astype(np.int32), counts.astype(np.int32)
+
+
+class Recommender:
+    # "Collectors also own": series scored by how many collectors own them
+    # together with each series the user has, as a cosine similarity between
+    # the series' sets of owners. The series x series co-occurrence counts
+    # live in numpy CSR arrays, built in one vectorized pass over collection.
+    # Later changes are read from the change log, so add_to_collection, an
+    # import or another process are all picked up. They are applied as small
+    # per-user differences, held in dicts and folded into the arrays once
+    # merge_at of them have built up.
+    def __init__(self, manager, merge_at=MERGE_AT):
+        if np is None:
+            raise ValueError('Recommendations need numpy installed')
+        self.manager = manager
+        self.merge_at = merge_at
+        self._lock = threading.Lock()
+        # change_id the model is current to, None until built
+        self.cursor = None
+
+    def _series_index(self, series_id):
+        # Dense index of a series, given one if it is new
+        index = self.index.get(series_id)
+        if index is None:
+            index = self.index[series_id] = len(self.series_ids)
+            self.series_ids.append(series_id)
+            if index >= len(self.owners):
+                self.owners = np.concatenate((self.owners, np.zeros(len(self.owners) + 1, dtype=np.int64)))
+        return index
+
+    def build(self):
+        with self._lock:
+            self._build()
+
+    def _build(self):
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        # Read first: changes made while loading are replayed by the next
+        # refresh(), and replaying a user's changes twice is harmless
+        self.cursor = self.manager.change_cursor()
+
+        cursor.execute('SELECT series_id FROM series ORDER BY series_id')
+        self.series_ids = [row[0] for row in cursor]
+        self.index = {series_id: index for index, series_id in enumerate(self.series_ids)}
+        size = max(len(self.series_ids), 1)
+        series_lookup = np.full((self.series_ids[-1] if self.series_ids else 0) + 1, -1, dtype=np.int64)
+        series_lookup[self.series_ids] = np.arange(len(self.series_ids))
+
+        cursor.execute('SELECT comic_id, series_id FROM comic')
+        comics = _fetch_array(cursor)
+        self.comic_series = np.full((comics[:, 0].max() if len(comics) else 0) + 1, -1, dtype=np.int64)
+        self.comic_series[comics[:, 0]] = comics[:, 1]
+
+        # The distinct (user, series) pairs, grouped by user
+        cursor.execute('SELECT user_id, comic_id FROM collection')
+        owned = _fetch_array(cursor)
+        # Rows whose comic or series is gone are left out
+        owned = owned[owned[:, 1] < len(self.comic_series)]
+        series = self.comic_series[owned[:, 1]]
+        found = (series >= 0) & (series < len(series_lookup))
+        series = np.where(found, series_lookup[np.where(found, series, 0)], -1)
+        keys = np.unique(owned[series >= 0, 0] * size + series[series >= 0])
+        self.user_ids, starts = np.unique(keys // size, return_index=True)
+        self.user_indptr = np.append(starts, len(keys))
+        self.user_series = (keys % size).astype(np.int32)
+        self.changed = {}
+
+        self.owners = np.bincount(self.user_series, minlength=size).astype(np.int64)
+        self._count_pairs(size)
+
+    def _count_pairs(self, size):
+        # Co-occurrence counts of every pair of distinct series a user owns,
+        # expanded a chunk of users at a time to bound memory
+        indptr = self.user_indptr
+        sizes = np.diff(indptr)
+        cumulative = np.cumsum(sizes * sizes)
+        keys = []
+        counts = []
+        first = 0
+        while first < len(sizes):
+            done = cumulative[first - 1] if first else 0
+            last = max(int(np.searchsorted(cumulative, done + PAIR_CHUNK, side='right')), first + 1)
+            members = self.user_series[indptr[first]:indptr[last]].astype(np.int64)
+            group = sizes[first:last]
+            # For each member, every member of its user's set
+            per_member = np.repeat(group, group)
+            left = np.repeat(members, per_member)
+            right = members[_gather(np.append(indptr[first:last] - indptr[first], len(members)),
+                                    np.repeat(np.arange(len(group)), group))]
+            pairs = left * size + right
+            pairs = pairs[left != right]
+            chunk_keys, chunk_counts = np.unique(pairs, return_counts=True)
+            keys.append(chunk_keys)
+            counts.append(chunk_counts)
+            first = last
+
+        keys, counts = _sum_keys(np.concatenate(keys or [np.zeros(0, np.int64)]),
+                                 np.concatenate(counts or [np.zeros(0, np.int64)]))
+        self.size = size
+        self.indptr, self.indices, self.data = _csr(keys, counts, size)
+        self.pending = {}
+        self.pending_count = 0
+
+    def _owned(self, user_id):
+        # Series indexes the model holds for a user
+        owned = self.changed.get(user_id)
+        if owned is not None:
+            return owned
+        position = np.searchsorted(self.user_ids, user_id)
+        if position < len(self.user_ids) and self.user_ids[position] == user_id:
+            return self.user_series[self.user_indptr[position]:self.user_indptr[position + 1]]
+        return self.user_series[:0]
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        # Applies collection changes logged since the model was last current.
+        # A cursor the log no longer reaches back to means a full rebuild.
+        if self.cursor is None or self.manager.change_floor() > self.cursor:
+            self._build()
+            return
+        latest = self.manager.change_cursor()
+        if latest == self.cursor:
+            return
+
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT table_name, row_id, user_id, json_extract(data, '$.series_id')
+            FROM change_log
+            WHERE change_id > ? AND change_id <= ? AND table_name IN ('collection', 'comic')
+        ''', (self.cursor, latest))
+        users = set()
+        moved = []
+        for table, row_id, user_id, series_id in cursor.fetchall():
+            if table == 'collection':
+                users.add(user_id)
+                continue
+            if series_id is None:
+                # Deleted comics take their collection rows with them
+                continue
+            if row_id >= len(self.comic_series):
+                grown = np.full(max(row_id + 1, 2 * len(self.comic_series)), -1, dtype=np.int64)
+                grown[:len(self.comic_series)] = self.comic_series
+                self.comic_series = grown
+            if self.comic_series[row_id] not in (-1, series_id):
+                moved.append(row_id)
+            self.comic_series[row_id] = series_id
+
+        if moved:
+            # Comics moved to another series, say by merge_series(), change
+            # the series of everyone who owns them
+            cursor.execute('''
+                SELECT DISTINCT user_id FROM collection WHERE comic_id IN (SELECT value FROM json_each(?))
+            ''', (str(moved),))
+            users.update(row[0] for row in cursor)
+
+        for user_id in users:
+            cursor.execute('''
+                SELECT DISTINCT c.series_id
+                FROM collection co
+                INNER JOIN comic c ON c.comic_id = co.comic_id
+                WHERE co.user_id = ?
+            ''', (user_id,))
+            self._apply(user_id, {self._series_index(row[0]) for row in cursor})
+        self.cursor = latest
+
+        if self.pending_count >= self.merge_at:
+            self._merge()
+
+    def _apply(self, user_id, new):
+        # Adjusts the counts for a user whose series went from the model's
+        # copy to new: +1 for each ordered pair only new holds, -1 for each
+        # only the old set held
+        old = set(self._owned(user_id).tolist())
+        if old == new:
+            return
+        for changed, members, step in ((new - old, new, 1), (old - new, old, -1)):
+            for a in changed:
+                self.owners[a] += step
+                for b in members:
+                    if b != a:
+                        self._bump(a, b, step)
+                        if b not in changed:
+                            self._bump(b, a, step)
+        self.changed[user_id] = np.array(sorted(new), dtype=np.int32)
+
+    def _bump(self, a, b, step):
+        row = self.pending.setdefault(a, {})
+        if b not in row:
+            self.pending_count += 1
+        row[b] = row.get(b, 0) + step
+
+    def _merge(self):
+        # Folds pending counts and changed users back into the arrays, sized
+        # for any series added since the build
+        size = max(len(self.series_ids), 1)
+        rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+        keys = [rows * size + self.indices]
+        counts = [self.data.astype(np.int64)]
+        for a, row in self.pending.items():
+            keys.append(a * size + np.fromiter(row.keys(), np.int64, len(row)))
+            counts.append(np.fromiter(row.values(), np.int64, len(row)))
+        keys, counts = _sum_keys(np.concatenate(keys), np.concatenate(counts))
+        keep = counts != 0
+        self.size = size
+        self.indptr, self.indices, self.data = _csr(keys[keep], counts[keep], size)
+        self.pending = {}
+        self.pending_count = 0
+
+        users = np.repeat(self.user_ids, np.diff(self.user_indptr))
+        unchanged = ~np.isin(users, np.fromiter(self.changed, np.int64, len(self.changed)))
+        keys = [users[unchanged] * size + self.user_series[unchanged]]
+        for user_id, owned in self.changed.items():
+            keys.append(user_id * size + owned.astype(np.int64))
+        keys = np.unique(np.concatenate(keys))
+        self.user_ids, starts = np.unique(keys // size, return_index=True)
+        self.user_indptr = np.append(starts, len(keys))
+        self.user_series = (keys % size).astype(np.int32)
+        self.changed = {}
+
+    def scores(self, user_id):
+        # Score of every series index for a user, 0 for those they own
+        owned = self._owned(user_id)
+        scores = np.zeros(len(self.series_ids))
+        if not len(owned):
+            return scores
+
+        rows = owned[owned < self.size].astype(np.int64)
+        positions = _gather(self.indptr, rows)
+        columns = self.indices[positions]
+        sources = np.repeat(rows, np.diff(self.indptr)[rows])
+        # A series whose last owner just left can still have pending counts
+        owners = np.maximum(self.owners, 1)
+        weights = self.data[positions] / np.sqrt(owners[sources] * owners[columns])
+        scores[:self.size] = np.bincount(columns, weights, minlength=self.size)
+
+        for a in owned.tolist():
+            for b, count in self.pending.get(a, {}).items():
+                if count:
+                    scores[b] += count / np.sqrt(owners[a] * owners[b])
+        scores[owned] = 0
+        return scores
+
+    def recommend(self, user_id, limit=10):
+        # Recommendation records for the series the user is most likely to
+        # want next, best first
+        with self._lock:
+            self._refresh()
+            scores = self.scores(user_id)
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        best = [(self.series_ids[index], float(scores[index])) for index in top.tolist() if scores[index] > 0]
+        if not best:
+            return []
+
+        conn = self.manager.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            SELECT series_id, name FROM series WHERE series_id IN ({', '.join('?' * len(best))})
+        ''', [series_id for series_id, score in best])
+        names = dict(cursor.fetchall())
+        return [
+            Recommendation((series_id, names[series_id], round(score, 4)))
+            for series_id, score in best if series_id in names
+        ]
@@ -0,0 +1,162 @@
+import array
+import gc
+from operator import itemgetter
+
+# Rows fetched per fetchmany() while filling a Columns
+CHUNK_SIZE = 10000
+
+
+class Record(tuple):
+    # A result row that is still a tuple, so indexing, unpacking, equality and
+    # JSON encoding work as before, with each column also readable by name.
+    # Subclasses list their columns in fields and declare an empty __slots__,
+    # which keeps a record within 8 bytes of the tuple it replaces. Records
+    # are built like tuples, Comic(row), which runs entirely in C, so
+    # list(map(Comic, cursor)) is the fast way to convert many rows.
+    __slots__ = ()
+    fields = ()
+    # array typecode per field for Columns: 'q' integers, 'd' floats, and
+    # anything else is kept in a list
+    types = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for index, name in enumerate(cls.fields):
+            setattr(cls, name, property(itemgetter(index)))
+
+        # For a cursor's row_factory. sqlite3 calls it through Python once per
+        # row, so it suits single rows better than long listings.
+        def row_factory(cursor, row, cls=cls, new=tuple.__new__):
+            return new(cls, row)
+        cls.row_factory = staticmethod(row_factory)
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={value!r}' for name, value in zip(self.fields, self))
+        return f'{type(self).__name__}({values})'
+
+    def as_dict(self):
+        return dict(zip(self.fields, self))
+
+
+class Comic(Record):
+    __slots__ = ()
+    fields = ('comic_id', 'series', 'issue_num')
+    types = ('q', None, 'q')
+
+
+class Series(Record):
+    __slots__ = ()
+    fields = ('series_id', 'name', 'volume_id', 'publisher_id')
+    types = ('q', None, 'q', 'q')
+
+
+class Publisher(Record):
+    __slots__ = ()
+    fields = ('publisher_id', 'name')
+    types = ('q', None)
+
+
+class Volume(Record):
+    __slots__ = ()
+    fields = ('volume_id', 'name')
+    types = ('q', None)
+
+
+class CollectionEntry(Record):
+    __slots__ = ()
+    fields = ('collection_id', 'series', 'issue_num', 'quantity')
+    types = ('q', None, 'q', 'q')
+
+
+class IssueGap(Record):
+    # A run of issues missing from a collection, first_issue to last_issue,
+    # and how many of them are in the catalogue
+    __slots__ = ()
+    fields = ('series_id', 'series', 'first_issue', 'last_issue', 'missing', 'in_catalogue')
+    types = ('q', None, 'q', 'q', 'q', 'q')
+
+
+class SimilarName(Record):
+    # A publisher or series from Manager.find_similar(), with the share of
+    # trigrams its name has in common with the one looked up
+    __slots__ = ()
+    fields = ('row_id', 'name', 'similarity')
+    types = ('q', None, 'd')
+
+
+class Recommendation(Record):
+    # A series from Recommender.recommend(); score sums how strongly its
+    # owners overlap with the owners of each series the user has
+    __slots__ = ()
+    fields = ('series_id', 'series', 'score')
+    types = ('q', None, 'd')
+
+
+class Change(Record):
+    # One entry from Manager.changes_since(); data is the row after the change
+    # as a dict, or None for a delete
+    __slots__ = ()
+    fields = ('change_id', 'table_name', 'row_id', 'action', 'data')
+    types = ('q', None, 'q', None, None)
+
+
+def build_records(record, rows):
+    # A list of record instances for every row. Records never hold cycles, but
+    # unlike plain tuples the collector never untracks them, so a long listing
+    # sets off full collections that walk every record built so far, doubling
+    # the cost at a million rows. The collector is paused while they're built.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return list(map(record, rows))
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class Columns:
+    # A column-oriented result set for large listings. Number columns are
+    # packed into array.array buffers and each distinct string is stored
+    # once, so a million rows take a fraction of the memory of a list of
+    # tuples. Indexing or iterating builds records on demand.
+    __slots__ = ('record', 'columns')
+
+    def __init__(self, record, columns):
+        self.record = record
+        self.columns = columns
+
+    @classmethod
+    def from_cursor(cls, record, cursor, chunk_size=CHUNK_SIZE):
+        columns = [array.array(code) if code else [] for code in record.types]
+        strings = {}
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for index, values in enumerate(zip(*rows)):
+                column = columns[index]
+                if isinstance(column, list):
+                    column.extend(map(strings.setdefault, values, values))
+                    continue
+                length = len(column)
+                try:
+                    column.extend(values)
+                except TypeError:
+                    # A NULL or mistyped value doesn't fit the array, so the
+                    # column becomes a list from here on
+                    columns[index] = column[:length].tolist()
+                    columns[index].extend(values)
+        return cls(record, columns)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, index):
+        return self.record([column[index] for column in self.columns])
+
+    def __iter__(self):
+        return map(self.record, zip(*self.columns))
+
+    def column(self, name):
+        # The array or list holding one column, without building any records
+        return self.columns[self.record.fields.index(name)]
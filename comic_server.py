@@ -0,0 +1,501 @@
+import base64
+import gzip
+import hashlib
+import json
+import re
+import sqlite3
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from comic_images import ImageStore
+from comic_manager import PAGE_SIZE, SIMILAR_THRESHOLD, Manager
+from comic_recommend import Recommender
+
+MAX_PAGE_SIZE = 500
+# Responses smaller than this are not worth compressing
+GZIP_MIN_BYTES = 512
+
+COMIC_COLUMNS = ('comic_id', 'series', 'issue_num')
+SERIES_COLUMNS = ('series_id', 'name', 'volume_id', 'publisher_id')
+PUBLISHER_COLUMNS = ('publisher_id', 'name')
+VOLUME_COLUMNS = ('volume_id', 'name')
+COLLECTION_COLUMNS = ('collection_id', 'series', 'issue_num', 'quantity')
+# Optional fields of a POST /collection or PATCH /collection/<id> body
+COPY_FIELDS = ('quantity', 'grade', 'purchase_price', 'acquired_on')
+VALUE_COLUMNS = ('comics', 'cover_total', 'current_total', 'gain')
+CHANGE_COLUMNS = ('change_id', 'table', 'row_id', 'action', 'data')
+SIMILAR_COLUMNS = ('id', 'name', 'similarity')
+RECOMMENDATION_COLUMNS = ('series_id', 'series', 'score')
+GAP_COLUMNS = ('series_id', 'series', 'first_issue', 'last_issue', 'missing', 'in_catalogue')
+
+# Clearance levels a user needs for each kind of catalogue change, the same
+# ones the terminal interface asks for
+INSERT_CLEARANCE = 2
+DELETE_CLEARANCE = 3
+UPDATE_CLEARANCE = 4
+
+
+class Blob:
+    # A non-JSON response body
+    __slots__ = ('content_type', 'body')
+
+    def __init__(self, content_type, body):
+        self.content_type = content_type
+        self.body = body
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _records(columns, rows):
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def _page(columns, rows, limit):
+    # Keyset page: pass next_after_id back as after_id for the following page
+    return {
+        'items': _records(columns, rows),
+        'next_after_id': rows[-1][0] if rows and len(rows) == limit else None,
+    }
+
+
+class ComicRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    server_version = 'ComicDB/1.0'
+    # Headers and body go out as separate writes; with Nagle on, each
+    # keep-alive response stalls on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    # (method, path pattern, handler name); list endpoints get ETags
+    routes = [
+        ('GET', r'/comics', 'list_comics'),
+        ('GET', r'/comics/search', 'search_comics'),
+        ('GET', r'/comics/(\d+)/prices', 'comic_prices'),
+        ('GET', r'/comics/(\d+)/cover', 'comic_cover'),
+        ('POST', r'/comics', 'create_comic'),
+        ('PATCH', r'/comics/(\d+)', 'update_comic'),
+        ('DELETE', r'/comics/(\d+)', 'delete_comic'),
+        ('GET', r'/series', 'list_series'),
+        ('GET', r'/series/similar', 'similar_series'),
+        ('GET', r'/series/(\d+)', 'get_series'),
+        ('POST', r'/series/(\d+)/merge', 'merge_series'),
+        ('POST', r'/series', 'create_series'),
+        ('PATCH', r'/series/(\d+)', 'update_series'),
+        ('DELETE', r'/series/(\d+)', 'delete_series'),
+        ('GET', r'/publishers', 'list_publishers'),
+        ('GET', r'/publishers/similar', 'similar_publishers'),
+        ('POST', r'/publishers', 'create_publisher'),
+        ('POST', r'/publishers/(\d+)/merge', 'merge_publishers'),
+        ('PATCH', r'/publishers/(\d+)', 'update_publisher'),
+        ('DELETE', r'/publishers/(\d+)', 'delete_publisher'),
+        ('GET', r'/volumes', 'list_volumes'),
+        ('POST', r'/volumes', 'create_volume'),
+        ('PATCH', r'/volumes/(\d+)', 'update_volume'),
+        ('DELETE', r'/volumes/(\d+)', 'delete_volume'),
+        ('POST', r'/login', 'login'),
+        ('POST', r'/logout', 'logout'),
+        ('GET', r'/collection', 'list_collection'),
+        ('POST', r'/collection', 'add_to_collection'),
+        ('GET', r'/collection/value', 'collection_value'),
+        ('GET', r'/collection/missing', 'missing_issues'),
+        ('GET', r'/collection/recommendations', 'recommendations'),
+        ('PATCH', r'/collection/(\d+)', 'update_collection'),
+        ('DELETE', r'/collection/(\d+)', 'delete_collection'),
+        ('GET', r'/changes', 'list_changes'),
+        ('GET', r'/changes/cursor', 'change_cursor'),
+        ('GET', r'/metrics', 'metrics'),
+    ]
+
+    @property
+    def manager(self):
+        return self.server.manager
+
+    def finish(self):
+        # Every client connection gets its own thread, and with it a SQLite
+        # connection, which is closed when the client goes away
+        try:
+            super().finish()
+        finally:
+            self.manager.release()
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query)
+        # Read the body up front so the connection stays usable on errors
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+
+        try:
+            for route_method, pattern, name in self.routes:
+                match = re.fullmatch(pattern, url.path.rstrip('/') or '/')
+                if match and route_method == method:
+                    status, payload = getattr(self, name)(*(int(group) for group in match.groups()))
+                    break
+            else:
+                raise ApiError(404, f'No route for {method} {url.path}')
+        except ApiError as error:
+            status, payload = error.status, {'error': str(error)}
+        except sqlite3.IntegrityError as error:
+            status, payload = 409, {'error': str(error)}
+        except (ValueError, KeyError, TypeError) as error:
+            status, payload = 400, {'error': f'Bad request: {error}'}
+        except sqlite3.Error as error:
+            status, payload = 500, {'error': str(error)}
+
+        self.respond(status, payload, cacheable=method == 'GET' and status == 200)
+
+    def respond(self, status, payload, cacheable=False):
+        compressible = True
+        if isinstance(payload, Blob):
+            body = payload.body
+            headers = {'Content-Type': payload.content_type}
+            # Images are compressed already
+            compressible = False
+        elif isinstance(payload, str):
+            body = payload.encode()
+            headers = {'Content-Type': 'text/plain; version=0.0.4'}
+            cacheable = False
+        else:
+            body = json.dumps(payload, separators=(',', ':')).encode()
+            headers = {'Content-Type': 'application/json'}
+
+        if cacheable:
+            etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+            headers['ETag'] = etag
+            headers['Cache-Control'] = 'no-cache'
+            if etag in (tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')):
+                status, body = 304, b''
+
+        if status == 401:
+            headers['WWW-Authenticate'] = 'Bearer realm="comicdb", Basic realm="comicdb"'
+
+        headers['Vary'] = 'Accept-Encoding'
+        if compressible and len(body) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def param(self, name, convert=int, default=None):
+        values = self.query.get(name)
+        return convert(values[0]) if values else default
+
+    def json_body(self):
+        if not self.body:
+            raise ApiError(400, 'Expected a JSON body')
+        return json.loads(self.body)
+
+    def limit(self, default=PAGE_SIZE):
+        # ?limit=, at most MAX_PAGE_SIZE
+        limit = self.param('limit', default=default)
+        if limit < 1:
+            raise ApiError(400, 'limit must be at least 1')
+        return min(limit, MAX_PAGE_SIZE)
+
+    def paging(self):
+        return self.param('after_id', default=0), self.limit()
+
+    def session_user(self):
+        # A bearer token from POST /login, or HTTP Basic credentials, which pay
+        # for a password hash on every request
+        header = self.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            user = self.manager.token_user(header[7:].strip())
+            if not user:
+                raise ApiError(401, 'Invalid or expired token')
+            return user
+        if not header.startswith('Basic '):
+            raise ApiError(401, 'Login required')
+        username, _, password = base64.b64decode(header[6:]).decode().partition(':')
+        user = self.manager.authenticate(username, password)
+        if not user:
+            raise ApiError(401, 'Invalid username or password')
+        return user
+
+    def require_clearance(self, level):
+        # The signed in user, if they are cleared for a catalogue change
+        user = self.session_user()
+        if user[2] < level:
+            raise ApiError(403, 'You do not have the required clearance level for this action')
+        return user
+
+    # Comics
+    def list_comics(self):
+        after_id, limit = self.paging()
+        return 200, _page(COMIC_COLUMNS, self.manager.show_comics_page(after_id, limit), limit)
+
+    def search_comics(self):
+        comics = self.manager.search_comics(self.param('q', str, ''), self.limit(20))
+        return 200, {'items': _records(COMIC_COLUMNS, comics)}
+
+    def comic_prices(self, comic_id):
+        history = self.manager.get_price_history(comic_id, self.param('start'), self.param('end'))
+        return 200, {'items': _records(('recorded_at', 'price'), history)}
+
+    def comic_cover(self, comic_id):
+        # The cached cover, or its thumbnail with ?thumb=1; never fetched on demand
+        cover = self.server.images.cover(comic_id, thumb=bool(self.param('thumb', default=0)))
+        if cover is None:
+            raise ApiError(404, f'No cached cover for comic {comic_id}')
+        path, content_type = cover
+        try:
+            with open(path, 'rb') as f:
+                return 200, Blob(content_type, f.read())
+        except FileNotFoundError:
+            raise ApiError(404, f'No cached cover for comic {comic_id}')
+
+    def create_comic(self):
+        self.require_clearance(INSERT_CLEARANCE)
+        comic = self.json_body()
+        comic_id = self.manager.add_comic(comic['series_id'], comic['issue_num'], comic['cover_price'])
+        return 201, {'comic_id': comic_id}
+
+    def update_comic(self, comic_id):
+        self.require_clearance(UPDATE_CLEARANCE)
+        self.manager.update_comic(comic_id, **self.json_body())
+        return 200, {'comic_id': comic_id}
+
+    def delete_comic(self, comic_id):
+        self.require_clearance(DELETE_CLEARANCE)
+        self.manager.delete_comic(comic_id)
+        return 200, {'comic_id': comic_id}
+
+    # Series
+    def list_series(self):
+        after_id, limit = self.paging()
+        return 200, _page(SERIES_COLUMNS, self.manager.show_series_page(after_id, limit), limit)
+
+    def get_series(self, series_id):
+        series = self.manager.get_series(series_id)
+        if series is None:
+            raise ApiError(404, f'No series {series_id}')
+        return 200, dict(zip(SERIES_COLUMNS, series))
+
+    def create_series(self):
+        self.require_clearance(INSERT_CLEARANCE)
+        series = self.json_body()
+        series_id = self.manager.add_series(series['name'], series['volume_id'], series['publisher_id'])
+        return 201, {'series_id': series_id}
+
+    def update_series(self, series_id):
+        self.require_clearance(UPDATE_CLEARANCE)
+        self.manager.update_series(series_id, **self.json_body())
+        return 200, {'series_id': series_id}
+
+    def delete_series(self, series_id):
+        self.require_clearance(DELETE_CLEARANCE)
+        self.manager.delete_series(series_id)
+        return 200, {'series_id': series_id}
+
+    # Publishers
+    def list_publishers(self):
+        after_id, limit = self.paging()
+        return 200, _page(PUBLISHER_COLUMNS, self.manager.show_publishers_page(after_id, limit), limit)
+
+    def create_publisher(self):
+        self.require_clearance(INSERT_CLEARANCE)
+        return 201, {'publisher_id': self.manager.add_publisher(self.json_body()['name'])}
+
+    def update_publisher(self, publisher_id):
+        self.require_clearance(UPDATE_CLEARANCE)
+        self.manager.update_publisher(publisher_id, self.json_body()['name'])
+        return 200, {'publisher_id': publisher_id}
+
+    def delete_publisher(self, publisher_id):
+        self.require_clearance(DELETE_CLEARANCE)
+        self.manager.delete_publisher(publisher_id)
+        return 200, {'publisher_id': publisher_id}
+
+    # Near duplicate names: ?name= and an optional ?threshold=, and a merge
+    # body of {"ids": [...]} to fold into the publisher or series in the path
+    def similar_names(self, table):
+        matches = self.manager.find_similar(
+            self.param('name', str, ''), self.param('threshold', float, SIMILAR_THRESHOLD), table,
+            self.limit(10),
+        )
+        return 200, {'items': _records(SIMILAR_COLUMNS, matches)}
+
+    def similar_publishers(self):
+        return self.similar_names('publisher')
+
+    def similar_series(self):
+        return self.similar_names('series')
+
+    def merge(self, merge, keep_id):
+        self.require_clearance(UPDATE_CLEARANCE)
+        ids = self.json_body()['ids']
+        try:
+            return merge(keep_id, ids)
+        except ValueError as error:
+            # The row to merge into doesn't exist
+            raise ApiError(404, str(error))
+
+    def merge_publishers(self, publisher_id):
+        moved = self.merge(self.manager.merge_publishers, publisher_id)
+        return 200, {'publisher_id': publisher_id, 'series_moved': moved}
+
+    def merge_series(self, series_id):
+        moved = self.merge(self.manager.merge_series, series_id)
+        return 200, {'series_id': series_id, 'comics_moved': moved}
+
+    # Volumes
+    def list_volumes(self):
+        after_id, limit = self.paging()
+        return 200, _page(VOLUME_COLUMNS, self.manager.show_volumes_page(after_id, limit), limit)
+
+    def create_volume(self):
+        self.require_clearance(INSERT_CLEARANCE)
+        return 201, {'volume_id': self.manager.add_volume(self.json_body()['num'])}
+
+    def update_volume(self, volume_id):
+        self.require_clearance(UPDATE_CLEARANCE)
+        self.manager.update_volume(volume_id, self.json_body()['num'])
+        return 200, {'volume_id': volume_id}
+
+    def delete_volume(self, volume_id):
+        self.require_clearance(DELETE_CLEARANCE)
+        self.manager.delete_volume(volume_id)
+        return 200, {'volume_id': volume_id}
+
+    # Sessions
+    def login(self):
+        credentials = self.json_body()
+        session = self.manager.login_token(credentials['username'], credentials['password'])
+        if session is None:
+            raise ApiError(401, 'Invalid username or password')
+        token, user = session
+        return 200, {'token': token, 'user_id': user[0], 'expires_in': self.manager.tokens.ttl}
+
+    def logout(self):
+        header = self.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            self.manager.logout_token(header[7:].strip())
+        return 200, {}
+
+    # The signed in user's collection
+    def list_collection(self):
+        user_id = self.session_user()[0]
+        after_id, limit = self.paging()
+        comics = self.manager.show_user_comics_page(after_id, limit, user_id=user_id)
+        return 200, _page(COLLECTION_COLUMNS, comics, limit)
+
+    def add_to_collection(self):
+        user_id = self.session_user()[0]
+        body = self.json_body()
+        details = {name: body[name] for name in COPY_FIELDS if name in body}
+        collection_id = self.manager.add_to_collection(body['comic_id'], user_id=user_id, **details)
+        return 201, {'collection_id': collection_id}
+
+    def update_collection(self, collection_id):
+        user_id = self.session_user()[0]
+        body = self.json_body()
+        details = {name: body[name] for name in COPY_FIELDS if name in body}
+        if not self.manager.update_collection(collection_id, user_id=user_id, **details):
+            raise ApiError(404, f'No collection entry {collection_id}')
+        return 200, {'collection_id': collection_id}
+
+    def delete_collection(self, collection_id):
+        # ?quantity=n removes that many copies instead of the whole entry
+        user_id = self.session_user()[0]
+        if not self.manager.delete_collection(collection_id, self.param('quantity'), user_id=user_id):
+            raise ApiError(404, f'No collection entry {collection_id}')
+        return 200, {'collection_id': collection_id}
+
+    def collection_value(self):
+        user_id = self.session_user()[0]
+        return 200, dict(zip(VALUE_COLUMNS, self.manager.collection_value(user_id)))
+
+    def missing_issues(self):
+        # ?series_id=n limits the gaps to one series
+        user_id = self.session_user()[0]
+        gaps = self.manager.missing_issues(self.param('series_id'), user_id=user_id)
+        return 200, {'items': _records(GAP_COLUMNS, gaps)}
+
+    def recommendations(self):
+        # Series that owners of the user's series also own. The model is built
+        # on the first request and kept current from the change log after.
+        user_id = self.session_user()[0]
+        if self.server.recommender is None:
+            raise ApiError(404, 'Recommendations are not enabled, install numpy')
+        items = self.server.recommender.recommend(user_id, self.limit(10))
+        return 200, {'items': _records(RECOMMENDATION_COLUMNS, items)}
+
+    # Delta sync: catalogue changes after after_id, plus the signed in user's
+    # collection changes when credentials are sent. A client reads
+    # /changes/cursor before a full pull, then passes the cursor of each
+    # reply as the next after_id. 410 means it has to pull in full again.
+    def list_changes(self):
+        user_id = self.session_user()[0] if self.headers.get('Authorization') else None
+        after_id, limit = self.paging()
+        try:
+            changes = self.manager.changes_since(after_id, limit, user_id=user_id)
+        except ValueError as error:
+            raise ApiError(410, str(error))
+        page = _page(CHANGE_COLUMNS, changes, limit)
+        page['cursor'] = changes[-1].change_id if changes else after_id
+        # Repeated changes to a row are merged, so a short page isn't the last
+        page['next_after_id'] = page['cursor'] if changes else None
+        return 200, page
+
+    def change_cursor(self):
+        return 200, {'cursor': self.manager.change_cursor()}
+
+    # Prometheus scrape target, served when the Manager has metrics enabled
+    def metrics(self):
+        if self.manager.metrics is None:
+            raise ApiError(404, 'Metrics are not enabled, start the server with --metrics')
+        return 200, self.manager.metrics.to_prometheus()
+
+
+class ComicServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, manager, quiet=False, images=None):
+        super().__init__(address, ComicRequestHandler)
+        self.manager = manager
+        self.quiet = quiet
+        self.images = images or ImageStore(manager)
+        try:
+            self.recommender = Recommender(manager)
+        except ValueError:
+            # numpy isn't installed
+            self.recommender = None
+
+
+def serve(db_name='comicdb.db', host='127.0.0.1', port=8000, quiet=False, metrics=False, slow_ms=None):
+    with Manager(db_name) as manager:
+        if metrics or slow_ms is not None:
+            manager.enable_metrics(slow_ms)
+        server = ComicServer((host, port), manager, quiet)
+        print(f'Serving {db_name} on http://{host}:{server.server_port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
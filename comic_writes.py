@@ -0,0 +1,89 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class WriteQueue:
+    # Serializes writes onto one background thread and commits them in groups:
+    # whatever has queued up while the previous commit was running goes into
+    # the next one, so many small writes share one fsync. With max_delay the
+    # thread also lingers that long for more writes before committing.
+    def __init__(self, connect, max_batch=256, max_delay=0.0):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.writes = 0
+
+        self._connect = connect
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='comicdb-group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params=()):
+        # Returns a Future resolving to the statement's lastrowid once committed,
+        # or to its first RETURNING value
+        future = Future()
+        self._queue.put((sql, params, future))
+        return future
+
+    def execute(self, sql, params=()):
+        return self.submit(sql, params).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        # connect() runs here so the queue writes through its own connection
+        conn = self._connect()
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    timeout = deadline - time.monotonic()
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+
+            self._commit(conn, batch)
+
+    def _commit(self, conn, batch):
+        cursor = conn.cursor()
+        done = []
+        for sql, params, future in batch:
+            try:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            except Exception as error:
+                # A failed statement is rolled back on its own; the rest of the
+                # group still commits
+                future.set_exception(error)
+            else:
+                done.append((future, rows[0][0] if rows else cursor.lastrowid))
+
+        try:
+            conn.commit()
+        except Exception as error:
+            conn.rollback()
+            for future, row_id in done:
+                future.set_exception(error)
+            return
+
+        self.batches += 1
+        self.writes += len(done)
+        for future, row_id in done:
+            future.set_result(row_id)
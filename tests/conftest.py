@@ -0,0 +1,113 @@
+import gzip
+import http.client
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import comic_manager
+from comic_manager import Manager
+from comic_server import ComicServer
+
+# Cheap scrypt settings; the tests only need hashes to verify
+TEST_PASSWORD_COST = {'n': 2 ** 4, 'r': 8, 'p': 1}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    # A new, fully migrated database in a temporary directory
+    with Manager(str(tmp_path / 'comicdb.db'), password_cost=TEST_PASSWORD_COST) as manager:
+        manager.create_comicdb()
+        yield manager
+
+
+@pytest.fixture
+def legacy(tmp_path, monkeypatch):
+    # legacy(migration) is a Manager on a new database built with only the
+    # migrations before `migration`; its migrate() then applies the rest
+    managers = []
+
+    def build(migration):
+        with monkeypatch.context() as patch:
+            migrations = comic_manager.MIGRATIONS
+            patch.setattr(comic_manager, 'MIGRATIONS', migrations[:migrations.index(migration)])
+            manager = Manager(str(tmp_path / f'legacy-{len(managers)}.db'), password_cost=TEST_PASSWORD_COST)
+            managers.append(manager)
+            manager.create_comicdb()
+        return manager
+
+    yield build
+    for manager in managers:
+        manager.close()
+
+
+@pytest.fixture
+def catalogue(manager):
+    # Two publishers with a series each, twenty issues per series, and one
+    # collector owning a few of them. Returns the collector's user_id.
+    manager.add_volume(1)
+    manager.add_publisher('Marvel')
+    manager.add_publisher('DC')
+    manager.add_series('Spider-Man', 1, 1)
+    manager.add_series('Batman', 1, 2)
+    manager.add_comics_bulk((series_id, issue, 3.99) for series_id in (1, 2) for issue in range(1, 21))
+    manager.add_user('reader', 'secret')
+    user_id = manager.authenticate('reader', 'secret')[0]
+    for comic_id in (1, 2, 5, 21):
+        manager.add_to_collection(comic_id, user_id=user_id)
+    return user_id
+
+
+class Response:
+    def __init__(self, response):
+        self.status = response.status
+        self.headers = response.headers
+        self.raw = response.read()
+        body = self.raw
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.json = json.loads(body) if body and self.headers.get('Content-Type') == 'application/json' else None
+
+
+class Client:
+    # Requests against a ComicServer; token= signs them with a bearer token
+    def __init__(self, port):
+        self.port = port
+
+    def request(self, method, path, body=None, token=None, headers=None):
+        headers = dict(headers or {})
+        if token is not None:
+            headers['Authorization'] = f'Bearer {token}'
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        try:
+            conn.request(method, path, data, headers)
+            return Response(conn.getresponse())
+        finally:
+            conn.close()
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def login(self, username, password):
+        response = self.request('POST', '/login', {'username': username, 'password': password})
+        assert response.status == 200, response.json
+        return response.json['token']
+
+
+@pytest.fixture
+def api(manager):
+    # A ComicServer for the manager on a free port, answering from a thread
+    server = ComicServer(('127.0.0.1', 0), manager, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield Client(server.server_port)
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+from comic_async import AsyncManager, Session
+from comic_auth import needs_rehash
+
+
+def test_login_returns_a_session(tmp_path):
+    async def run():
+        async with AsyncManager(str(tmp_path / 'comicdb.db')) as manager:
+            await manager.create_comicdb()
+            await manager.add_user('reader', 'secret')
+            await manager.add_admin('owner', 'secret')
+            return (
+                await manager.login('reader', 'secret'),
+                await manager.login('owner', 'secret'),
+                await manager.login('reader', 'wrong'),
+            )
+
+    reader, owner, rejected = asyncio.run(run())
+
+    assert isinstance(reader, Session)
+    assert (reader.username, reader.clearance_level) == ('reader', 1)
+    assert owner.clearance_level == 5
+    assert rejected is None
+
+
+def test_login_upgrades_an_outdated_hash_on_the_writer(tmp_path):
+    writes = []
+
+    async def run():
+        async with AsyncManager(str(tmp_path / 'comicdb.db')) as manager:
+            await manager.create_comicdb()
+            manager.manager.password_cost = {'n': 2 ** 4, 'r': 8, 'p': 1}
+            await manager.add_user('reader', 'secret')
+            manager.manager.password_cost = {'n': 2 ** 5, 'r': 8, 'p': 1}
+            update = manager.manager.rehash_password
+            manager.manager.rehash_password = lambda *args: writes.append(threading.current_thread().name) or update(*args)
+            session = await manager.login('reader', 'secret')
+            stored = await manager._run(manager._readers, lambda: manager.manager.connect().execute(
+                'SELECT password FROM user WHERE user_id = ?', (session.user_id,)
+            ).fetchone()[0])
+            return session, stored, manager.manager.password_cost
+
+    session, stored, cost = asyncio.run(run())
+
+    assert session.username == 'reader'
+    assert writes and all(name.startswith('comicdb-writer') for name in writes)
+    assert not needs_rehash(stored, **cost)
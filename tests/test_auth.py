@@ -0,0 +1,110 @@
+import pytest
+
+from comic_auth import SessionTokens, is_hashed, needs_rehash, verify_password
+from comic_manager import _hash_passwords
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def reader(manager):
+    manager.add_user('reader', 'secret')
+    token, user = manager.login_token('reader', 'secret')
+    return token, user
+
+
+def test_changing_a_password_ends_the_users_sessions(manager, reader):
+    token, user = reader
+
+    manager.change_password(user[0], 'better')
+
+    assert manager.token_user(token) is None
+    assert manager.authenticate('reader', 'secret') is None
+    assert manager.authenticate('reader', 'better') == user
+
+
+def test_deleting_a_user_ends_their_sessions(manager, reader):
+    token, user = reader
+    manager.add_user('other', 'secret')
+    other, _ = manager.login_token('other', 'secret')
+
+    manager.delete_user(user[0])
+
+    assert manager.token_user(token) is None
+    assert manager.token_user(other) is not None
+    assert manager.authenticate('reader', 'secret') is None
+
+
+def test_expired_tokens_are_pruned_on_issue_and_lookup():
+    clock = Clock()
+    tokens = SessionTokens(ttl=10, clock=clock)
+    first = [tokens.issue((n, 'user', 1)) for n in range(3)]
+    clock.now = 5
+    second = tokens.issue((3, 'user', 1))
+    assert len(tokens) == 4
+
+    clock.now = 10
+    tokens.issue((4, 'user', 1))
+    # The first three expired unread and are gone without being looked up
+    assert len(tokens) == 2
+
+    clock.now = 15
+    assert tokens.lookup('unknown') is None
+    assert len(tokens) == 1
+    assert tokens.lookup(second) is None
+    assert all(tokens.lookup(token) is None for token in first)
+
+
+def stored_password(manager, username):
+    return manager.connect().execute('SELECT password FROM user WHERE username = ?', (username,)).fetchone()[0]
+
+
+def test_plaintext_passwords_are_hashed_on_upgrade(legacy):
+    manager = legacy(_hash_passwords)
+    conn = manager.connect()
+    conn.execute('ALTER TABLE user RENAME COLUMN clearance_level TO clearence_level')
+    conn.execute("INSERT INTO user (username, password, clearence_level) VALUES ('owner', 'secret', 5)")
+    conn.commit()
+
+    manager.migrate()
+
+    stored = stored_password(manager, 'owner')
+    assert is_hashed(stored) and verify_password('secret', stored)
+    assert manager.authenticate('owner', 'secret')[1:] == ('owner', 5)
+    assert manager.authenticate('owner', 'wrong') is None
+    assert manager.authenticate('nobody', 'secret') is None
+
+
+def test_login_rehashes_passwords_below_the_current_cost(manager):
+    manager.add_user('reader', 'secret')
+    old = stored_password(manager, 'reader')
+    manager.password_cost = {'n': 2 ** 5, 'r': 8, 'p': 1}
+    assert needs_rehash(old, **manager.password_cost)
+
+    assert manager.authenticate('reader', 'wrong') is None
+    assert stored_password(manager, 'reader') == old
+    user = manager.authenticate('reader', 'secret')
+
+    new = stored_password(manager, 'reader')
+    assert new != old and not needs_rehash(new, **manager.password_cost)
+    assert manager.authenticate('reader', 'secret') == user
+    assert stored_password(manager, 'reader') == new
+
+
+def test_tokens_expire_after_their_ttl(api, manager):
+    clock = Clock()
+    manager.tokens = SessionTokens(ttl=60, clock=clock)
+    manager.add_user('reader', 'secret')
+    token = api.login('reader', 'secret')
+
+    clock.now = 59
+    assert api.get('/collection', token=token).status == 200
+    clock.now = 60
+    assert api.get('/collection', token=token).status == 401
+    assert len(manager.tokens) == 0
@@ -0,0 +1,145 @@
+import pytest
+
+from comic_manager import _add_change_log
+
+
+def add_catalogue(manager):
+    manager.add_volume(1)
+    manager.add_publisher('Marvel')
+    manager.add_series('Spider-Man', 1, 1)
+
+
+def pull(manager, cursor_id=0, limit=1000, user_id=None):
+    # Every batch from cursor_id until an empty one, as a syncing client reads them
+    batches = []
+    while True:
+        changes = manager.changes_since(cursor_id, limit, user_id=user_id)
+        if not changes:
+            return batches
+        batches.append(changes)
+        cursor_id = changes[-1].change_id
+
+
+def test_batches_page_through_the_log_in_order(manager):
+    add_catalogue(manager)
+    manager.add_comics_bulk((1, issue, 3.99) for issue in range(1, 26))
+
+    batches = pull(manager, limit=10)
+
+    assert [len(batch) for batch in batches] == [10, 10, 8]
+    change_ids = [change.change_id for batch in batches for change in batch]
+    assert change_ids == sorted(change_ids) == list(range(1, 29))
+
+
+def test_repeated_changes_to_a_row_are_merged_within_a_batch(manager):
+    add_catalogue(manager)
+    comic_id = manager.add_comic(1, 1, 3.99)
+    start = manager.change_cursor()
+    manager.update_comic(comic_id, current_price=7)
+    manager.update_comic(comic_id, current_price=8)
+    manager.add_comic(1, 2, 3.99)
+
+    changes = manager.changes_since(start, 10)
+
+    # Three log entries, but the comic appears once with its latest data
+    assert [(change.table_name, change.action) for change in changes] == [('comic', 'update'), ('comic', 'insert')]
+    assert changes[0].data['current_price'] == 8
+    assert changes[-1].change_id == manager.change_cursor()
+
+
+def test_writes_are_logged_with_the_row_after_them(manager, catalogue):
+    start = manager.change_cursor()
+    manager.update_comic(1, current_price=9.5)
+    manager.update_comic(1, current_price=9.5)
+    # Local cover paths aren't part of the catalogue
+    manager.connect().execute("UPDATE comic SET image_path = 'a.png' WHERE comic_id = 2")
+    manager.connect().commit()
+    manager.update_publisher(2, 'DC Comics')
+    manager.delete_comic(40)
+
+    changes = [tuple(change)[1:] for change in manager.changes_since(start)]
+
+    assert changes == [
+        ('comic', 1, 'update', {
+            'comic_id': 1, 'series_id': 1, 'issue_num': 1, 'cover_price': 3.99, 'current_price': 9.5,
+            'description': None, 'image_url': None,
+        }),
+        ('publisher', 2, 'update', {'publisher_id': 2, 'name': 'DC Comics'}),
+        ('comic', 40, 'delete', None),
+    ]
+
+
+def test_collection_changes_go_to_their_owner_only(manager, catalogue):
+    manager.add_user('other', 'secret')
+    other = manager.authenticate('other', 'secret')[0]
+    start = manager.change_cursor()
+    mine = manager.add_to_collection(7, user_id=catalogue)
+    manager.add_to_collection(7, user_id=other)
+    manager.add_publisher('Image')
+
+    def tables(user_id):
+        return [(change.table_name, change.row_id) for change in manager.changes_since(start, user_id=user_id)]
+
+    assert tables(None) == [('publisher', 3)]
+    assert tables(catalogue) == [('collection', mine), ('publisher', 3)]
+
+
+def test_truncated_changes_raise_below_the_floor(manager, catalogue):
+    cursor_id = manager.change_cursor()
+    manager.add_publisher('Image')
+    manager.add_publisher('Dark Horse')
+    conn = manager.connect()
+    conn.execute('UPDATE change_log SET changed_at = 0 WHERE change_id <= ?', (cursor_id + 1,))
+    conn.commit()
+
+    assert manager.truncate_changes(older_than_days=30) == cursor_id + 1
+    assert manager.change_floor() == cursor_id + 1
+    with pytest.raises(ValueError):
+        manager.changes_since(cursor_id)
+    assert [change.data['name'] for change in manager.changes_since(cursor_id + 1)] == ['Dark Horse']
+
+    # With every entry truncated the floor is the last change_id handed out
+    conn.execute('UPDATE change_log SET changed_at = 0')
+    conn.commit()
+    manager.truncate_changes(older_than_days=30)
+    assert manager.change_floor() == manager.change_cursor() == cursor_id + 2
+    assert manager.changes_since(cursor_id + 2) == []
+
+
+def test_catalogues_older_than_the_log_need_a_full_pull(legacy, manager):
+    older = legacy(_add_change_log)
+    older.add_volume(1)
+    older.add_publisher('Marvel')
+
+    older.migrate()
+
+    assert older.change_floor() == older.change_cursor() == 1
+    with pytest.raises(ValueError):
+        older.changes_since(0)
+    older.add_publisher('DC')
+    assert [change.row_id for change in older.changes_since(1)] == [2]
+    # A database created empty starts its log from 0
+    assert manager.change_floor() == 0
+
+
+def test_the_api_syncs_until_an_empty_page_and_answers_410_below_the_floor(api, manager, catalogue):
+    token = api.login('reader', 'secret')
+    for comic_id in range(1, 21):
+        manager.update_comic(comic_id, current_price=5)
+        manager.update_comic(comic_id, current_price=6)
+
+    seen = []
+    after_id = 0
+    while after_id is not None:
+        page = api.get(f'/changes?after_id={after_id}&limit=7', token=token).json
+        seen += page['items']
+        after_id = page['next_after_id']
+    assert page['cursor'] == api.get('/changes/cursor').json['cursor'] == manager.change_cursor()
+    assert len({(item['table'], item['row_id']) for item in seen}) == 1 + 2 + 2 + 40 + 4
+
+    conn = manager.connect()
+    conn.execute('UPDATE change_log SET changed_at = 0 WHERE change_id <= 10')
+    conn.commit()
+    manager.truncate_changes()
+    assert api.get('/changes?after_id=5').status == 410
+    assert api.get('/changes?after_id=10').status == 200
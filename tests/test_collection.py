@@ -0,0 +1,43 @@
+import sqlite3
+
+import pytest
+
+
+def entries(manager, user_id):
+    return manager.connect().execute('''
+        SELECT collection_id, comic_id, quantity, grade, purchase_price, acquired_on
+        FROM collection WHERE user_id = ? ORDER BY collection_id
+    ''', (user_id,)).fetchall()
+
+
+def test_adding_an_owned_comic_adds_copies(manager, catalogue):
+    first = manager.add_to_collection(3, user_id=catalogue, grade=9.2, purchase_price=5.0)
+
+    again = manager.add_to_collection(3, user_id=catalogue, quantity=2, acquired_on='2024-01-01')
+
+    assert again == first
+    assert entries(manager, catalogue)[-1] == (first, 3, 3, 9.2, 5.0, '2024-01-01')
+    with pytest.raises(ValueError):
+        manager.add_to_collection(3, user_id=catalogue, quantity=0)
+
+
+def test_copies_are_removed_before_the_entry(manager, catalogue):
+    collection_id = manager.add_to_collection(3, user_id=catalogue, quantity=3)
+
+    assert manager.delete_collection(collection_id, quantity=2, user_id=catalogue) == 1
+    assert entries(manager, catalogue)[-1][2] == 1
+    assert manager.delete_collection(collection_id, quantity=5, user_id=catalogue) == 1
+    assert collection_id not in [row[0] for row in entries(manager, catalogue)]
+
+
+def test_only_the_owner_changes_an_entry(manager, catalogue):
+    manager.add_user('other', 'secret')
+    other = manager.authenticate('other', 'secret')[0]
+    collection_id = entries(manager, catalogue)[0][0]
+
+    assert manager.update_collection(collection_id, quantity=4, user_id=other) == 0
+    assert manager.delete_collection(collection_id, user_id=other) == 0
+    assert manager.update_collection(collection_id, quantity=4, grade=8.0, user_id=catalogue) == 1
+    assert entries(manager, catalogue)[0][2:4] == (4, 8.0)
+    with pytest.raises(sqlite3.IntegrityError):
+        manager.update_collection(collection_id, quantity=-1, user_id=catalogue)
@@ -0,0 +1,195 @@
+# ImageStore against a local HTTP server standing in for the remote cover
+# source, so fetching, storage and failures are tested without the network.
+import functools
+import hashlib
+import os
+import struct
+import threading
+import zlib
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from comic_images import Image, ImageStore, fetch
+
+
+def png(color):
+    # A valid 2x2 PNG of one colour, so Pillow can thumbnail it when installed
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    rows = b''.join(b'\x00' + bytes(color) * 2 for _ in range(2))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 2, 2, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def source(tmp_path):
+    # Serves tmp_path/remote over HTTP; yields (directory, base URL)
+    directory = tmp_path / 'remote'
+    directory.mkdir()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=str(directory)))
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield directory, f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store(manager, tmp_path):
+    return ImageStore(manager, root=str(tmp_path / 'covers'))
+
+
+@pytest.fixture
+def comics(manager):
+    manager.add_volume(1)
+    manager.add_publisher('Marvel')
+    manager.add_series('Spider-Man', 1, 1)
+    manager.add_comics_bulk((1, issue, 3.99) for issue in range(1, 5))
+    return [1, 2, 3, 4]
+
+
+def cached_paths(manager, comic_id):
+    return manager.connect().execute(
+        'SELECT image_path, thumb_path FROM comic WHERE comic_id = ?', (comic_id,)
+    ).fetchone()
+
+
+def test_cache_comic_stores_the_served_image(manager, store, comics, source):
+    directory, url = source
+    data = png((255, 0, 0))
+    (directory / 'red.png').write_bytes(data)
+    manager.update_comic(1, image_url=f'{url}/red.png')
+
+    relative, thumb = store.cache_comic(1)
+
+    digest = hashlib.sha256(data).hexdigest()
+    assert relative == os.path.join(digest[:2], digest + '.png')
+    with open(store.path(relative), 'rb') as f:
+        assert f.read() == data
+    assert cached_paths(manager, 1) == (relative, thumb)
+    assert (thumb is None) == (Image is None)
+    assert store.cover(1) == (store.path(relative), 'image/png')
+    assert store.total_bytes() >= len(data)
+
+
+def test_identical_images_are_stored_once(manager, store, comics, source):
+    directory, url = source
+    data = png((0, 255, 0))
+    (directory / 'a.png').write_bytes(data)
+    (directory / 'b.png').write_bytes(data)
+    manager.update_comic(1, image_url=f'{url}/a.png')
+    manager.update_comic(2, image_url=f'{url}/b.png')
+
+    assert store.cache_missing() == (2, 0)
+
+    assert cached_paths(manager, 1) == cached_paths(manager, 2)
+    assert manager.connect().execute('SELECT COUNT(*) FROM image_cache').fetchone()[0] == 1
+
+
+def test_failed_downloads_are_counted_and_left_uncached(manager, store, comics, source):
+    directory, url = source
+    (directory / 'good.png').write_bytes(png((0, 0, 255)))
+    (directory / 'notes.txt').write_bytes(b'not an image')
+    manager.update_comic(1, image_url=f'{url}/good.png')
+    manager.update_comic(2, image_url=f'{url}/missing.png')
+    manager.update_comic(3, image_url=f'{url}/notes.txt')
+
+    assert store.cache_missing() == (1, 2)
+
+    assert cached_paths(manager, 1)[0] is not None
+    assert cached_paths(manager, 2) == (None, None)
+    assert cached_paths(manager, 3) == (None, None)
+    # Only the comics still missing a cover are fetched again
+    assert store.cache_missing() == (0, 2)
+
+
+def test_local_paths_are_a_source_too(manager, store, comics, tmp_path):
+    path = tmp_path / 'local.png'
+    path.write_bytes(png((9, 9, 9)))
+    manager.update_comic(1, image_url=str(path))
+
+    relative, thumb = store.cache_comic(1)
+
+    assert relative.endswith('.png')
+    assert store.cover(1)[1] == 'image/png'
+
+
+def test_fetch_rejects_oversized_images(source):
+    directory, url = source
+    (directory / 'big.png').write_bytes(png((1, 2, 3)) + b'\x00' * 1024)
+
+    with pytest.raises(ValueError):
+        fetch(f'{url}/big.png', limit=1024)
+
+
+def test_a_new_image_url_clears_the_cached_copy(manager, store, comics, source):
+    directory, url = source
+    (directory / 'old.png').write_bytes(png((4, 5, 6)))
+    manager.update_comic(1, image_url=f'{url}/old.png')
+    store.cache_comic(1)
+
+    manager.update_comic(1, image_url=f'{url}/new.png')
+
+    assert cached_paths(manager, 1) == (None, None)
+    assert store.cover(1) is None
+
+
+def test_least_recently_used_images_are_evicted(manager, store, comics, source):
+    directory, url = source
+    images = [png((n, n, n)) for n in (10, 20, 30)]
+    for comic_id, data in zip(comics, images):
+        (directory / f'{comic_id}.png').write_bytes(data)
+        manager.update_comic(comic_id, image_url=f'{url}/{comic_id}.png')
+    store.cache_missing()
+    oldest = cached_paths(manager, 1)[0]
+    manager.connect().execute('UPDATE image_cache SET last_used = 0 WHERE path = ?', (oldest,))
+    manager.connect().commit()
+
+    assert store.evict(max_bytes=store.total_bytes() - 1) == 1
+
+    assert cached_paths(manager, 1) == (None, None)
+    assert not os.path.exists(store.path(oldest))
+    assert cached_paths(manager, 2)[0] is not None
+
+
+def test_cache_missing_holds_a_bounded_window_of_downloads(manager, tmp_path, comics):
+    manager.add_comics_bulk((1, issue, 3.99) for issue in range(5, 41))
+    for comic_id in range(1, 41):
+        manager.update_comic(comic_id, image_url=f'cover-{comic_id}')
+    held = []
+    fetched = []
+
+    def fetch(source):
+        fetched.append(source)
+        held.append(len(fetched) - len(stored))
+        return png((int(source.split('-')[1]), 0, 0))
+
+    store = ImageStore(manager, root=str(tmp_path / 'covers'), fetch=fetch)
+    stored = []
+    add_bytes = store.add_bytes
+    store.add_bytes = lambda data: stored.append(1) or add_bytes(data)
+
+    assert store.cache_missing(workers=2) == (40, 0)
+    # Fetched images waiting to be stored never exceed workers * 2, plus the
+    # one being fetched
+    assert max(held) <= 5
+
+
+def test_files_of_a_failed_add_are_removed(manager, store, monkeypatch):
+    def fail(digest, data):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(store, '_thumbnail', fail)
+
+    with pytest.raises(OSError):
+        store.add_bytes(png((7, 7, 7)))
+
+    assert [name for _, _, names in os.walk(store.root) for name in names] == []
+    assert store.total_bytes() == 0
@@ -0,0 +1,94 @@
+# The importer reading CSV and JSON Lines files written to a temporary
+# directory, as it would read an export from another catalogue
+import json
+
+import pytest
+
+from comic_import import Importer
+
+
+def write_csv(path, header, rows):
+    path.write_text('\n'.join([','.join(header)] + [','.join(map(str, row)) for row in rows]) + '\n')
+    return str(path)
+
+
+def test_series_then_comics_in_several_chunks(manager, tmp_path):
+    series = write_csv(tmp_path / 'series.csv', ('name', 'volume', 'publisher'), [
+        (f'Series {n}', n % 3 + 1, f'Publisher {n % 4}') for n in range(25)
+    ])
+    comics = tmp_path / 'comics.jsonl'
+    comics.write_text(''.join(
+        json.dumps({'series': f'Series {n % 25}', 'issue_num': n // 25 + 1, 'cover_price': '3.99'}) + '\n'
+        for n in range(100)
+    ))
+
+    importer = Importer(manager, chunk_size=10)
+    assert importer.import_file(series, 'series') == 25
+    importer.import_file(str(comics), 'comics')
+
+    assert (importer.rows, importer.inserted) == (125, 125)
+    assert len(manager.show_all_series()) == 25
+    assert len(manager.show_all_publishers()) == 4
+    stored = {(row[1], row[2], row[3], row[4]) for row in manager.iter_comic_details()}
+    assert ('Series 7', 'Vol. 2', 'Publisher 3', 2) in stored and len(stored) == 100
+
+
+def test_bulk_chunks_do_not_reload_whole_tables(manager, tmp_path):
+    path = write_csv(tmp_path / 'series.csv', ('name', 'volume', 'publisher'), [
+        (f'Series {n}', 1, 'Marvel') for n in range(50)
+    ])
+    importer = Importer(manager, chunk_size=5)
+    loads = []
+    load_lookups = importer._load_lookups
+    importer._load_lookups = lambda: loads.append(1) or load_lookups()
+
+    importer.import_file(path, 'series')
+
+    assert len(loads) == 1
+    assert len(importer.series) == 50
+    # Every imported series resolves by name without another lookup
+    assert importer.series_id('Series 49') == max(importer.series.values())
+
+
+def test_repeated_rows_are_not_inserted_twice(manager, tmp_path):
+    path = write_csv(tmp_path / 'publishers.csv', ('name',), [('Marvel',), ('DC',), ('Marvel',)])
+
+    importer = Importer(manager, chunk_size=2)
+    importer.import_file(path, 'publishers')
+    importer.import_file(path, 'publishers')
+
+    assert sorted(publisher.name for publisher in manager.show_all_publishers()) == ['DC', 'Marvel']
+
+
+def test_comics_of_an_unknown_series_are_rejected(manager, tmp_path):
+    path = write_csv(tmp_path / 'comics.csv', ('series', 'issue_num', 'cover_price'), [('Nowhere', 1, 3.99)])
+
+    with pytest.raises(ValueError, match='Unknown series'):
+        Importer(manager).import_file(path, 'comics')
+
+
+def test_unknown_formats_are_rejected(manager, tmp_path):
+    path = tmp_path / 'comics.xml'
+    path.write_text('<comics/>')
+
+    with pytest.raises(ValueError, match='Unknown import format'):
+        Importer(manager).import_file(str(path), 'comics')
+
+
+def test_volume_rows_without_a_number_are_rejected(manager, tmp_path):
+    path = write_csv(tmp_path / 'volumes.csv', ('num', 'name'), [(1, ''), ('', 'Vol. 2'), ('', 'Vol.'), (4, '')])
+    importer = Importer(manager, chunk_size=2)
+
+    with pytest.raises(ValueError, match='row 3 '):
+        importer.import_file(path, 'volumes')
+
+    assert [row[1] for row in manager.show_all_volumes()] == ['Vol. 1', 'Vol. 2']
+
+
+def test_series_rows_without_a_volume_are_rejected(manager, tmp_path):
+    path = write_csv(tmp_path / 'series.csv', ('name', 'volume', 'publisher'), [('Spider-Man', '', 'Marvel')])
+
+    with pytest.raises(ValueError, match='volume'):
+        Importer(manager).import_file(path, 'series')
+
+    assert manager.show_all_volumes() == []
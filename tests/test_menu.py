@@ -0,0 +1,84 @@
+# Picker driven by scripted input, recording what it prints
+from comic_menu import Picker
+
+
+def scripted(*answers):
+    # input and print stand-ins: answers are given in order, output collected
+    answers = list(answers)
+    printed = []
+
+    def answer(prompt):
+        printed.append(prompt)
+        return answers.pop(0)
+
+    return answer, printed.append, printed
+
+
+def picker(rows, *answers, page_size=3, pages=False):
+    answer, show, printed = scripted(*answers)
+    if pages:
+        chosen = Picker.from_pages(rows, lambda row: row[1], page_size=page_size, input_func=answer, print_func=show)
+    else:
+        chosen = Picker.from_rows(rows, str, page_size=page_size, input_func=answer, print_func=show)
+    return chosen, printed
+
+
+NAMES = ['Amazing', 'Batman', 'Captain', 'Daredevil', 'Elektra', 'Fantastic', 'Ghost']
+
+
+def test_pages_keep_their_numbering():
+    chooser, printed = picker(NAMES, 'n', 'n', '7')
+
+    assert chooser.choose('Pick: ') == 'Ghost'
+    assert printed[0] == '1.) Amazing\n2.) Batman\n3.) Captain'
+    assert printed[1] == 'n = next page, /text = filter'
+    assert printed[3] == '4.) Daredevil\n5.) Elektra\n6.) Fantastic'
+    assert printed[4] == 'n = next page, p = previous page, /text = filter'
+    assert printed[6] == '7.) Ghost'
+
+
+def test_numbers_off_the_page_are_refused():
+    chooser, printed = picker(NAMES, '4', 'x', 'n', 'p', '2')
+
+    assert chooser.choose('Pick: ') == 'Batman'
+    assert printed.count('Please enter a valid number that is in the list') == 2
+    assert printed[-3] == '1.) Amazing\n2.) Batman\n3.) Captain'
+
+
+def test_a_filter_pages_over_matching_rows_only():
+    chooser, printed = picker(NAMES * 3, '/a', 'n', 'n', '/zzz', '/', '1')
+
+    assert chooser.choose('Pick: ') == 'Amazing'
+    # Six names hold an a, so the filtered pages run 1-3, 4-6, 7-9 ...
+    filtered = [line for line in printed if line.startswith('1.) ') or line.startswith('4.) ')
+                or line.startswith('7.) ')]
+    assert filtered[1:4] == [
+        '1.) Amazing\n2.) Batman\n3.) Captain',
+        '4.) Daredevil\n5.) Elektra\n6.) Fantastic',
+        '7.) Amazing\n8.) Batman\n9.) Captain',
+    ]
+    assert 'Nothing matches "zzz"' in printed
+
+
+def test_empty_sources_and_show_only_lists_return_none():
+    chooser, printed = picker([], page_size=3)
+    assert chooser.choose('Pick: ') is None
+    assert printed == []
+
+    chooser, printed = picker(NAMES, '')
+    assert chooser.choose() is None
+    assert printed[-1] == 'Hit Enter to continue: '
+
+
+def test_pages_are_read_from_the_manager_as_needed(manager, catalogue):
+    calls = []
+
+    def fetch_page(after_id, limit):
+        calls.append(after_id)
+        return manager.show_series_page(after_id, limit)
+
+    chooser, printed = picker(fetch_page, '/bat', '1', page_size=1, pages=True)
+
+    assert tuple(chooser.choose('Pick: ')) == tuple(manager.get_series(2))
+    assert printed[0] == '1.) Spider-Man'
+    assert calls[0] == 0
@@ -0,0 +1,113 @@
+# Upgrades of databases built before a migration, holding rows written under
+# the old schema
+import sqlite3
+
+import pytest
+
+from comic_manager import _add_collection_quantities, _add_delete_actions
+
+
+@pytest.fixture
+def before_delete_actions(legacy):
+    # A catalogue with foreign keys but no delete actions: two series, three
+    # comics, two collectors and price history
+    manager = legacy(_add_delete_actions)
+    conn = manager.connect()
+    conn.executescript('''
+        INSERT INTO volume (volume_id, name) VALUES (1, 'Vol. 1'), (2, 'Vol. 2');
+        INSERT INTO publisher (publisher_id, name) VALUES (1, 'Marvel'), (2, 'DC');
+        INSERT INTO series (series_id, name, volume_id, publisher_id) VALUES (1, 'Spider-Man', 1, 1), (2, 'Batman', 2, 2);
+        INSERT INTO comic (comic_id, series_id, issue_num, cover_price, current_price) VALUES
+            (1, 1, 1, 3.99, 10), (2, 1, 2, 3.99, NULL), (3, 2, 1, 4.99, 6);
+        INSERT INTO user (user_id, username, password, clearance_level) VALUES (1, 'a', 'x', 1), (2, 'b', 'x', 1);
+        INSERT INTO collection (collection_id, user_id, comic_id) VALUES (1, 1, 1), (2, 1, 3), (3, 2, 2);
+    ''')
+    # A deleted comic's id must not come back after the tables are rebuilt
+    conn.execute("INSERT INTO comic (comic_id, series_id, issue_num, cover_price) VALUES (9, 1, 9, 1)")
+    conn.execute('DELETE FROM comic WHERE comic_id = 9')
+    conn.commit()
+    manager.migrate()
+    return manager
+
+
+def count(manager, table):
+    return manager.connect().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_rows_survive_the_rebuild(before_delete_actions):
+    manager = before_delete_actions
+    conn = manager.connect()
+
+    assert conn.execute('PRAGMA foreign_key_check').fetchall() == []
+    assert conn.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    assert [count(manager, table) for table in ('series', 'comic', 'collection')] == [2, 3, 3]
+    assert manager.add_comic(1, 3, 3.99) == 10
+    assert manager.get_price_history(1)[-1][1] == 10
+
+
+def test_deleting_a_series_cascades_to_comics_and_collections(before_delete_actions):
+    manager = before_delete_actions
+
+    manager.delete_series(1)
+
+    assert count(manager, 'comic') == 1
+    assert manager.connect().execute('SELECT collection_id FROM collection').fetchall() == [(2,)]
+    assert manager.get_price_history(1) == []
+    assert manager.connect().execute('PRAGMA foreign_key_check').fetchall() == []
+
+
+def test_volumes_and_publishers_in_use_are_kept(before_delete_actions):
+    manager = before_delete_actions
+
+    with pytest.raises(sqlite3.IntegrityError):
+        manager.delete_volume(1)
+    with pytest.raises(sqlite3.IntegrityError):
+        manager.delete_publisher(2)
+    assert count(manager, 'volume') == 2 and count(manager, 'publisher') == 2
+
+    manager.delete_series(2)
+    manager.delete_volume(2)
+    manager.delete_publisher(2)
+    assert count(manager, 'volume') == 1 and count(manager, 'publisher') == 1
+
+
+def test_deleting_a_user_deletes_their_collection(before_delete_actions):
+    manager = before_delete_actions
+
+    manager.delete_user(1)
+
+    assert manager.connect().execute('SELECT user_id FROM collection').fetchall() == [(2,)]
+    assert count(manager, 'comic') == 3
+
+
+def test_duplicate_collection_rows_collapse_into_quantities(legacy):
+    manager = legacy(_add_collection_quantities)
+    manager.add_volume(1)
+    manager.add_publisher('Marvel')
+    manager.add_series('Spider-Man', 1, 1)
+    manager.add_comics_bulk([(1, 1, 2.0), (1, 2, 3.0)])
+    conn = manager.connect()
+    # A value summary enabled before quantities, with one row per copy
+    conn.execute('''
+        CREATE TABLE collection_value_summary (
+            user_id INTEGER PRIMARY KEY, comics INTEGER NOT NULL, cover_total REAL NOT NULL, current_total REAL NOT NULL
+        )
+    ''')
+    conn.execute("INSERT INTO user (user_id, username, password, clearance_level) VALUES (1, 'a', 'x', 1), (2, 'b', 'x', 1)")
+    conn.executemany('INSERT INTO collection (user_id, comic_id) VALUES (?, ?)', [
+        (1, 1), (1, 2), (1, 1), (2, 1), (1, 1),
+    ])
+    conn.commit()
+
+    manager.migrate()
+
+    assert conn.execute('SELECT collection_id, user_id, comic_id, quantity FROM collection ORDER BY 1').fetchall() == [
+        (1, 1, 1, 3), (2, 1, 2, 1), (4, 2, 1, 1),
+    ]
+    # The summary was rebuilt with triggers that count copies
+    assert manager.value_summary(1) == manager.collection_value(1) == (4, 9.0, 9.0, 0.0)
+    assert manager.add_to_collection(1, user_id=1) == 1
+    assert manager.value_summary(1) == (5, 11.0, 11.0, 0.0)
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute('INSERT INTO collection (user_id, comic_id) VALUES (1, 2)')
+    conn.rollback()
@@ -0,0 +1,44 @@
+def gaps(records):
+    return [tuple(gap) for gap in records]
+
+
+def test_runs_missing_from_each_series(manager, catalogue):
+    assert gaps(manager.missing_issues(user_id=catalogue)) == [
+        (2, 'Batman', 2, 20, 19, 19),
+        (1, 'Spider-Man', 3, 4, 2, 2),
+        (1, 'Spider-Man', 6, 20, 15, 15),
+    ]
+    assert gaps(manager.missing_issues(1, user_id=catalogue)) == gaps(manager.missing_issues(user_id=catalogue))[1:]
+
+
+def test_gaps_count_what_the_catalogue_holds(manager, catalogue):
+    # Issues 10 to 12 were never catalogued, and 25 is the newest issue
+    manager.connect().execute('DELETE FROM comic WHERE series_id = 1 AND issue_num BETWEEN 10 AND 12')
+    manager.connect().commit()
+    manager.add_comic(1, 25, 3.99)
+    manager.add_to_collection(20, user_id=catalogue)
+
+    assert gaps(manager.missing_issues(1, user_id=catalogue)) == [
+        (1, 'Spider-Man', 3, 4, 2, 2),
+        (1, 'Spider-Man', 6, 19, 14, 11),
+        (1, 'Spider-Man', 21, 25, 5, 1),
+    ]
+
+
+def test_complete_and_unowned_series_have_no_gaps(manager, catalogue):
+    for comic_id in range(21, 41):
+        manager.add_to_collection(comic_id, user_id=catalogue)
+    manager.add_user('other', 'secret')
+
+    assert [gap.series for gap in manager.missing_issues(user_id=catalogue)] == ['Spider-Man', 'Spider-Man']
+    assert manager.missing_issues(user_id=manager.authenticate('other', 'secret')[0]) == []
+
+
+def test_missing_issues_over_the_api(api, catalogue):
+    token = api.login('reader', 'secret')
+
+    assert api.get('/collection/missing').status == 401
+    items = api.get('/collection/missing?series_id=2', token=token).json['items']
+    assert items == [{
+        'series_id': 2, 'series': 'Batman', 'first_issue': 2, 'last_issue': 20, 'missing': 19, 'in_catalogue': 19,
+    }]
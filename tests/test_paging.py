@@ -0,0 +1,69 @@
+# Keyset pages and streamed listings must cover every row exactly once, in
+# key order, however the page and chunk sizes fall
+import pytest
+
+
+def all_pages(fetch_page, limit):
+    rows = []
+    after_id = 0
+    while True:
+        page = fetch_page(after_id, limit)
+        rows.extend(page)
+        if len(page) < limit:
+            return rows
+        after_id = page[-1][0]
+
+
+@pytest.fixture
+def listing(manager, catalogue):
+    # Gaps in every key sequence, as deletes leave them
+    manager.add_comics_bulk((2, issue, 3.99) for issue in range(21, 60))
+    manager.delete_comic(3)
+    manager.delete_comic(50)
+    manager.add_volume(2)
+    manager.add_publisher('Image')
+    manager.delete_publisher(3)
+    manager.add_publisher('Dark Horse')
+    return manager
+
+
+@pytest.mark.parametrize('size', [1, 7, 77, 1000])
+def test_pages_and_chunks_cover_every_row_once(listing, size):
+    expected = {
+        'comics': sorted(map(tuple, listing.show_all_comics())),
+        'series': sorted(map(tuple, listing.show_all_series())),
+        'publishers': sorted(map(tuple, listing.show_all_publishers())),
+        'volumes': sorted(map(tuple, listing.show_all_volumes())),
+    }
+    pages = {
+        'comics': listing.show_comics_page,
+        'series': listing.show_series_page,
+        'publishers': listing.show_publishers_page,
+        'volumes': listing.show_volumes_page,
+    }
+    streams = {
+        'comics': listing.iter_comics,
+        'series': listing.iter_series,
+        'publishers': listing.iter_publishers,
+        'volumes': listing.iter_volumes,
+    }
+
+    for kind, rows in expected.items():
+        assert list(map(tuple, all_pages(pages[kind], size))) == rows, kind
+        assert list(map(tuple, streams[kind](chunk_size=size))) == rows, kind
+    assert len(expected['comics']) == 77
+
+
+def test_pages_past_the_end_are_empty(listing):
+    assert listing.show_comics_page(after_id=10 ** 6) == []
+    assert listing.show_comics_page(limit=0) == []
+
+
+def test_a_stream_can_be_abandoned_part_way(listing):
+    rows = listing.iter_comics(chunk_size=5)
+    assert [next(rows)[0] for _ in range(3)] == [1, 2, 4]
+    rows.close()
+
+    # The connection is free for writes and new reads
+    listing.add_publisher('Boom')
+    assert len(list(listing.iter_comics(chunk_size=5))) == 77
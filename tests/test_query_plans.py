@@ -0,0 +1,72 @@
+# The hot lookups have to search the indexes added by the migrations rather
+# than scan their tables. Each test runs a Manager method, captures the SQL it
+# sends and checks EXPLAIN QUERY PLAN for every statement.
+import re
+
+
+def query_plan(manager, call):
+    # Plan details of each distinct statement the call runs
+    conn = manager.connect()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+
+    details = []
+    for sql in dict.fromkeys(statements):
+        if re.match(r'\s*(SELECT|WITH|UPDATE|DELETE)\b', sql, re.IGNORECASE):
+            details.extend(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql))
+    return details
+
+
+def assert_searches(details, index, *tables):
+    # index is searched, and none of the tables or aliases are scanned
+    assert any(detail.startswith('SEARCH') and f'INDEX {index} ' in detail for detail in details), details
+    for table in tables:
+        assert not any(re.match(rf'SCAN {table}\b', detail) for detail in details), details
+
+
+def test_user_collection_searches_by_user(manager, catalogue):
+    details = query_plan(manager, lambda: manager.show_user_comics_page(user_id=catalogue))
+    assert_searches(details, 'idx_collection_user_comic', 'co', 'collection')
+
+
+def test_collection_value_searches_by_user(manager, catalogue):
+    details = query_plan(manager, lambda: manager.collection_value(catalogue))
+    assert_searches(details, 'idx_collection_user_comic', 'co', 'collection')
+
+
+def test_login_searches_by_username(manager, catalogue):
+    details = query_plan(manager, lambda: manager.authenticate('reader', 'secret'))
+    assert_searches(details, 'idx_user_username', 'user')
+
+
+def test_series_issues_search_by_series(manager, catalogue):
+    details = query_plan(manager, lambda: manager.missing_issues(1, user_id=catalogue))
+    assert_searches(details, 'idx_comic_series_issue', 'c', 'comic')
+    assert_searches(details, 'idx_collection_user_comic', 'co', 'collection')
+
+
+def test_comic_delete_searches_collection_by_comic(manager, catalogue):
+    details = query_plan(manager, lambda: manager.delete_comic(5))
+    assert_searches(details, 'idx_collection_comic', 'collection')
+
+
+def test_publisher_merge_searches_series_by_publisher(manager, catalogue):
+    details = query_plan(manager, lambda: manager.merge_publishers(1, [2]))
+    assert_searches(details, 'idx_series_publisher', 'series')
+
+
+def test_series_merge_searches_comics_by_series(manager, catalogue):
+    details = query_plan(manager, lambda: manager.merge_series(1, [2]))
+    assert_searches(details, 'idx_comic_series_issue', 'comic')
+
+
+def test_volume_lookup_searches_series_by_volume(manager, catalogue):
+    # The foreign key check behind delete_volume runs this lookup
+    details = [row[3] for row in manager.connect().execute(
+        'EXPLAIN QUERY PLAN SELECT 1 FROM series WHERE volume_id = ?', (1,)
+    )]
+    assert_searches(details, 'idx_series_volume', 'series')
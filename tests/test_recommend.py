@@ -0,0 +1,96 @@
+# The incrementally updated model must give the same scores as one rebuilt
+# from the collection table, whatever mix of writes came in between
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from comic_recommend import Recommender
+
+
+@pytest.fixture
+def collectors(manager):
+    # Eight series of five issues and twenty collectors owning a few each
+    manager.add_volume(1)
+    manager.add_publisher('Marvel')
+    for n in range(8):
+        manager.add_series(f'Series {n}', 1, 1)
+    manager.add_comics_bulk((series_id, issue, 3.99) for series_id in range(1, 9) for issue in range(1, 6))
+    rng = random.Random(7)
+    users = []
+    for n in range(20):
+        manager.add_user(f'user{n}', 'secret')
+        users.append(manager.authenticate(f'user{n}', 'secret')[0])
+        for comic_id in rng.sample(range(1, 41), 4):
+            manager.add_to_collection(comic_id, user_id=users[-1])
+    return users
+
+
+def recommendations(recommender, user_id):
+    return {record.series_id: round(record.score, 9) for record in recommender.recommend(user_id, limit=100)}
+
+
+def assert_matches_rebuild(manager, recommender, users):
+    rebuilt = Recommender(manager)
+    for user_id in users:
+        assert recommendations(recommender, user_id) == recommendations(rebuilt, user_id)
+
+
+@pytest.mark.parametrize('merge_at', [1, 10, 100000])
+def test_incremental_updates_match_a_rebuild(manager, collectors, merge_at):
+    users = collectors
+    recommender = Recommender(manager, merge_at=merge_at)
+    recommender.build()
+    assert any(recommendations(recommender, user_id) for user_id in users)
+    rng = random.Random(merge_at)
+
+    for _ in range(6):
+        for user_id in rng.sample(users, 5):
+            manager.add_to_collection(rng.randrange(1, 41), user_id=user_id)
+        removed = manager.connect().execute('SELECT collection_id, user_id FROM collection ORDER BY random() LIMIT 3')
+        for collection_id, user_id in removed.fetchall():
+            manager.delete_collection(collection_id, user_id=user_id)
+        recommender.refresh()
+        assert_matches_rebuild(manager, recommender, users)
+
+    # A new series, comics moved between series and a deleted comic
+    new = manager.add_series('Series 8', 1, 1)
+    comic_id = manager.add_comic(new, 1, 3.99)
+    manager.add_to_collection(comic_id, user_id=users[0])
+    manager.add_to_collection(comic_id, user_id=users[1])
+    manager.merge_series(1, [2])
+    manager.delete_comic(40)
+    recommender.refresh()
+    assert_matches_rebuild(manager, recommender, users)
+
+
+def test_a_truncated_log_rebuilds_the_model(manager, collectors):
+    users = collectors
+    recommender = Recommender(manager)
+    recommender.build()
+    manager.add_to_collection(1, user_id=users[0])
+    manager.add_to_collection(6, user_id=users[0])
+    conn = manager.connect()
+    conn.execute('UPDATE change_log SET changed_at = 0')
+    conn.commit()
+    manager.truncate_changes()
+
+    assert_matches_rebuild(manager, recommender, users)
+    assert recommender.cursor == manager.change_cursor()
+
+
+def test_a_user_without_a_collection_gets_nothing(manager, collectors):
+    manager.add_user('new', 'secret')
+
+    assert Recommender(manager).recommend(manager.authenticate('new', 'secret')[0]) == []
+
+
+def test_recommendations_over_the_api(api, collectors):
+    token = api.login('user0', 'secret')
+
+    items = api.get('/collection/recommendations?limit=3', token=token).json['items']
+
+    assert 0 < len(items) <= 3
+    assert [item['score'] for item in items] == sorted((item['score'] for item in items), reverse=True)
+    assert all(item['series'].startswith('Series ') for item in items)
@@ -0,0 +1,24 @@
+def test_search_ranks_every_match(manager):
+    # The best match is the last comic added, after more than a thousand
+    # weaker ones, so it only comes first if all matches are ranked
+    manager.add_volume(1)
+    manager.add_publisher('Marvel')
+    manager.add_series('Spider Man Amazing Adventures Tales', 1, 1)
+    manager.add_series('Spider', 1, 1)
+    manager.add_comics_bulk((1, issue, 3.99) for issue in range(1, 1201))
+    best = manager.add_comic(2, 1, 3.99)
+
+    comics = manager.search_comics('spider', limit=5)
+
+    assert comics[0].comic_id == best
+    assert len(comics) == 5
+
+
+def test_search_matches_prefixes_and_exact_numbers(manager):
+    manager.add_volume(1)
+    manager.add_publisher('Marvel')
+    manager.add_series('Uncanny X-Men', 1, 1)
+    manager.add_comics_bulk((1, issue, 3.99) for issue in (1, 12, 120))
+
+    assert [comic.issue_num for comic in manager.search_comics('uncan 12')] == [12]
+    assert manager.search_comics('!!') == []
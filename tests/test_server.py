@@ -0,0 +1,120 @@
+# The JSON API over HTTP, against a server on a free local port
+import base64
+
+import pytest
+
+from comic_server import MAX_PAGE_SIZE
+
+
+@pytest.fixture
+def staff(manager, catalogue):
+    # A user at each clearance level from 1 to 4, by level
+    manager.add_user('staff2', 'secret')
+    manager.add_user('staff3', 'secret')
+    manager.add_user('staff4', 'secret')
+    conn = manager.connect()
+    conn.executemany('UPDATE user SET clearance_level = ? WHERE username = ?', [
+        (level, f'staff{level}') for level in (2, 3, 4)
+    ])
+    conn.commit()
+    return {1: 'reader', 2: 'staff2', 3: 'staff3', 4: 'staff4'}
+
+
+def test_catalogue_changes_need_clearance(api, staff):
+    tokens = {level: api.login(name, 'secret') for level, name in staff.items()}
+    comic = {'series_id': 1, 'issue_num': 99, 'cover_price': 4.99}
+
+    unsigned = api.request('POST', '/comics', comic)
+    assert unsigned.status == 401
+    assert 'Bearer' in unsigned.headers['WWW-Authenticate']
+    assert api.request('POST', '/comics', comic, token='forged').status == 401
+    assert api.request('POST', '/comics', comic, token=tokens[1]).status == 403
+
+    created = api.request('POST', '/comics', comic, token=tokens[2])
+    assert created.status == 201
+    comic_id = created.json['comic_id']
+
+    assert api.request('PATCH', f'/comics/{comic_id}', {'current_price': 9}, token=tokens[3]).status == 403
+    assert api.request('PATCH', f'/comics/{comic_id}', {'current_price': 9}, token=tokens[4]).status == 200
+    assert api.request('DELETE', f'/comics/{comic_id}', token=tokens[2]).status == 403
+    assert api.request('DELETE', f'/comics/{comic_id}', token=tokens[3]).status == 200
+    # Reads stay open
+    assert api.get('/comics').status == 200
+
+
+def test_basic_credentials_sign_requests_too(api, staff):
+    credentials = base64.b64encode(b'staff2:secret').decode()
+    wrong = base64.b64encode(b'staff2:wrong').decode()
+
+    assert api.request('POST', '/publishers', {'name': 'Image'},
+                       headers={'Authorization': f'Basic {credentials}'}).status == 201
+    assert api.request('POST', '/publishers', {'name': 'Image'},
+                       headers={'Authorization': f'Basic {wrong}'}).status == 401
+
+
+def test_logout_ends_the_token(api, staff):
+    token = api.login('reader', 'secret')
+    assert api.get('/collection', token=token).status == 200
+
+    assert api.request('POST', '/logout', token=token).status == 200
+
+    assert api.get('/collection', token=token).status == 401
+
+
+def test_unchanged_lists_answer_304(api, manager, catalogue):
+    first = api.get('/series')
+    etag = first.headers['ETag']
+
+    repeat = api.get('/series', headers={'If-None-Match': etag})
+    assert (repeat.status, repeat.raw) == (304, b'')
+
+    manager.add_series('X-Men', 1, 1)
+    changed = api.get('/series', headers={'If-None-Match': etag})
+    assert changed.status == 200
+    assert changed.headers['ETag'] != etag
+    assert len(changed.json['items']) == 3
+
+
+def test_large_responses_are_gzipped_when_accepted(api, catalogue):
+    large = api.get('/comics', headers={'Accept-Encoding': 'gzip'})
+    assert large.headers['Content-Encoding'] == 'gzip'
+    plain = api.get('/comics')
+    assert 'Content-Encoding' not in plain.headers
+    assert large.json == plain.json
+    assert len(large.raw) < len(plain.raw)
+    # Small bodies go out as they are
+    assert 'Content-Encoding' not in api.get('/volumes', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_conflicting_writes_answer_409(api, staff):
+    token = api.login('staff4', 'secret')
+
+    # The volume and publisher are still used by a series
+    assert api.request('DELETE', '/volumes/1', token=token).status == 409
+    assert api.request('DELETE', '/publishers/1', token=token).status == 409
+    missing_parent = api.request('POST', '/series', {'name': 'X', 'volume_id': 1, 'publisher_id': 99}, token=token)
+    assert missing_parent.status == 409
+    # The failed writes left nothing locked
+    assert api.request('POST', '/publishers', {'name': 'Image'}, token=token).status == 201
+
+
+def test_limits_are_checked_and_capped(api, manager, catalogue):
+    manager.add_comics_bulk((1, issue, 3.99) for issue in range(100, 700))
+
+    assert api.get('/comics?limit=0').status == 400
+    assert api.get('/comics?limit=-1').status == 400
+    assert api.get('/comics/search?q=spider&limit=0').status == 400
+    assert len(api.get('/comics?limit=100000').json['items']) == MAX_PAGE_SIZE
+
+    page = api.get('/comics?limit=2').json
+    assert [item['comic_id'] for item in page['items']] == [1, 2]
+    assert page['next_after_id'] == 2
+    last = api.get('/comics?after_id=100000').json
+    assert last == {'items': [], 'next_after_id': None}
+    assert api.get('/comics?limit=abc').status == 400
+
+
+def test_unknown_routes_and_rows_answer_404(api, catalogue):
+    assert api.get('/nothing').status == 404
+    assert api.get('/series/99').status == 404
+    assert api.get('/series/1').json['name'] == 'Spider-Man'
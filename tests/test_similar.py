@@ -0,0 +1,91 @@
+import pytest
+
+from comic_manager import _normalise_name_trigrams, _trigrams
+
+
+def indexed(manager, index='publisher_trigrams'):
+    return [row[0] for row in manager.connect().execute(f'SELECT name FROM {index} ORDER BY rowid')]
+
+
+def test_names_are_indexed_as_queries_see_them(manager):
+    manager.add_publisher('Dark  Horse')
+    manager.add_publisher('\tImage\nComics ')
+    manager.update_publisher(1, 'Dark   Horse')
+
+    assert indexed(manager) == [' Dark Horse ', ' Image Comics ']
+    terms = {row[0] for row in manager.connect().execute('SELECT term FROM publisher_trigram_terms')}
+    assert _trigrams('Dark Horse') | _trigrams('Image Comics') == terms
+
+    matches = manager.find_similar('dark horse')
+    assert [(match.row_id, match.similarity) for match in matches] == [(1, 1.0)]
+
+
+def test_existing_indexes_are_rebuilt_normalised(legacy):
+    manager = legacy(_normalise_name_trigrams)
+    manager.add_publisher('Dark  Horse')
+    manager.add_volume(1)
+    manager.add_series('Hell\tboy', 1, 1)
+    assert indexed(manager) == [' Dark  Horse ']
+
+    manager.migrate()
+
+    assert indexed(manager) == [' Dark Horse ']
+    assert indexed(manager, 'series_trigrams') == [' Hell boy ']
+    manager.add_publisher('Image  Comics')
+    assert indexed(manager)[-1] == ' Image Comics '
+
+
+def test_similar_names_rank_closest_first(manager):
+    for name in ('Marvel Comics', 'Marvel', 'Marvell Comics', 'DC Comics', 'Dark Horse'):
+        manager.add_publisher(name)
+
+    matches = manager.find_similar('Marvel Comics')
+
+    assert [match.name for match in matches][:2] == ['Marvel Comics', 'Marvell Comics']
+    assert matches[0].similarity == 1.0
+    assert all(a.similarity >= b.similarity for a, b in zip(matches, matches[1:]))
+    assert 'Dark Horse' not in [match.name for match in matches]
+    assert [match.name for match in manager.find_similar('Marvel Comics', threshold=0.9)] == ['Marvel Comics']
+    assert manager.find_similar('') == []
+    with pytest.raises(ValueError):
+        manager.find_similar('Marvel', table='comic')
+
+
+def test_merging_series_moves_their_comics(manager, catalogue):
+    manager.add_series('Spider Man', 1, 1)
+    duplicate = manager.add_series('Spiderman', 1, 1)
+    manager.add_comics_bulk((duplicate, issue, 3.99) for issue in (1, 21, 22))
+
+    assert {match.row_id for match in manager.find_similar('Spider-Man', table='series')} == {1, 3, 4}
+    assert manager.merge_series(1, [duplicate, 3, duplicate, 1]) == 3
+
+    assert manager.get_series(duplicate) is None and manager.get_series(3) is None
+    issues = [row[0] for row in manager.connect().execute('SELECT issue_num FROM comic WHERE series_id = 1')]
+    # Issue 1 of both series is kept
+    assert sorted(issues) == [1, 1] + list(range(2, 23))
+    assert [match.row_id for match in manager.find_similar('Spiderman', table='series')] == [1]
+    assert manager.merge_series(1, [1]) == 0
+    with pytest.raises(ValueError):
+        manager.merge_series(99, [2])
+    assert manager.get_series(2) is not None
+
+
+def test_merging_over_the_api(api, manager, catalogue):
+    manager.add_publisher('Marvel Comics')
+    manager.add_series('X-Men', 1, 3)
+    manager.add_user('editor', 'secret')
+    manager.connect().execute("UPDATE user SET clearance_level = 4 WHERE username = 'editor'")
+    manager.connect().commit()
+    reader = api.login('reader', 'secret')
+    editor = api.login('editor', 'secret')
+
+    similar = api.get('/publishers/similar?name=marvel%20comics').json['items']
+    assert similar[0] == {'id': 3, 'name': 'Marvel Comics', 'similarity': 1.0}
+    assert api.request('POST', '/publishers/1/merge', {'ids': [3]}, token=reader).status == 403
+    assert api.request('POST', '/publishers/99/merge', {'ids': [3]}, token=editor).status == 404
+    merged = api.request('POST', '/publishers/1/merge', {'ids': [3]}, token=editor)
+    assert merged.json == {'publisher_id': 1, 'series_moved': 1}
+    assert api.get('/series/3').json['publisher_id'] == 1
+    assert api.request('POST', '/series/99/merge', {'ids': [3]}, token=editor).status == 404
+    assert api.request('POST', '/series/1/merge', {'ids': [3]}, token=editor).json['comics_moved'] == 0
+    assert api.get('/series/3').status == 404
@@ -0,0 +1,73 @@
+# The materialized value summary must agree with collection_value() after
+# every kind of write its triggers cover
+import pytest
+
+
+@pytest.fixture
+def collectors(manager, catalogue):
+    manager.add_user('other', 'secret')
+    other = manager.authenticate('other', 'secret')[0]
+    manager.add_to_collection(1, user_id=other, quantity=2)
+    manager.add_to_collection(30, user_id=other)
+    manager.enable_value_summary()
+    return catalogue, other
+
+
+def assert_summary_current(manager, *users):
+    for user_id in users:
+        assert manager.value_summary(user_id) == manager.collection_value(user_id)
+
+
+def test_summary_starts_from_the_existing_collection(manager, collectors):
+    reader, other = collectors
+
+    assert manager.value_summary(reader) == (4, 15.96, 15.96, 0.0)
+    assert_summary_current(manager, reader, other)
+
+
+def test_summary_follows_collection_writes(manager, collectors):
+    reader, other = collectors
+
+    manager.add_to_collection(3, user_id=reader, quantity=3)
+    assert_summary_current(manager, reader, other)
+    manager.add_to_collection(3, user_id=reader)
+    collection_id = manager.add_to_collection(4, user_id=reader)
+    assert_summary_current(manager, reader, other)
+    manager.update_collection(collection_id, quantity=5, user_id=reader)
+    assert_summary_current(manager, reader, other)
+    manager.delete_collection(collection_id, quantity=2, user_id=reader)
+    assert_summary_current(manager, reader, other)
+    manager.delete_collection(collection_id, user_id=reader)
+    assert_summary_current(manager, reader, other)
+    assert manager.value_summary(reader)[0] == 8
+
+
+def test_summary_follows_price_changes(manager, collectors):
+    reader, other = collectors
+
+    manager.update_comic(1, current_price=25.5)
+    assert_summary_current(manager, reader, other)
+    assert manager.value_summary(other)[3] == 43.02
+    manager.refresh_prices([(1, 30.0), (21, 2.5)])
+    assert_summary_current(manager, reader, other)
+    manager.update_comic(1, cover_price=1.0)
+    assert_summary_current(manager, reader, other)
+    # Without a current price a comic is valued at its cover price again
+    manager.connect().execute('UPDATE comic SET current_price = NULL WHERE comic_id = 1')
+    manager.connect().commit()
+    assert_summary_current(manager, reader, other)
+
+
+def test_summary_follows_deletes(manager, collectors):
+    reader, other = collectors
+
+    manager.delete_comic(1)
+    assert_summary_current(manager, reader, other)
+    manager.delete_series(2)
+    assert_summary_current(manager, reader, other)
+    assert manager.value_summary(other) == (0, 0.0, 0.0, 0.0)
+
+    manager.delete_user(reader)
+    assert manager.connect().execute(
+        'SELECT comics FROM collection_value_summary WHERE user_id = ?', (reader,)
+    ).fetchone() in (None, (0,))
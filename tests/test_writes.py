@@ -0,0 +1,52 @@
+# Failed writes must not leave a transaction open on the Manager's persistent
+# per-thread connection, or every later write from any connection is locked out
+import sqlite3
+
+import pytest
+
+from comic_manager import Manager
+
+
+@pytest.fixture
+def catalogue(manager):
+    manager.add_volume(1)
+    manager.add_publisher('Marvel')
+    manager.add_series('Spider-Man', 1, 1)
+    return manager
+
+
+def assert_unlocked(manager):
+    assert not manager.connect().in_transaction
+    # Another connection can still take the write lock
+    with Manager(manager.db_name, {'busy_timeout': 0}) as other:
+        other.add_publisher('DC')
+
+
+def test_a_foreign_key_failure_is_rolled_back(catalogue):
+    with pytest.raises(sqlite3.IntegrityError):
+        catalogue.add_comic(999, 1, 3.99)
+    assert_unlocked(catalogue)
+
+
+def test_a_restricted_delete_is_rolled_back(catalogue):
+    with pytest.raises(sqlite3.IntegrityError):
+        catalogue.delete_volume(1)
+    assert_unlocked(catalogue)
+
+
+@pytest.mark.parametrize('delete', ['delete_volume', 'delete_publisher'])
+def test_other_errors_are_rolled_back_too(catalogue, delete):
+    catalogue.add_volume(2)
+    catalogue.add_publisher('Image')
+    conn = catalogue.connect()
+    for table in ('volume', 'publisher'):
+        # Fails partway through the delete with an error other than a constraint
+        conn.execute(f'''
+            CREATE TEMP TRIGGER fail_{table} AFTER DELETE ON {table} BEGIN
+                SELECT abs(-9223372036854775807 - 1);
+            END
+        ''')
+
+    with pytest.raises(sqlite3.OperationalError):
+        getattr(catalogue, delete)(2)
+    assert_unlocked(catalogue)